@@ -1,30 +1,97 @@
-import gradio as gr
 import os
 from dotenv import load_dotenv
-import openai
-from openai import AsyncOpenAI
 import asyncio
+import gzip
 import json
+import tempfile
 import time
+from contextlib import aclosing, asynccontextmanager
 from datetime import datetime
-from typing import List, Dict, Any
+
+from assets import STATIC_DIR, STATIC_URL, avatar_images, load_css
+from chat_log import CHAT_LOG_PATH, ChatLog
+from chat_view import ChatView
+from compact_history import prompt_table
+from client_pool import ClientPool, key_fingerprint
+from coalescing import COALESCE_ENABLED, SingleFlight, flight_key
+from context_window import MESSAGE_OVERHEAD_TOKENS, PROMPT_TRIM_CHUNK, count_tokens, prompt_budget
+from response_cache import RESPONSE_CACHE_ENABLED, SEMANTIC_CACHE_ENABLED, OpenAIEmbedder, ResponseCache
+from prefetch import PREFETCH_ENABLED, FirstTurnPrefetcher
+from metrics import PROMPT_PREFIX_RESETS, SUMMARY_FAILURES, RequestSpan, model_stats, registry as metrics_registry, status_summary
+from resilience import ResilientStreamer
+from router import BackendUnavailable, ModelRouter, load_backends
+from scheduler import AdmissionController
+from sessions import SessionState, SessionStore
+from startup import PhaseTimer, import_breakdown, print_report, warm_imports
+from state_store import create_backend
+from streaming import STREAM_FLUSH_INTERVAL, coalesce_deltas
+from transforms import load_pipeline
+from tools import ToolEngine, load_tools
+from summarizer import OpenAISummarizer
 
 # Load environment variables
 load_dotenv()
 
+# Gradio's usage analytics make network calls during startup
+os.environ.setdefault("GRADIO_ANALYTICS_ENABLED", "False")
+
 # Initialize client with API key from environment
 initial_api_key = os.getenv("OPENAI_API_KEY")
 
-# Global variables
-current_api_key = initial_api_key
-current_model = "gpt-4o-mini"
-client = None
-conversation_history = []
-system_prompt = "You are a helpful, creative, and intelligent AI assistant. You provide accurate, detailed, and engaging responses while being friendly and professional."
+# OpenAI-compatible backends (MODEL_BACKENDS) and the latency-aware router choosing between them
+model_router = ModelRouter(load_backends())
+metrics_registry.register("chat_backend", model_router)
+
+DEFAULT_MODEL = model_router.models()[0]
+
+# Models one compare request may fan out to
+COMPARE_MAX_MODELS = int(os.getenv("COMPARE_MAX_MODELS", "4"))
+
+# Exports are written here rather than the working directory
+EXPORT_DIR = os.getenv("EXPORT_DIR", tempfile.gettempdir())
+
+# Per-session conversation state, keyed by Gradio session hash; STATE_BACKEND=sqlite shares it between workers
+session_store = SessionStore(backend=create_backend())
+
+# AsyncOpenAI clients shared across sessions, keyed by API key hash
+client_pool = ClientPool()
+
+# Global concurrency limit, per-key rate limits and fair queueing of chat requests
+scheduler = AdmissionController()
+
+# Persistent conversation log, written in batches by a background thread
+chat_log = ChatLog() if CHAT_LOG_PATH else None
+
+# Streams stopped early and the completion tokens that were not generated as a result
+cancellation_stats = {"cancelled": 0, "tokens_saved": 0}
+
+# Retry with jittered backoff before the first token, optionally hedging slow first tokens
+resilient_streamer = ResilientStreamer()
+
+# Exact (and optionally semantic) response cache in front of the completions API
+response_cache = ResponseCache() if RESPONSE_CACHE_ENABLED else None
+
+# Sent as the seed of every completion request when set, making answers reproducible at any temperature
+REQUEST_SEED = int(os.getenv("REQUEST_SEED")) if os.getenv("REQUEST_SEED") else None
 
-# Initialize client if API key is available
-if initial_api_key:
-    client = AsyncOpenAI(api_key=initial_api_key)
+# Identical deterministic requests in flight at the same time share one upstream stream
+single_flight = SingleFlight() if COALESCE_ENABLED else None
+if single_flight is not None:
+    metrics_registry.register("chat_coalesce", single_flight)
+
+# Streaming post-processing of answers before they reach the UI (TRANSFORMS: redaction, code fence repair)
+output_pipeline = load_pipeline()
+if output_pipeline is not None:
+    metrics_registry.register("chat_transform", output_pipeline)
+
+# Local tools (calculator, file search, SQLite queries) the personas in TOOL_PERSONAS can call
+tool_registry = load_tools()
+tool_engine = ToolEngine(tool_registry) if tool_registry is not None else None
+if tool_engine is not None:
+    metrics_registry.register("chat_tools", tool_engine)
+
+# Builds the summarizer used by rolling summary mode (ROLLING_SUMMARY=1); swap for an offline stub in tests
+summarizer_factory = OpenAISummarizer
 
 # Predefined system prompts
 # Constants for system prompt choices
@@ -41,129 +108,530 @@ SYSTEM_PROMPTS = {
     "Travel Guide": "You are a travel expert. Provide destination recommendations, travel tips, cultural insights, and help plan memorable trips around the world.",
     "Tech Support": "You are a technical support specialist. Help troubleshoot technology issues, explain technical concepts simply, and provide step-by-step solutions.",
 }
+# Sessions hold an id for these instead of a copy; custom prompts stay with their session
+prompt_table.register(SYSTEM_PROMPTS.values())
 
-async def get_openai_response_stream(messages, model="gpt-4o-mini", temperature=0.7, max_tokens=2000):
-    """Get streaming response from OpenAI API"""
+def resolve_system_prompt(choice, custom_system_prompt=""):
+    """System prompt for a persona choice; the custom prompt when "Custom" is chosen and not blank"""
+    if choice == CUSTOM_PROMPT and custom_system_prompt and custom_system_prompt.strip():
+        return custom_system_prompt.strip()
+    return SYSTEM_PROMPTS.get(choice, SYSTEM_PROMPTS[DEFAULT_ASSISTANT])
+
+async def stream_completion(client, messages, model, temperature, max_tokens, span=None, seed=None, tools=None):
+    """Stream content deltas from the chat completions API; errors propagate
+
+    With tools, the tool call deltas of the response are yielded too, as the SDK's objects.
+    """
+    if span is not None:
+        span.request_started()
+    stream = await client.chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        stream=True,
+        stream_options={"include_usage": True},
+        **({"seed": seed} if seed is not None else {}),
+        **({"tools": tools} if tools else {})
+    )
+    
     try:
-        stream = await client.chat.completions.create(
-            model=model,
-            messages=messages,
-            temperature=temperature,
-            max_tokens=max_tokens,
-            stream=True
-        )
-        
-        full_response = ""
         async for chunk in stream:
-            if chunk.choices[0].delta.content is not None:
-                content = chunk.choices[0].delta.content
-                full_response += content
-                yield full_response
-    except Exception as e:
-        yield f"Error: {str(e)}"
+            if chunk.choices and chunk.choices[0].delta.content:
+                if span is not None:
+                    span.token()
+                yield chunk.choices[0].delta.content
+            elif chunk.choices and chunk.choices[0].delta.tool_calls:
+                for tool_call in chunk.choices[0].delta.tool_calls:
+                    yield tool_call
+            elif chunk.usage is not None and span is not None:
+                details = getattr(chunk.usage, "prompt_tokens_details", None)
+                span.usage(chunk.usage.prompt_tokens, chunk.usage.completion_tokens, getattr(details, "cached_tokens", None))
+    finally:
+        # Close the HTTP response right away when the consumer stops early
+        await stream.close()
+
+def backend_client(backend, api_key):
+    """Pooled client for a backend, using its configured key or else the user's"""
+    client = client_pool.get(backend.api_key or api_key, base_url=backend.base_url)
+    if client is None:
+        raise BackendUnavailable(f"Backend {backend.name!r} needs an OpenAI API key")
+    return client
 
-def update_conversation_history(user_msg, assistant_msg, system_msg):
-    """Update the global conversation history"""
-    global conversation_history
+def upstream_stream(messages, model, temperature, max_tokens, api_key=None, span=None, tools=None):
+    """Deltas from the routed backend; the router fails over between backends, retries (and optional hedging) wrap it"""
+    def open_backend(backend):
+        return stream_completion(backend_client(backend, api_key), messages, model, temperature, max_tokens, span, REQUEST_SEED, tools)
     
-    # Add system message if it's the first message or changed
-    if not conversation_history or conversation_history[0]["content"] != system_msg:
-        conversation_history = [{"role": "system", "content": system_msg}]
+    return resilient_streamer.stream(lambda: model_router.stream(model, open_backend))
+
+async def warm_connections():
+    """Open a pooled connection to every backend so the next request skips connection setup"""
+    async def warm(backend):
+        client = client_pool.get(backend.api_key or initial_api_key, base_url=backend.base_url)
+        if client is not None:
+            try:
+                await client.models.list()
+            except Exception:
+                pass
     
-    # Add user and assistant messages
-    conversation_history.append({"role": "user", "content": user_msg})
-    conversation_history.append({"role": "assistant", "content": assistant_msg})
+    await asyncio.gather(*(warm(backend) for backend in model_router.backends))
+
+async def coalesced_stream(key, messages, model, temperature, max_tokens, span=None, api_key=None):
+    """Deltas of the shared flight for key, timed on this request's span as they are forwarded to it
+
+    Only the request that started the flight is charged its token usage, so a
+    shared answer's cost is counted once.
+    """
+    # Receives the upstream marks and usage; each request's own span is what gets recorded
+    upstream_span = RequestSpan(model)
+    started = False
+
+    def start():
+        nonlocal started
+        started = True
+        return upstream_stream(messages, model, temperature, max_tokens, api_key, upstream_span)
+
+    if span is not None:
+        span.request_started()
+    deltas = single_flight.stream(key, start)
+    async with aclosing(deltas):
+        async for delta in deltas:
+            if span is not None:
+                span.token()
+            yield delta
+    if started and span is not None and upstream_span.prompt_tokens is not None:
+        span.usage(upstream_span.prompt_tokens, upstream_span.completion_tokens, upstream_span.cached_tokens)
+
+def response_stream(messages, model, temperature, max_tokens, client=None, span=None, api_key=None, use_tools=False):
+    """Deltas from the response cache, an identical in-flight request, or else the routed, retried upstream call; errors propagate"""
+    if use_tools:
+        # Answers made with local tools depend on local state, so they are neither cached nor shared
+        return tool_engine.run(messages, lambda round_messages, tools: upstream_stream(round_messages, model, temperature, max_tokens, api_key, span, tools))
+    def producer():
+        if single_flight is not None and single_flight.eligible(temperature, REQUEST_SEED):
+            # Keyed by API key too, so one user's failing key never fails another user's answer
+            key = flight_key(model, messages, temperature, max_tokens, REQUEST_SEED, key_fingerprint(api_key) if api_key else None)
+            return coalesced_stream(key, messages, model, temperature, max_tokens, span, api_key)
+        return upstream_stream(messages, model, temperature, max_tokens, api_key, span)
     
-    # Keep only last 20 messages (plus system prompt) to manage context length
-    if len(conversation_history) > 41:  # 1 system + 40 messages
-        conversation_history = conversation_history[:1] + conversation_history[-40:]
+    if response_cache is None:
+        return producer()
+    embedder = OpenAIEmbedder(client) if SEMANTIC_CACHE_ENABLED and client is not None else None
+    return response_cache.stream(messages, model, temperature, max_tokens, producer, REQUEST_SEED, embedder=embedder)
+
+async def get_openai_response_stream(messages, model="gpt-4o-mini", temperature=0.7, max_tokens=2000, client=None, span=None, api_key=None, use_tools=False):
+    """Get streaming response from the routed backend, yielding only the new text of each chunk
+
+    With use_tools the model may call local tools (see response_stream).
+    """
+    emitted = False
+    try:
+        deltas = response_stream(messages, model, temperature, max_tokens, client, span, api_key, use_tools)
+        async with aclosing(deltas):
+            async for delta in deltas:
+                emitted = True
+                yield delta
+    except Exception as e:
+        if span is not None:
+            span.error = True
+        prefix = "\n\n" if emitted else ""
+        yield f"{prefix}Error: {str(e)}"
+
+# Answers to frequent opening questions per persona, generated ahead of time into the response cache (PREFETCH=1)
+prefetcher = None
+if PREFETCH_ENABLED and response_cache is not None and chat_log is not None:
+    prefetcher = FirstTurnPrefetcher(
+        response_cache, chat_log,
+        lambda messages, model, temperature, max_tokens: upstream_stream(messages, model, temperature, max_tokens, initial_api_key),
+        SYSTEM_PROMPTS, warm=warm_connections, seed=REQUEST_SEED,
+    )
+
+# Local document index grounding selected personas (RAG_INDEX_PATH, see retrieval.py); needs numpy
+retriever = None
+if os.getenv("RAG_INDEX_PATH"):
+    from retrieval import Retriever
+    retriever = Retriever()
 
-async def chat_response_stream(message, history, api_key, model, temperature, max_tokens, system_prompt_choice, custom_system_prompt):
+SESSION_DEFAULTS = {"api_key": initial_api_key, "model": DEFAULT_MODEL, "system_prompt": SYSTEM_PROMPTS[DEFAULT_ASSISTANT]}
+
+def get_session(session_id):
+    """Get the conversation state for a Gradio session"""
+    return session_store.get(session_id, **SESSION_DEFAULTS)
+
+async def aget_session(session_id):
+    """get_session() for coroutines: shared state is loaded off the event loop"""
+    return await session_store.aget(session_id, **SESSION_DEFAULTS)
+
+def restore_session_history(session, history):
+    """Re-seed a session whose state was evicted from the messages still shown in the UI"""
+    if session.history or not history:
+        return
+    for msg in history:
+        if msg.get("role") in ("user", "assistant") and isinstance(msg.get("content"), str):
+            session.add_message(msg["role"], msg["content"])
+
+def build_messages(session, user_msg, max_tokens, client=None, context=None, reserve_tokens=0):
+    """Add the user turn to the session and assemble the newest messages that fit the model's budget
+
+    The layout keeps a stable prefix for upstream prompt caching: the fixed
+    system prompt, the rolling summary, then append-only history. History is
+    trimmed in chunks and the summary only republished at those trims, so
+    the prefix changes once per chunk rather than every turn. Per-turn
+    context (retrieved documents) goes right before the newest user message,
+    within reserve_tokens held back from the history budget.
+    """
+    session.add_message("user", user_msg)
+    budget = prompt_budget(session.model, int(max_tokens)) - count_tokens(session.system_prompt, session.model) - MESSAGE_OVERHEAD_TOKENS - reserve_tokens
+    summary = session.summary
+    prefix_changed = False
+    if summary is not None:
+        if session.history.tokens > budget - summary.tokens:
+            # The prefix changes at this trim anyway, so switch to the newest summary too
+            prefix_changed = summary.publish()
+        budget -= summary.tokens
+    dropped = session.history.trim(budget, int(budget * PROMPT_TRIM_CHUNK))
+    if dropped or prefix_changed:
+        PROMPT_PREFIX_RESETS.inc()
+    
+    messages = [{"role": "system", "content": session.system_prompt}]
+    if summary is not None:
+        if dropped:
+            # Evicted turns are folded into the summary in the background; the current one goes out now
+            try:
+                summarizer = summarizer_factory(client)
+            except ValueError:
+                # No client to summarize with (a backend with its own key and none entered in the UI)
+                SUMMARY_FAILURES.inc(len(dropped))
+            else:
+                summary.schedule(dropped, summarizer, session.model)
+        summary_message = summary.as_message()
+        if summary_message:
+            messages.append(summary_message)
+            summary.record_turn()
+    messages.extend(session.history.as_messages())
+    if context is not None:
+        messages.insert(len(messages) - 1, context)
+    return messages
+
+async def retrieve_context(system_prompt_choice, message, model):
+    """Retrieved documents for grounded personas as (context message or None, tokens reserved for it)"""
+    if retriever is None or not retriever.applies_to(system_prompt_choice):
+        return None, 0
+    # Grounded personas always reserve the same share of the budget, so trimming does not depend on what is found
+    try:
+        context = await asyncio.to_thread(retriever.retrieve, message, model)
+    except Exception:
+        context = None
+    return context, retriever.max_tokens
+
+def update_conversation_history(session, assistant_msg):
+    """Record the assistant reply in the session's conversation history"""
+    session.add_message("assistant", assistant_msg)
+
+async def chat_response_stream(message, history, api_key, model, temperature, max_tokens, system_prompt_choice, custom_system_prompt, session_id=None):
     """Handle streaming chat response"""
-    global client, current_api_key, current_model, system_prompt
-    
-    # Update API key if provided and different
-    if api_key and api_key.strip() != current_api_key:
-        current_api_key = api_key.strip()
-        if current_api_key:
-            client = AsyncOpenAI(api_key=current_api_key)
-        else:
-            client = None
-    elif not api_key and current_api_key:
-        current_api_key = None
-        client = None
-
-    # Check if client exists
-    if client is None:
+    session = await aget_session(session_id)
+    
+    span = RequestSpan()
+    
+    # Update API key; clients come from the shared pool so a key change never opens a new connection pool
+    session.api_key = api_key.strip() if api_key else None
+    acquire_started = time.perf_counter()
+    client = client_pool.get(session.api_key)
+    span.client_acquired(acquire_started)
+
+    # Check if client exists; backends with their own key (e.g. local servers) work without one
+    if client is None and all(b.api_key is None for b in model_router.backends_for(model)):
         history.append({"role": "user", "content": message})
         history.append({"role": "assistant", "content": "🔑 Please provide your OpenAI API key to start the conversation."})
         yield history, ""
+        return
     
     # Update model
-    current_model = model
+    session.model = model
+    session.history.model = model
+    span.model = model
     
     # Update system prompt
-    if system_prompt_choice == "Custom" and custom_system_prompt.strip():
-        system_prompt = custom_system_prompt.strip()
-    else:
-        system_prompt = SYSTEM_PROMPTS.get(system_prompt_choice, SYSTEM_PROMPTS["Default Assistant"])
+    session.system_prompt = resolve_system_prompt(system_prompt_choice, custom_system_prompt)
     
     if not message.strip():
         history.append({"role": "user", "content": message})
         history.append({"role": "assistant", "content": "⚠️ Please enter a message to continue our conversation."})
         yield history, ""
+        return
+    
+    # A new message from the same session stops the reply still streaming for it
+    cancel_event = session.start_run()
     
-    # Add user message to history
+    # Prepare messages for API from the session's token-budgeted context, not the full UI history
+    restore_session_history(session, history)
+    context, reserve_tokens = await retrieve_context(system_prompt_choice, message, session.model)
+    messages = build_messages(session, message, max_tokens, client, context, reserve_tokens)
+    if prefetcher is not None:
+        prefetcher.record_first_turn(session.model, messages, temperature, int(max_tokens))
+    
+    # Add user message to history; this run only ever writes its own reply, since a resubmit appends a newer one
     history.append({"role": "user", "content": message})
-    history.append({"role": "assistant", "content": "🤔 Thinking..."})
+    reply = {"role": "assistant", "content": "🤔 Thinking..."}
+    history.append(reply)
     
-    # Prepare messages for API
-    messages = [{"role": "system", "content": system_prompt}]
-    for msg in history[:-1]:  # Exclude the "Thinking..." message
-        messages.append(msg)
+    # Wait for a concurrency slot and the key's rate limits, showing the queue position meanwhile
+    prompt_tokens = sum(count_tokens(m["content"], session.model) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+    ticket = scheduler.ticket(session.session_id, key_fingerprint(session.api_key or f"model:{session.model}"), prompt_tokens + int(max_tokens))
     
-    # Get streaming response
+    # Get streaming response; deltas are coalesced so the UI updates once per window, not per token
     full_response = ""
     try:
-        async for partial_response in get_openai_response_stream(messages, current_model, temperature, max_tokens):
-            full_response = partial_response
-            history[-1]["content"] = full_response
+        async with aclosing(ticket.wait(cancel_event)) as updates:
+            async for state, value in updates:
+                if state == "queue":
+                    reply["content"] = f"⏳ Waiting in queue (position {value})..."
+                else:
+                    reply["content"] = f"⏳ Rate limit reached, starting in {value:.0f}s..."
+                yield history, ""
+        span.admitted()
+        
+        if not cancel_event.is_set():
+            use_tools = tool_engine is not None and tool_engine.applies_to(system_prompt_choice)
+            deltas = get_openai_response_stream(messages, session.model, temperature, int(max_tokens), client=client, span=span, api_key=session.api_key, use_tools=use_tools)
+            if output_pipeline is not None:
+                deltas = output_pipeline.run(deltas)
+            async for delta in coalesce_deltas(deltas, cancel_event=cancel_event):
+                full_response += delta
+                reply["content"] = full_response
+                yield history, ""
+        
+        if cancel_event.is_set():
+            cancellation_stats["cancelled"] += 1
+            cancellation_stats["tokens_saved"] += max(0, int(max_tokens) - count_tokens(full_response, session.model))
+            reply["content"] = f"{full_response}\n\n⏹️ *Stopped*" if full_response else "⏹️ *Stopped*"
             yield history, ""
         
-        # Update conversation history for context
-        update_conversation_history(message, full_response, system_prompt)
+        # Update conversation history for context, unless a newer message superseded this one
+        if session.run is cancel_event:
+            update_conversation_history(session, full_response)
+        
+        # Logged as shown, so a stopped reply keeps its marker; one stopped before any text is not logged
+        if chat_log is not None and full_response:
+            chat_log.append(session.session_id, "user", message, system_prompt_choice, session.model)
+            chat_log.append(session.session_id, "assistant", reply["content"], system_prompt_choice, session.model)
         
     except Exception as e:
-        history[-1]["content"] = f"❌ Error: {str(e)}"
+        if session.run is cancel_event and session.history.last_role() == "user":
+            session.history.pop()
+        reply["content"] = f"❌ Error: {str(e)}"
         yield history, ""
+    finally:
+        ticket.release(prompt_tokens + count_tokens(full_response, session.model))
+        session.finish_run(cancel_event)
+        span.finish()
+        await session_store.asave(session)
+
+async def request_messages(prompt, system_prompt_choice=DEFAULT_ASSISTANT, custom_system_prompt="", model=None, max_tokens=2000, history=None):
+    """Messages for a one-off prompt, built as chat_response_stream builds them for a session with this history"""
+    model = model or DEFAULT_MODEL
+    session = SessionState(None, model=model, system_prompt=resolve_system_prompt(system_prompt_choice, custom_system_prompt), rolling_summary=False)
+    for msg in history or []:
+        if msg.get("role") in ("user", "assistant") and isinstance(msg.get("content"), str):
+            session.add_message(msg["role"], msg["content"])
+    context, reserve_tokens = await retrieve_context(system_prompt_choice, prompt, model)
+    return build_messages(session, prompt, max_tokens, context=context, reserve_tokens=reserve_tokens)
+
+async def complete(prompt, system_prompt_choice=DEFAULT_ASSISTANT, custom_system_prompt="", model=None, temperature=0.7, max_tokens=2000, history=None, api_key=None, queue_id="batch"):
+    """Run one prompt through the chat pipeline without the UI and return the reply with its token usage
 
-def clear_chat():
+    Requests wait for the scheduler like interactive ones; queue_id is the
+    fair-queueing identity, so a whole batch sharing one gets a single
+    session's share of the slots. Errors are raised rather than shown.
+    """
+    model = model or DEFAULT_MODEL
+    api_key = api_key or initial_api_key
+    client = client_pool.get(api_key)
+    if client is None and all(b.api_key is None for b in model_router.backends_for(model)):
+        raise BackendUnavailable("An OpenAI API key is needed for this model")
+    messages = await request_messages(prompt, system_prompt_choice, custom_system_prompt, model, max_tokens, history)
+    
+    span = RequestSpan(model)
+    prompt_tokens = sum(count_tokens(m["content"], model) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+    ticket = scheduler.ticket(queue_id, key_fingerprint(api_key or f"model:{model}"), prompt_tokens + int(max_tokens))
+    parts = []
+    try:
+        async with aclosing(ticket.wait()) as updates:
+            async for _ in updates:
+                pass
+        span.admitted()
+        use_tools = tool_engine is not None and tool_engine.applies_to(system_prompt_choice)
+        deltas = response_stream(messages, model, temperature, int(max_tokens), client, span, api_key, use_tools)
+        if output_pipeline is not None:
+            deltas = output_pipeline.run(deltas)
+        async with aclosing(deltas):
+            async for delta in deltas:
+                parts.append(delta)
+    except Exception:
+        span.error = True
+        raise
+    finally:
+        ticket.release(prompt_tokens + count_tokens("".join(parts), model))
+        span.finish()
+    return {
+        "output": "".join(parts),
+        "usage": {"prompt_tokens": span.prompt_tokens, "completion_tokens": span.completion_tokens, "cached_tokens": span.cached_tokens},
+    }
+
+def render_comparison(model, text, span, error=None):
+    """One model's column in compare mode: measured figures, then its answer so far"""
+    figures = []
+    ttft = span.ttft()
+    if ttft is not None:
+        figures.append(f"TTFT {ttft:.2f} s")
+    tokens_per_second = span.tokens_per_second()
+    if tokens_per_second is not None:
+        figures.append(f"{tokens_per_second:.0f} tok/s")
+    cost = span.cost() if span.prompt_tokens is not None else None
+    if cost is not None:
+        figures.append(f"${cost:.5f}")
+    header = f"### {model}\n" + (f"*{' · '.join(figures)}*\n\n" if figures else "\n")
+    if error is not None:
+        return f"{header}{text}\n\n❌ Error: {error}" if text else f"{header}❌ Error: {error}"
+    return header + (text or "⏳ Waiting for the first token...")
+
+async def compare_models_stream(message, models, api_key, temperature, max_tokens, system_prompt_choice, custom_system_prompt, history=None, session_id=None):
+    """Send the same prompt to several models at once, yielding their rendered answers side by side as they stream
+
+    Each model gets the messages the chat would send it (same persona and
+    conversation so far, trimmed to its own context window) and waits for
+    the scheduler like any request. The response cache is bypassed so the
+    timings are real; they also feed the per-model stats. Answers are not
+    added to the conversation.
+    """
+    api_key = api_key.strip() if api_key else None
+    client = client_pool.get(api_key)
+    models = list(dict.fromkeys(models))[:COMPARE_MAX_MODELS]
+    spans = [RequestSpan(model) for model in models]
+    texts = [""] * len(models)
+    errors = [None] * len(models)
+    done = [False] * len(models)
+    changed = asyncio.Event()
+
+    async def run(index):
+        model, span = models[index], spans[index]
+        ticket = None
+        prompt_tokens = 0
+        try:
+            if client is None and all(b.api_key is None for b in model_router.backends_for(model)):
+                raise BackendUnavailable("An OpenAI API key is needed for this model")
+            messages = await request_messages(message, system_prompt_choice, custom_system_prompt, model, max_tokens, history)
+            prompt_tokens = sum(count_tokens(m["content"], model) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+            ticket = scheduler.ticket(session_id or "compare", key_fingerprint(api_key or f"model:{model}"), prompt_tokens + int(max_tokens))
+            async with aclosing(ticket.wait()) as updates:
+                async for _ in updates:
+                    pass
+            span.admitted()
+            deltas = upstream_stream(messages, model, temperature, int(max_tokens), api_key, span)
+            if output_pipeline is not None:
+                deltas = output_pipeline.run(deltas)
+            async with aclosing(deltas):
+                async for delta in deltas:
+                    texts[index] += delta
+                    changed.set()
+        except Exception as e:
+            span.error = True
+            errors[index] = str(e)
+        finally:
+            if ticket is not None:
+                ticket.release(prompt_tokens + count_tokens(texts[index], model))
+            span.finish()
+            done[index] = True
+            changed.set()
+
+    tasks = [asyncio.create_task(run(index)) for index in range(len(models))]
+    try:
+        yield [render_comparison(models[i], texts[i], spans[i], errors[i]) for i in range(len(models))]
+        while not all(done):
+            await changed.wait()
+            # One UI update per flush window for all columns together
+            await asyncio.sleep(STREAM_FLUSH_INTERVAL)
+            changed.clear()
+            yield [render_comparison(models[i], texts[i], spans[i], errors[i]) for i in range(len(models))]
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+def clear_chat(session_id=None):
     """Clear the chat history and conversation memory"""
-    global conversation_history
-    conversation_history = []
+    session = get_session(session_id)
+    session.clear()
+    session_store.save(session)
     return []
 
-def export_conversation(history):
-    """Export conversation as JSON"""
+def write_history_export(path, header, history):
+    """Write the UI history as gzip JSONL when no persistent log is configured"""
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        f.write(json.dumps(header, ensure_ascii=False) + "\n")
+        for msg in history:
+            f.write(json.dumps(msg, ensure_ascii=False) + "\n")
+
+async def export_conversation(history, session_id=None):
+    """Export conversation as gzip-compressed JSONL, streamed from the chat log off the event loop"""
     if not history:
         return None
     
-    export_data = {
+    session = await aget_session(session_id)
+    header = {
         "timestamp": datetime.now().isoformat(),
-        "model": current_model,
-        "system_prompt": system_prompt,
-        "conversation": history
+        "session_id": session.session_id,
+        "model": session.model,
+        "system_prompt": session.system_prompt
     }
     
-    filename = f"conversation_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-    with open(filename, 'w', encoding='utf-8') as f:
-        json.dump(export_data, f, indent=2, ensure_ascii=False)
+    filename = os.path.join(EXPORT_DIR, f"conversation_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{session.session_id[:8]}.jsonl.gz")
+    if chat_log is None:
+        await asyncio.to_thread(write_history_export, filename, header, history)
+    else:
+        await asyncio.to_thread(chat_log.flush)
+        await asyncio.to_thread(chat_log.export, filename, session.session_id, header=header)
     
     return filename
 
-def get_status_info():
+def get_status_info(session_id=None):
     """Get current status information"""
-    status = f"🟢 **Active** | Model: {current_model} | Messages: {len(conversation_history)} | Time: {datetime.now().strftime('%H:%M:%S')}"
+    session = session_store.peek(session_id)
+    model = session.model if session else DEFAULT_MODEL
+    messages = session.message_count() if session else 0
+    stats = session_store.stats()
+    status = (
+        f"🟢 **Active** | Model: {model} | Messages: {messages} | "
+        f"Sessions: {stats['sessions']} (evicted {stats['evictions']}) | Time: {datetime.now().strftime('%H:%M:%S')}"
+    )
+    queue_stats = scheduler.stats()
+    status += f" | Streams: {queue_stats['active']} active, {queue_stats['queue_depth']} queued (p95 wait {queue_stats['wait_p95']:.1f}s)"
+    if cancellation_stats["cancelled"]:
+        status += f" | Stopped: {cancellation_stats['cancelled']} (~{cancellation_stats['tokens_saved']} tokens saved)"
+    if response_cache is not None:
+        cache_stats = response_cache.stats()
+        status += f" | Cache hit rate: {cache_stats['hit_rate']:.0%} ({cache_stats['entries']} cached)"
+    if single_flight is not None and single_flight.coalesced:
+        status += f" | Coalesced: {single_flight.coalesced} requests shared an in-flight answer"
+    if prefetcher is not None and prefetcher.first_turns:
+        prefetch_stats = prefetcher.stats()
+        status += f" | Prefetch hit rate: {prefetch_stats['hit_rate']:.0%} ({prefetch_stats['entries']} ready)"
+    if retriever is not None and retriever.queries:
+        rag_stats = retriever.stats()
+        status += f" | Documents used in {rag_stats['hits']}/{rag_stats['queries']} answers"
+    if session is not None and session.summary is not None and session.summary.saved_tokens:
+        status += f" | Summary saved {session.summary.saved_tokens} prompt tokens"
+    if len(model_router.backends) > 1:
+        routes = ", ".join(
+            f"{name} {'⛔' if b['open'] else ''}{b['ttft'] * 1000:.0f} ms" if b["ttft"] is not None else f"{name} –"
+            for name, b in model_router.stats().items()
+        )
+        status += f" | Backends: {routes}"
+    latency = status_summary()
+    if latency:
+        status += f" | {latency}"
     return status
 
 def get_model_info(model):
@@ -175,460 +643,427 @@ def get_model_info(model):
         "gpt-4o": "✨ **GPT-4o** - Optimized for conversation with multimodal capabilities.",
         "gpt-4o-mini": "💫 **GPT-4o Mini** - Lightweight version of GPT-4o. Great balance of speed and capability."
     }
-    return model_info.get(model, "📋 Model information not available.")
-
-# Enhanced CSS with ChatGPT-like styling
-custom_css = """
-@import url('https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700&display=swap');
-
-:root {
-    --primary-color: #10a37f;
-    --primary-hover: #0d8d6c;
-    --secondary-color: #f7f7f8;
-    --accent-color: #0066cc;
-    --success-color: #10a37f;
-    --warning-color: #ff9500;
-    --error-color: #ff3333;
-    --background-primary: #ffffff;
-    --background-secondary: #f7f7f8;
-    --background-chat: #ffffff;
-    --text-primary: #2d3748;
-    --text-secondary: #4a5568;
-    --text-light: #718096;
-    --border-color: #e2e8f0;
-    --shadow-primary: 0 2px 8px rgba(0, 0, 0, 0.1);
-    --shadow-secondary: 0 1px 3px rgba(0, 0, 0, 0.1);
-}
-
-* {
-    font-family: 'Inter', -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
-}
-
-.gradio-container {
-    background: var(--background-primary);
-    color: var(--text-primary);
-    min-height: 100vh;
-}
-
-/* Header styling */
-.header {
-    background: linear-gradient(135deg, var(--primary-color) 0%, var(--accent-color) 100%);
-    color: white;
-    padding: 20px;
-    text-align: center;
-    border-radius: 0 0 20px 20px;
-    margin-bottom: 20px;
-    box-shadow: var(--shadow-primary);
-}
-
-.header h1 {
-    font-size: 2.5em;
-    font-weight: 700;
-    margin: 0;
-    text-shadow: 0 2px 4px rgba(0, 0, 0, 0.1);
-}
-
-.header p {
-    font-size: 1.1em;
-    margin: 10px 0 0 0;
-    opacity: 0.9;
-}
-
-/* Settings panel styling */
-.settings-panel {
-    background: var(--background-secondary);
-    border: 1px solid var(--border-color);
-    border-radius: 12px;
-    padding: 20px;
-    margin-bottom: 20px;
-    box-shadow: var(--shadow-secondary);
-}
-
-.settings-panel h3 {
-    color: var(--text-primary);
-    margin-top: 0;
-    margin-bottom: 15px;
-    font-weight: 600;
-}
-
-/* Chat container styling */
-.chat-container {
-    background: var(--background-chat);
-    border: 1px solid var(--border-color);
-    border-radius: 12px;
-    box-shadow: var(--shadow-secondary);
-    overflow: hidden;
-}
-
-/* Status bar styling */
-.status-bar {
-    background: linear-gradient(135deg, var(--success-color), var(--accent-color));
-    color: white;
-    padding: 10px 15px;
-    border-radius: 8px;
-    margin: 10px 0;
-    font-size: 0.9em;
-    font-weight: 500;
-}
-
-/* Model info styling */
-.model-info {
-    background: var(--background-secondary);
-    border: 1px solid var(--border-color);
-    border-radius: 8px;
-    padding: 15px;
-    margin: 10px 0;
-    font-size: 0.9em;
-}
-
-/* Button styling */
-.gr-button {
-    background: var(--primary-color);
-    color: white;
-    border: none;
-    border-radius: 8px;
-    padding: 10px 20px;
-    font-weight: 500;
-    transition: all 0.2s ease;
-    cursor: pointer;
-}
-
-.gr-button:hover {
-    background: var(--primary-hover);
-    transform: translateY(-1px);
-}
-
-.gr-button[variant="secondary"] {
-    background: var(--warning-color);
-}
-
-.gr-button[variant="secondary"]:hover {
-    background: #e6850e;
-}
-
-/* Input styling */
-.gr-textbox, .gr-dropdown, .gr-slider {
-    border: 1px solid var(--border-color);
-    border-radius: 8px;
-    padding: 10px;
-    font-size: 14px;
-    transition: border-color 0.2s ease;
-}
-
-.gr-textbox:focus, .gr-dropdown:focus {
-    border-color: var(--primary-color);
-    outline: none;
-    box-shadow: 0 0 0 3px rgba(16, 163, 127, 0.1);
-}
-
-/* Chatbot styling */
-.gr-chatbot {
-    background: transparent;
-    border: none;
-    font-size: 14px;
-    line-height: 1.6;
-}
-
-/* Message styling */
-.message {
-    padding: 15px;
-    margin: 8px 0;
-    border-radius: 12px;
-    max-width: 85%;
-    word-wrap: break-word;
-}
-
-.message.user {
-    background: var(--primary-color);
-    color: white;
-    margin-left: auto;
-    margin-right: 0;
-}
-
-.message.assistant {
-    background: var(--background-secondary);
-    color: var(--text-primary);
-    margin-right: auto;
-    margin-left: 0;
-}
-
-/* Advanced controls */
-.advanced-controls {
-    background: var(--background-secondary);
-    border: 1px solid var(--border-color);
-    border-radius: 8px;
-    padding: 15px;
-    margin: 10px 0;
-}
-
-.advanced-controls h4 {
-    margin-top: 0;
-    margin-bottom: 10px;
-    color: var(--text-primary);
-}
+    if model in model_info:
+        info = model_info[model]
+    else:
+        backends = [b.name for b in model_router.backends_for(model)]
+        info = f"🖥️ **{model}** - Served by {', '.join(backends)}." if backends else "📋 Model information not available."
+    measured = model_stats.summary(model)
+    if measured is not None:
+        figures = [f"TTFT {measured['ttft_p50']:.2f} s (p95 {measured['ttft_p95']:.2f} s)"]
+        if measured["tokens_per_second"] is not None:
+            figures.append(f"{measured['tokens_per_second']:.0f} tok/s")
+        if measured["cost_per_request"] is not None:
+            figures.append(f"~${measured['cost_per_request']:.5f}/answer")
+        answers = f"{measured['requests']} answer{'s' if measured['requests'] != 1 else ''}"
+        info += f"\n\n📊 **Measured** over {answers}: {' · '.join(figures)}"
+    return info
 
-/* Responsive design */
-@media (max-width: 768px) {
-    .header h1 {
-        font-size: 2em;
-    }
+def build_demo():
+    """Create the ChatGPT-like interface; gradio is imported here so importing app.py stays cheap"""
+    import gradio as gr
     
-    .settings-panel {
-        padding: 15px;
-    }
+    # System fonts only: the default Soft theme would pull its font from Google Fonts at runtime
+    theme = gr.themes.Soft(
+        font=["Inter", "-apple-system", "BlinkMacSystemFont", "Segoe UI", "Roboto", "sans-serif"],
+        font_mono=["ui-monospace", "SFMono-Regular", "Consolas", "monospace"],
+    )
+    with gr.Blocks(css=load_css(), title="🤖 ChatGPT-like AI Assistant", theme=theme) as demo:
+        # Header
+        with gr.Row(elem_classes="header"):
+            gr.HTML("""
+            <div>
+                <h1>🤖 ChatGPT-like AI Assistant</h1>
+                <p>Powered by OpenAI's GPT models with advanced conversation features</p>
+            </div>
+            """)
     
-    .gr-button {
-        padding: 8px 16px;
-        font-size: 13px;
-    }
-}
-
-/* Loading animation */
-@keyframes thinking {
-    0%, 80%, 100% { opacity: 1; }
-    40% { opacity: 0.3; }
-}
-
-.thinking {
-    animation: thinking 1.5s infinite;
-}
-
-/* Fade in animation */
-@keyframes fadeIn {
-    from { opacity: 0; transform: translateY(10px); }
-    to { opacity: 1; transform: translateY(0); }
-}
-
-.fade-in {
-    animation: fadeIn 0.3s ease-out;
-}
-"""
-
-# Create the ChatGPT-like interface
-with gr.Blocks(css=custom_css, title="🤖 ChatGPT-like AI Assistant", theme=gr.themes.Soft()) as demo:
-    # Header
-    with gr.Row(elem_classes="header"):
-        gr.HTML("""
-        <div>
-            <h1>🤖 ChatGPT-like AI Assistant</h1>
-            <p>Powered by OpenAI's GPT models with advanced conversation features</p>
-        </div>
-        """)
-    
-    with gr.Row():
-        # Left column - Settings and controls
-        with gr.Column(scale=1):
-            with gr.Group(elem_classes="settings-panel fade-in"):
-                gr.Markdown("### ⚙️ **Configuration**")
+        with gr.Row():
+            # Left column - Settings and controls
+            with gr.Column(scale=1):
+                with gr.Group(elem_classes="settings-panel fade-in"):
+                    gr.Markdown("### ⚙️ **Configuration**")
                 
-                # API Key
-                api_key_input = gr.Textbox(
-                    label="🔑 OpenAI API Key",
-                    type="password",
-                    value=initial_api_key,
-                    placeholder="sk-...",
-                    info="Your OpenAI API key for accessing GPT models"
-                )
+                    # API Key
+                    api_key_input = gr.Textbox(
+                        label="🔑 OpenAI API Key",
+                        type="password",
+                        value=initial_api_key,
+                        placeholder="sk-...",
+                        info="Your OpenAI API key for accessing GPT models"
+                    )
                 
-                # Model Selection
-                model_dropdown = gr.Dropdown(
-                    choices=[
-                        "gpt-4o-mini",
-                        "gpt-4o",
-                        "gpt-4-turbo",
-                        "gpt-4",
-                        "gpt-3.5-turbo"
-                    ],
-                    value="gpt-4o-mini",
-                    label="🧠 AI Model",
-                    info="Choose the GPT model for your conversation"
-                )
+                    # Model Selection
+                    model_dropdown = gr.Dropdown(
+                        choices=model_router.models(),
+                        value=DEFAULT_MODEL,
+                        label="🧠 AI Model",
+                        info="Choose the GPT model for your conversation"
+                    )
                 
-                # Model information display
-                model_info_display = gr.Markdown(
-                    get_model_info("gpt-4o-mini"),
-                    elem_classes="model-info"
-                )
+                    # Model information display
+                    model_info_display = gr.Markdown(
+                        get_model_info(DEFAULT_MODEL),
+                        elem_classes="model-info"
+                    )
                 
-                # System Prompt Selection
-                system_prompt_dropdown = gr.Dropdown(
-                    choices=list(SYSTEM_PROMPTS.keys()) + ["Custom"],
-                    value="Default Assistant",
-                    label="🎭 Assistant Personality",
-                    info="Choose how the AI should behave"
-                )
+                    # System Prompt Selection
+                    system_prompt_dropdown = gr.Dropdown(
+                        choices=list(SYSTEM_PROMPTS.keys()) + ["Custom"],
+                        value="Default Assistant",
+                        label="🎭 Assistant Personality",
+                        info="Choose how the AI should behave"
+                    )
                 
-                # Custom System Prompt
-                custom_system_prompt = gr.Textbox(
-                    label="✏️ Custom System Prompt",
-                    placeholder="Enter your custom system prompt here...",
-                    lines=3,
-                    visible=False,
-                    info="Define custom behavior for the AI"
-                )
+                    # Custom System Prompt
+                    custom_system_prompt = gr.Textbox(
+                        label="✏️ Custom System Prompt",
+                        placeholder="Enter your custom system prompt here...",
+                        lines=3,
+                        visible=False,
+                        info="Define custom behavior for the AI"
+                    )
                 
-            # Advanced Controls
-            with gr.Group(elem_classes="advanced-controls fade-in"):
-                gr.Markdown("### 🎛️ **Advanced Settings**")
+                # Advanced Controls
+                with gr.Group(elem_classes="advanced-controls fade-in"):
+                    gr.Markdown("### 🎛️ **Advanced Settings**")
                 
-                temperature_slider = gr.Slider(
-                    minimum=0.1,
-                    maximum=2.0,
-                    value=0.7,
-                    step=0.1,
-                    label="🌡️ Temperature",
-                    info="Higher values = more creative, lower = more focused"
-                )
+                    temperature_slider = gr.Slider(
+                        minimum=0.0,
+                        maximum=2.0,
+                        value=0.7,
+                        step=0.1,
+                        label="🌡️ Temperature",
+                        info="Higher values = more creative, lower = more focused"
+                    )
                 
-                max_tokens_slider = gr.Slider(
-                    minimum=100,
-                    maximum=4000,
-                    value=2000,
-                    step=100,
-                    label="📝 Max Tokens",
-                    info="Maximum length of the AI response"
-                )
+                    max_tokens_slider = gr.Slider(
+                        minimum=100,
+                        maximum=4000,
+                        value=2000,
+                        step=100,
+                        label="📝 Max Tokens",
+                        info="Maximum length of the AI response"
+                    )
                 
-            # Control Buttons
-            with gr.Group(elem_classes="settings-panel fade-in"):
-                gr.Markdown("### 🎮 **Controls**")
+                # Control Buttons
+                with gr.Group(elem_classes="settings-panel fade-in"):
+                    gr.Markdown("### 🎮 **Controls**")
                 
-                with gr.Row():
-                    clear_btn = gr.Button("🗑️ Clear Chat", variant="secondary")
-                    export_btn = gr.Button("📥 Export", variant="primary")
+                    with gr.Row():
+                        clear_btn = gr.Button("🗑️ Clear Chat", variant="secondary")
+                        export_btn = gr.Button("📥 Export", variant="primary")
                 
-                # Status Display
-                status_display = gr.Markdown(
-                    get_status_info(),
-                    elem_classes="status-bar"
-                )
+                    export_file = gr.File(label="📄 Exported conversation", visible=False)
+                
+                    # Status Display
+                    status_display = gr.Markdown(
+                        get_status_info(),
+                        elem_classes="status-bar"
+                    )
                 
-            # Tips and Info
-            with gr.Group(elem_classes="settings-panel fade-in"):
-                gr.Markdown("""
-                ### 💡 **Tips**
-                - **Temperature**: 0.3-0.7 for focused responses, 0.7-1.2 for creative writing
-                - **Max Tokens**: Higher values allow longer responses but cost more
-                - **System Prompts**: Try different personalities for varied conversation styles
-                - **Memory**: The AI remembers your conversation context automatically
-                """)
+                # Tips and Info
+                with gr.Group(elem_classes="settings-panel fade-in"):
+                    gr.Markdown("""
+                    ### 💡 **Tips**
+                    - **Temperature**: 0.3-0.7 for focused responses, 0.7-1.2 for creative writing
+                    - **Max Tokens**: Higher values allow longer responses but cost more
+                    - **System Prompts**: Try different personalities for varied conversation styles
+                    - **Memory**: The AI remembers your conversation context automatically
+                    """)
         
-        # Right column - Chat interface
-        with gr.Column(scale=2):
-            with gr.Group(elem_classes="chat-container fade-in"):
-                # Chat interface
-                chatbot = gr.Chatbot(
-                    label="💬 **Conversation**",
-                    height=600,
-                    show_copy_button=True,
-                    show_label=True,
-                    container=True,
-                    type="messages",
-                    avatar_images=("https://cdn-icons-png.flaticon.com/512/847/847969.png", 
-                                 "https://cdn-icons-png.flaticon.com/512/4712/4712109.png")
-                )
+            # Right column - Chat interface
+            with gr.Column(scale=2):
+                with gr.Group(elem_classes="chat-container fade-in"):
+                    # Full transcript kept server-side; the Chatbot only gets its newest messages
+                    chat_view = gr.State(ChatView())
+                    earlier_btn = gr.Button("⬆️ Show earlier messages", variant="secondary", size="sm", visible=False)
                 
-                # Message input
-                with gr.Row():
-                    msg = gr.Textbox(
-                        label="",
-                        placeholder="Type your message here... (Shift+Enter for new line)",
-                        lines=2,
-                        max_lines=6,
-                        scale=4,
-                        container=False,
-                        autofocus=True
+                    # Chat interface
+                    chatbot = gr.Chatbot(
+                        label="💬 **Conversation**",
+                        height=600,
+                        show_copy_button=True,
+                        show_label=True,
+                        container=True,
+                        type="messages",
+                        avatar_images=avatar_images()
                     )
-                    send_btn = gr.Button("📤 Send", variant="primary", scale=1)
+                
+                    # Message input
+                    with gr.Row():
+                        msg = gr.Textbox(
+                            label="",
+                            placeholder="Type your message here... (Shift+Enter for new line)",
+                            lines=2,
+                            max_lines=6,
+                            scale=4,
+                            container=False,
+                            autofocus=True
+                        )
+                        send_btn = gr.Button("📤 Send", variant="primary", scale=1)
+                        stop_btn = gr.Button("⏹️ Stop", variant="secondary", scale=1)
     
-    # Welcome message
-    with gr.Group(elem_classes="settings-panel fade-in"):
-        gr.Markdown("""
-        ## 🚀 **Welcome to Your AI Assistant!**
+        # Compare mode: the same prompt to several models at once, answers side by side
+        with gr.Accordion("⚖️ Compare models", open=False, elem_classes="settings-panel fade-in"):
+            with gr.Row():
+                compare_models = gr.CheckboxGroup(
+                    choices=model_router.models(),
+                    value=model_router.models()[:2],
+                    label=f"🧠 Models (up to {COMPARE_MAX_MODELS})",
+                    scale=2
+                )
+                compare_input = gr.Textbox(
+                    label="Prompt",
+                    placeholder="Uses the personality, settings and conversation above; answers are not added to the chat",
+                    lines=2,
+                    scale=3
+                )
+                compare_btn = gr.Button("⚖️ Compare", variant="primary", scale=1)
+            with gr.Row():
+                compare_columns = [gr.Markdown(visible=False) for _ in range(COMPARE_MAX_MODELS)]
+    
+        # Welcome message
+        with gr.Group(elem_classes="settings-panel fade-in"):
+            gr.Markdown("""
+            ## 🚀 **Welcome to Your AI Assistant!**
         
-        This ChatGPT-like interface offers advanced features for natural conversation:
+            This ChatGPT-like interface offers advanced features for natural conversation:
         
-        ### ✨ **Key Features**
-        - **🧠 Multiple AI Models**: Choose from GPT-3.5, GPT-4, and GPT-4o variants
-        - **🎭 Personality Modes**: Pre-configured system prompts for different use cases
-        - **💾 Conversation Memory**: Maintains context throughout your session
-        - **🎛️ Advanced Controls**: Fine-tune temperature and response length
-        - **📥 Export Conversations**: Save your chats as JSON files
-        - **⚡ Streaming Responses**: Real-time response generation
+            ### ✨ **Key Features**
+            - **🧠 Multiple AI Models**: Choose from GPT-3.5, GPT-4, and GPT-4o variants
+            - **🎭 Personality Modes**: Pre-configured system prompts for different use cases
+            - **💾 Conversation Memory**: Maintains context throughout your session
+            - **🎛️ Advanced Controls**: Fine-tune temperature and response length
+            - **📥 Export Conversations**: Save your chats as JSON files
+            - **⚡ Streaming Responses**: Real-time response generation
         
-        ### 🎯 **Getting Started**
-        1. **Add your OpenAI API key** (required for functionality)
-        2. **Choose your preferred model** (GPT-4o-mini recommended for speed)
-        3. **Select an assistant personality** or create your own
-        4. **Start chatting** - the AI will remember your conversation!
+            ### 🎯 **Getting Started**
+            1. **Add your OpenAI API key** (required for functionality)
+            2. **Choose your preferred model** (GPT-4o-mini recommended for speed)
+            3. **Select an assistant personality** or create your own
+            4. **Start chatting** - the AI will remember your conversation!
         
-        *Built By ❤️ Mahfujul Karim*
-        """)
+            *Built By ❤️ Mahfujul Karim*
+            """)
     
-    # Event handlers
-    async def submit_message(message, history, api_key, model, temperature, max_tokens, system_prompt_choice, custom_system_prompt):
-        """Handle message submission"""
-        if not message.strip():
-            yield history, ""
+        # Event handlers
+        async def submit_message(message, view, api_key, model, temperature, max_tokens, system_prompt_choice, custom_system_prompt, request: gr.Request):
+            """Handle message submission"""
+            view.reset_window()
+            if not message.strip():
+                yield view.render(), "", gr.update(visible=view.hidden() > 0)
+                return
         
-        # Use async generator for streaming
-        async for x in chat_response_stream(message, history, api_key, model, temperature, max_tokens, system_prompt_choice, custom_system_prompt):
-            yield x
-    
-    # In on_system_prompt_change function:
-    def on_system_prompt_change(choice):
-        if choice == CUSTOM_PROMPT:
-            return gr.update(visible=True)
-        else:
-            return gr.update(visible=False)
-    
-    def on_model_change(model):
-        """Handle model selection change"""
-        return get_model_info(model), get_status_info()
-    
-    def refresh_status():
-        """Refresh status display"""
-        return get_status_info()
-    
-    # Connect events
-    send_btn.click(
-        submit_message,
-        inputs=[msg, chatbot, api_key_input, model_dropdown, temperature_slider, max_tokens_slider, system_prompt_dropdown, custom_system_prompt],
-        outputs=[chatbot, msg]
-    )
+            # Use async generator for streaming; each update carries only the visible window
+            view.begin_reply()
+            try:
+                async for _, text in chat_response_stream(message, view.messages, api_key, model, temperature, max_tokens, system_prompt_choice, custom_system_prompt, session_id=request.session_hash):
+                    yield view.render(), text, gr.update(visible=view.hidden() > 0)
+            finally:
+                view.end_reply()
+        
+        async def on_compare(message, models, view, api_key, temperature, max_tokens, system_prompt_choice, custom_system_prompt, request: gr.Request):
+            """Stream the prompt to every selected model, one column each"""
+            models = (models or [])[:COMPARE_MAX_MODELS]
+            if not message.strip() or not models:
+                yield [gr.update(visible=False)] * COMPARE_MAX_MODELS
+                return
+            hidden = [gr.update(visible=False)] * (COMPARE_MAX_MODELS - len(models))
+            async for columns in compare_models_stream(message, models, api_key, temperature, max_tokens, system_prompt_choice, custom_system_prompt, history=view.messages, session_id=request.session_hash):
+                yield [gr.update(value=column, visible=True) for column in columns] + hidden
+        
+        def on_show_earlier(view):
+            """Page older messages into the Chatbot"""
+            view.show_earlier()
+            value = view.render()
+            view.release()
+            return value, gr.update(visible=view.hidden() > 0)
     
-    msg.submit(
-        submit_message,
-        inputs=[msg, chatbot, api_key_input, model_dropdown, temperature_slider, max_tokens_slider, system_prompt_dropdown, custom_system_prompt],
-        outputs=[chatbot, msg]
-    )
+        # In on_system_prompt_change function:
+        def on_system_prompt_change(choice):
+            if choice == CUSTOM_PROMPT:
+                return gr.update(visible=True)
+            else:
+                return gr.update(visible=False)
     
-    clear_btn.click(
-        clear_chat,
-        outputs=[chatbot]
-    )
+        def on_model_change(model, request: gr.Request):
+            """Handle model selection change"""
+            return get_model_info(model), get_status_info(request.session_hash)
     
-    system_prompt_dropdown.change(
-        on_system_prompt_change,
-        inputs=[system_prompt_dropdown],
-        outputs=[custom_system_prompt]
-    )
+        def refresh_status(request: gr.Request):
+            """Refresh status display"""
+            return get_status_info(request.session_hash)
     
-    model_dropdown.change(
-        on_model_change,
-        inputs=[model_dropdown],
-        outputs=[model_info_display, status_display]
-    )
+        def on_clear(view, request: gr.Request):
+            """Clear the chat for this session"""
+            view.clear()
+            return clear_chat(request.session_hash), gr.update(visible=False)
+    
+        async def on_export(view, request: gr.Request):
+            """Export this session's conversation for download"""
+            filename = await export_conversation(view.messages, request.session_hash)
+            return gr.update(value=filename, visible=filename is not None)
+    
+        def on_stop(request: gr.Request):
+            """Stop the reply currently streaming for this session"""
+            session = session_store.peek(request.session_hash)
+            if session is not None:
+                session.stop_run()
+    
+        # Connect events
+        send_btn.click(
+            submit_message,
+            api_name="chat",
+            inputs=[msg, chat_view, api_key_input, model_dropdown, temperature_slider, max_tokens_slider, system_prompt_dropdown, custom_system_prompt],
+            outputs=[chatbot, msg, earlier_btn],
+            concurrency_limit=None,  # admission is handled by the scheduler
+            trigger_mode="multiple"  # a resubmission cancels the previous reply itself
+        )
+    
+        msg.submit(
+            submit_message,
+            inputs=[msg, chat_view, api_key_input, model_dropdown, temperature_slider, max_tokens_slider, system_prompt_dropdown, custom_system_prompt],
+            outputs=[chatbot, msg, earlier_btn],
+            concurrency_limit=None,  # admission is handled by the scheduler
+            trigger_mode="multiple"  # a resubmission cancels the previous reply itself
+        )
+    
+        stop_btn.click(on_stop, queue=False)
+    
+        export_btn.click(
+            on_export,
+            inputs=[chat_view],
+            outputs=[export_file]
+        )
+    
+        clear_btn.click(
+            on_clear,
+            inputs=[chat_view],
+            outputs=[chatbot, earlier_btn]
+        )
+    
+        compare_btn.click(
+            on_compare,
+            inputs=[compare_input, compare_models, chat_view, api_key_input, temperature_slider, max_tokens_slider, system_prompt_dropdown, custom_system_prompt],
+            outputs=compare_columns,
+            concurrency_limit=None  # admission is handled by the scheduler
+        ).then(
+            get_model_info,
+            inputs=[model_dropdown],
+            outputs=[model_info_display]
+        )
+    
+        earlier_btn.click(
+            on_show_earlier,
+            inputs=[chat_view],
+            outputs=[chatbot, earlier_btn],
+            queue=False
+        )
+    
+        system_prompt_dropdown.change(
+            on_system_prompt_change,
+            inputs=[system_prompt_dropdown],
+            outputs=[custom_system_prompt]
+        )
+    
+        model_dropdown.change(
+            on_model_change,
+            inputs=[model_dropdown],
+            outputs=[model_info_display, status_display]
+        )
     
-    # Auto-refresh status
-    demo.load(refresh_status, outputs=[status_display])
+        # Auto-refresh status
+        demo.load(refresh_status, outputs=[status_display])
+        status_timer = gr.Timer(5)
+        status_timer.tick(refresh_status, outputs=[status_display], queue=False)
+    
+        # Stop any streaming reply and free the session's state when the tab is closed
+        def on_unload(request: gr.Request):
+            session_store.discard(request.session_hash)
+    
+        demo.unload(on_unload)
+    
+    return demo
+
+_demo = None
+
+def get_demo():
+    """The Gradio UI, built on first use"""
+    global _demo
+    if _demo is None:
+        _demo = build_demo()
+    return _demo
+
+def __getattr__(name):
+    # `app.demo` (e.g. for `gradio app.py` reload mode) builds the UI lazily
+    if name == "demo":
+        return get_demo()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def create_app():
+    """ASGI app serving the Gradio UI at /, local static assets and Prometheus metrics at /metrics"""
+    import gradio as gr
+    from fastapi import FastAPI
+    from fastapi.responses import PlainTextResponse
+    from fastapi.staticfiles import StaticFiles
+    
+    @asynccontextmanager
+    async def lifespan(app):
+        if prefetcher is not None:
+            prefetcher.start()
+        try:
+            yield
+        finally:
+            if prefetcher is not None:
+                await prefetcher.stop()
+    
+    app = FastAPI(lifespan=lifespan)
+    
+    @app.get("/metrics")
+    def metrics():
+        return PlainTextResponse(metrics_registry.export(), media_type="text/plain; version=0.0.4")
+    
+    app.mount(STATIC_URL, StaticFiles(directory=STATIC_DIR), name="local-assets")
+    
+    demo = get_demo()
+    demo.show_error = True
+    demo.show_api = False
+    app = gr.mount_gradio_app(app, demo, path="/")
+    # The OpenAI SDK is only needed for the first request; load it while the server starts accepting connections
+    warm_imports()
+    return app
+
+def profile_startup():
+    """Print how long each startup phase and the slowest imports take"""
+    timer = PhaseTimer()
+    with timer.phase("import gradio"):
+        import gradio  # noqa: F401
+    with timer.phase("import openai"):
+        import openai  # noqa: F401
+    with timer.phase("build UI"):
+        get_demo()
+    with timer.phase("create ASGI app"):
+        create_app()
+    with timer.phase("first client"):
+        client_pool.get(initial_api_key or "sk-profile-startup")
+    print_report(timer, import_breakdown("import app; app.create_app()"))
 
 # Launch the application
 if __name__ == "__main__":
-    demo.launch(
-        share=False,
-        show_error=True,
-        show_api=False,
-        quiet=False,
-        ssl_verify=False
-    )
\ No newline at end of file
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="ChatGPT-like AI Assistant")
+    parser.add_argument("--profile-startup", action="store_true", help="print an import-time and startup phase breakdown and exit")
+    args = parser.parse_args()
+    
+    if args.profile_startup:
+        profile_startup()
+    else:
+        import uvicorn
+        
+        uvicorn.run(
+            create_app(),
+            host=os.getenv("GRADIO_SERVER_NAME", "127.0.0.1"),
+            port=int(os.getenv("GRADIO_SERVER_PORT", "7860"))
+        )
@@ -0,0 +1,100 @@
+"""Static UI assets: stylesheet, web fonts and avatar images
+
+The app never fetches these from a CDN at runtime. Run this module once at
+build time (e.g. in the container image) to download the Inter font and the
+avatar images into static/ and precompile the CSS bundle:
+
+    python assets.py
+
+Without the downloaded files the UI falls back to system fonts and Gradio's
+default avatars.
+"""
+import os
+import re
+import urllib.request
+from functools import lru_cache
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+# URL prefix the static directory is mounted at by app.create_app()
+STATIC_URL = "/local-assets"
+
+FONT_CSS_URL = "https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700&display=swap"
+AVATAR_URLS = {
+    "user.png": "https://cdn-icons-png.flaticon.com/512/847/847969.png",
+    "assistant.png": "https://cdn-icons-png.flaticon.com/512/4712/4712109.png",
+}
+# Google Fonts only serves woff2 to user agents it recognises as modern browsers
+BROWSER_USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36"
+
+
+def static_path(*parts):
+    return os.path.join(STATIC_DIR, *parts)
+
+
+def download(url, timeout=30):
+    request = urllib.request.Request(url, headers={"User-Agent": BROWSER_USER_AGENT})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return response.read()
+
+
+def fetch_fonts():
+    """Download the Inter font files and write a local @font-face stylesheet"""
+    os.makedirs(static_path("fonts"), exist_ok=True)
+    css = download(FONT_CSS_URL).decode("utf-8")
+
+    def localize(match):
+        url = match.group(1)
+        name = os.path.basename(url.split("?")[0])
+        with open(static_path("fonts", name), "wb") as f:
+            f.write(download(url))
+        return f"url({STATIC_URL}/fonts/{name})"
+
+    css = re.sub(r"url\((https://[^)]+)\)", localize, css)
+    with open(static_path("fonts", "inter.css"), "w", encoding="utf-8") as f:
+        f.write(css)
+
+
+def fetch_avatars():
+    """Download the chat avatar images"""
+    os.makedirs(static_path("avatars"), exist_ok=True)
+    for name, url in AVATAR_URLS.items():
+        with open(static_path("avatars", name), "wb") as f:
+            f.write(download(url))
+
+
+def build_css_bundle():
+    """Concatenate the font faces and the app stylesheet into static/bundle.css"""
+    parts = []
+    for path in (static_path("fonts", "inter.css"), static_path("style.css")):
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                parts.append(f.read())
+    with open(static_path("bundle.css"), "w", encoding="utf-8") as f:
+        f.write("\n".join(parts))
+
+
+@lru_cache(maxsize=None)
+def load_css():
+    """The precompiled CSS bundle, or the bare stylesheet if assets were never fetched"""
+    path = static_path("bundle.css")
+    if not os.path.exists(path):
+        path = static_path("style.css")
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def avatar_images():
+    """Local (user, assistant) avatar paths for gr.Chatbot, or None to use Gradio's defaults"""
+    paths = tuple(static_path("avatars", name) for name in AVATAR_URLS)
+    return paths if all(os.path.exists(p) for p in paths) else None
+
+
+def main():
+    fetch_fonts()
+    fetch_avatars()
+    build_css_bundle()
+    print(f"Assets written to {STATIC_DIR}")
+
+
+if __name__ == "__main__":
+    main()
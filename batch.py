@@ -0,0 +1,298 @@
+"""Run a JSONL file of prompts through the chat pipeline without the UI
+
+    python batch.py run prompts.jsonl results.jsonl --concurrency 8
+    python batch.py run prompts.jsonl results.jsonl --mode batch-api    # provider Batch API (24h window)
+
+Each input line is {"id": ..., "prompt": ...} plus optional "persona",
+"system_prompt" (a custom prompt), "model", "temperature", "max_tokens" and
+"history" (earlier user/assistant messages); missing settings use the UI
+defaults. Messages are built exactly as for interactive chats, including
+document retrieval for grounded personas.
+
+Results are appended to the output file as they finish, one line per prompt:
+{"id", "status": "ok" | "error", "output", "usage", "error"}. The output file
+is the checkpoint: running the same command again skips prompts that already
+succeeded and retries the rest, so when an id appears more than once its last
+line wins. In batch-api mode the submitted batch ids are kept next to it in
+<output>.batch.json until their results are collected.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import app
+
+# Stream mode: prompts in flight at once (admission still goes through the app's scheduler)
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+# Batch API mode: requests per uploaded file (the API allows up to 50,000) and seconds between status polls
+BATCH_API_MAX_REQUESTS = int(os.getenv("BATCH_API_MAX_REQUESTS", "50000"))
+BATCH_API_POLL_INTERVAL = float(os.getenv("BATCH_API_POLL_INTERVAL", "30"))
+
+BATCH_API_ENDPOINT = "/v1/chat/completions"
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+def read_items(path):
+    """Prompts from a JSONL file, one dict per non-blank line; ids default to the line number"""
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if not isinstance(item.get("prompt"), str):
+                raise ValueError(f"{path}:{number}: missing \"prompt\"")
+            item["id"] = str(item.get("id", number))
+            yield item
+
+
+def completed_ids(path):
+    """Ids that already have a successful result in the output file"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue  # a line cut short by a crash
+            if result.get("status") == "ok":
+                done.add(str(result["id"]))
+            else:
+                done.discard(str(result["id"]))
+    return done
+
+
+def request_settings(item):
+    """Keyword arguments for app.request_messages / app.complete from an input line"""
+    custom = item.get("system_prompt") or ""
+    return {
+        "system_prompt_choice": app.CUSTOM_PROMPT if custom else item.get("persona", app.DEFAULT_ASSISTANT),
+        "custom_system_prompt": custom,
+        "model": item.get("model") or app.DEFAULT_MODEL,
+        "max_tokens": int(item.get("max_tokens", 2000)),
+        "history": item.get("history"),
+    }
+
+
+class ResultWriter:
+    """Appends result lines to the output file, flushing each so a crash loses at most the prompts in flight"""
+
+    def __init__(self, path):
+        self.path = path
+        self.ok = 0
+        self.errors = 0
+        cut_short = False
+        if os.path.exists(path) and os.path.getsize(path):
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                cut_short = f.read(1) != b"\n"
+        self._file = open(path, "a", encoding="utf-8")
+        if cut_short:
+            # End a line cut short by a crash so it does not swallow the first new result
+            self._file.write("\n")
+
+    def write(self, item_id, output=None, usage=None, error=None):
+        status = "ok" if error is None else "error"
+        self._file.write(json.dumps({"id": item_id, "status": status, "output": output, "usage": usage, "error": error},
+                                    ensure_ascii=False) + "\n")
+        self._file.flush()
+        if error is None:
+            self.ok += 1
+        else:
+            self.errors += 1
+
+    def close(self):
+        self._file.close()
+
+
+async def run_stream(items, writer, concurrency=BATCH_CONCURRENCY, api_key=None, queue_id="batch"):
+    """Complete prompts one request each with bounded concurrency, reading the input lazily"""
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+
+    async def worker():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            settings = request_settings(item)
+            try:
+                result = await app.complete(item["prompt"], temperature=float(item.get("temperature", 0.7)),
+                                            api_key=api_key, queue_id=queue_id, **settings)
+                writer.write(item["id"], result["output"], result["usage"])
+            except Exception as e:
+                writer.write(item["id"], error=str(e))
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        for item in items:
+            await queue.put(item)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        for task in workers:
+            task.cancel()
+
+
+async def batch_request_line(item):
+    """A Batch API request line with the same messages the chat pipeline would send"""
+    settings = request_settings(item)
+    messages = await app.request_messages(item["prompt"], **settings)
+    body = {"model": settings["model"], "messages": messages, "temperature": float(item.get("temperature", 0.7)),
+            "max_tokens": settings["max_tokens"]}
+    return {"custom_id": item["id"], "method": "POST", "url": BATCH_API_ENDPOINT, "body": body}
+
+
+def load_state(path):
+    if not os.path.exists(path):
+        return {"batches": []}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_state(path, state):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+
+async def submit_batches(client, items, state, state_path, max_requests=BATCH_API_MAX_REQUESTS):
+    """Upload the prompts in files of at most max_requests lines and create a batch for each"""
+    async def submit(lines):
+        data = "".join(json.dumps(line, ensure_ascii=False) + "\n" for line in lines).encode("utf-8")
+        uploaded = await client.files.create(file=("batch.jsonl", data), purpose="batch")
+        batch = await client.batches.create(input_file_id=uploaded.id, endpoint=BATCH_API_ENDPOINT, completion_window="24h")
+        # Recorded right away, so an interrupted run collects this batch instead of paying for it twice
+        state["batches"].append({"id": batch.id, "ids": [line["custom_id"] for line in lines]})
+        save_state(state_path, state)
+
+    lines = []
+    for item in items:
+        lines.append(await batch_request_line(item))
+        if len(lines) >= max_requests:
+            await submit(lines)
+            lines = []
+    if lines:
+        await submit(lines)
+
+
+async def file_lines(client, file_id):
+    if not file_id:
+        return []
+    content = await client.files.content(file_id)
+    return [json.loads(line) for line in content.text.splitlines() if line.strip()]
+
+
+async def collect_batches(client, state, state_path, writer, poll_interval=BATCH_API_POLL_INTERVAL):
+    """Wait for the submitted batches to finish and write their results"""
+    while state["batches"]:
+        pending = state["batches"][0]
+        batch = await client.batches.retrieve(pending["id"])
+        if batch.status not in TERMINAL_STATUSES:
+            await asyncio.sleep(poll_interval)
+            continue
+        answered = set()
+        for line in await file_lines(client, batch.output_file_id) + await file_lines(client, batch.error_file_id):
+            response = line.get("response") or {}
+            body = response.get("body") or {}
+            answered.add(line["custom_id"])
+            if line.get("error") or response.get("status_code") != 200:
+                error = line.get("error") or body.get("error") or {}
+                writer.write(line["custom_id"], error=error.get("message") or f"status {response.get('status_code')}")
+                continue
+            usage = body.get("usage") or {}
+            writer.write(line["custom_id"], body["choices"][0]["message"]["content"], {
+                "prompt_tokens": usage.get("prompt_tokens"),
+                "completion_tokens": usage.get("completion_tokens"),
+                "cached_tokens": (usage.get("prompt_tokens_details") or {}).get("cached_tokens"),
+            })
+        for item_id in pending["ids"]:
+            if item_id not in answered:
+                writer.write(item_id, error=f"batch {batch.id} {batch.status} without a result")
+        state["batches"].pop(0)
+        save_state(state_path, state)
+
+
+async def run_batch_api(items, writer, state_path, api_key=None, base_url=None, poll_interval=BATCH_API_POLL_INTERVAL,
+                        max_requests=BATCH_API_MAX_REQUESTS):
+    """Submit the prompts to the provider's Batch API (or resume the batches in state_path) and collect the results"""
+    client = app.client_pool.get(api_key, base_url=base_url)
+    if client is None:
+        raise RuntimeError("The Batch API needs an OpenAI API key")
+    state = load_state(state_path)
+    # Prompts already in a batch from an interrupted run are collected, not resubmitted
+    submitted = {item_id for batch in state["batches"] for item_id in batch["ids"]}
+    await submit_batches(client, (item for item in items if item["id"] not in submitted), state, state_path, max_requests)
+    await collect_batches(client, state, state_path, writer, poll_interval)
+    if os.path.exists(state_path):
+        os.remove(state_path)
+
+
+def batch_api_unsupported(error):
+    """Whether a failed Batch API call means the backend has no Batch API (as local OpenAI-compatible servers)"""
+    from openai import APIConnectionError, APIStatusError
+    return isinstance(error, APIConnectionError) or (isinstance(error, APIStatusError) and error.status_code in (404, 405, 501))
+
+
+async def run(args):
+    api_key = args.api_key or app.initial_api_key
+    done = completed_ids(args.output)
+    skipped = 0
+
+    def pending():
+        nonlocal skipped
+        for item in read_items(args.input):
+            if item["id"] in done:
+                skipped += 1
+            else:
+                yield item
+
+    state_path = args.output + ".batch.json"
+    mode = "batch-api" if args.mode == "auto" and os.path.exists(state_path) else args.mode
+    writer = ResultWriter(args.output)
+    start = time.perf_counter()
+    try:
+        if mode in ("batch-api", "auto"):
+            try:
+                await run_batch_api(pending(), writer, state_path, api_key, args.base_url, args.poll_interval, args.max_requests)
+                mode = "batch-api"
+            except Exception as e:
+                if mode == "batch-api" or not batch_api_unsupported(e) or load_state(state_path)["batches"]:
+                    raise
+                print(f"Batch API unavailable ({e}); streaming instead", file=sys.stderr)
+                mode, skipped = "stream", 0
+        if mode in ("stream", "auto"):
+            mode = "stream"
+            await run_stream(pending(), writer, args.concurrency, api_key, queue_id=f"batch:{os.path.abspath(args.output)}")
+    finally:
+        writer.close()
+        await app.client_pool.aclose()
+    return {"mode": mode, "ok": writer.ok, "errors": writer.errors, "skipped": skipped,
+            "seconds": round(time.perf_counter() - start, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a JSONL file of prompts through the chat pipeline")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="complete every prompt not yet in the output file")
+    run_parser.add_argument("input")
+    run_parser.add_argument("output")
+    run_parser.add_argument("--mode", choices=("stream", "batch-api", "auto"), default="stream",
+                            help="auto uses the Batch API when the backend offers one and streams otherwise")
+    run_parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    run_parser.add_argument("--api-key", help="defaults to OPENAI_API_KEY")
+    run_parser.add_argument("--base-url", help="Batch API endpoint (defaults to OPENAI_BASE_URL or api.openai.com)")
+    run_parser.add_argument("--poll-interval", type=float, default=BATCH_API_POLL_INTERVAL)
+    run_parser.add_argument("--max-requests", type=int, default=BATCH_API_MAX_REQUESTS, help="requests per Batch API file")
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(run(args))))
+
+
+if __name__ == "__main__":
+    main()
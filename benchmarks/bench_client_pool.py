@@ -0,0 +1,89 @@
+"""Time-to-first-token with pooled clients vs a fresh AsyncOpenAI per request
+
+Runs against the local fake server, so no API key or network is needed.
+
+    python benchmarks/bench_client_pool.py --requests 200 --concurrency 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from openai import AsyncOpenAI  # noqa: E402
+
+from client_pool import ClientPool  # noqa: E402
+from fake_openai import FakeOpenAIServer  # noqa: E402
+
+MESSAGES = [{"role": "user", "content": "Say something."}]
+
+
+async def first_token_latency(client):
+    """Seconds from request start to the first content delta"""
+    start = time.perf_counter()
+    stream = await client.chat.completions.create(model="gpt-4o-mini", messages=MESSAGES, stream=True)
+    ttft = None
+    async for chunk in stream:
+        if ttft is None and chunk.choices and chunk.choices[0].delta.content:
+            ttft = time.perf_counter() - start
+    return ttft
+
+
+async def run(name, get_client, requests, concurrency, keys):
+    """Issue requests with bounded concurrency and collect TTFT percentiles"""
+    semaphore = asyncio.Semaphore(concurrency)
+    samples = []
+
+    async def one(i):
+        async with semaphore:
+            samples.append(await first_token_latency(get_client(keys[i % len(keys)])))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - start
+    samples.sort()
+    pct = lambda p: round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000, 3)  # noqa: E731
+    return {"mode": name, "requests": requests, "ttft_ms_p50": pct(0.50), "ttft_ms_p95": pct(0.95),
+            "ttft_ms_p99": pct(0.99), "wall_s": round(elapsed, 3)}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--keys", type=int, default=10, help="distinct API keys (simulated users)")
+    parser.add_argument("--tokens", type=int, default=20)
+    parser.add_argument("--base-url", help="use an existing OpenAI-compatible server instead of the stub")
+    args = parser.parse_args()
+
+    keys = [f"sk-bench-{i}" for i in range(args.keys)]
+    server = None
+    base_url = args.base_url
+    if base_url is None:
+        server = await FakeOpenAIServer(tokens=args.tokens).start()
+        base_url = server.base_url
+
+    try:
+        fresh = await run("fresh-client", lambda key: AsyncOpenAI(api_key=key, base_url=base_url),
+                          args.requests, args.concurrency, keys)
+        fresh_connections = server.connections if server else None
+
+        pool = ClientPool(base_url=base_url)
+        pooled = await run("pooled", pool.get, args.requests, args.concurrency, keys)
+        pool_stats = pool.stats()
+        await pool.aclose()
+        if server:
+            fresh["connections"] = fresh_connections
+            pooled["connections"] = server.connections - fresh_connections
+        print(json.dumps({"results": [fresh, pooled], "pool": pool_stats}, indent=2))
+    finally:
+        if server:
+            await server.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
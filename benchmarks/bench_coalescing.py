@@ -0,0 +1,138 @@
+"""Upstream calls and time-to-first-token when identical requests share one stream
+
+Sends --requests identical temperature-0 prompts at once to the fake server,
+arriving over --stagger seconds, with and without single-flight coalescing.
+Then checks the edge cases with coalescing on: a subscriber that reads too
+slowly is detached without holding the others back, and the first requester
+leaving early does not cut off the others. Every subscriber must receive the
+same text as an uncoalesced request.
+
+    python benchmarks/bench_coalescing.py --requests 50 --stagger 0.2
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from client_pool import ClientPool  # noqa: E402
+from coalescing import SingleFlight, flight_key  # noqa: E402
+from fake_openai import FakeOpenAIServer  # noqa: E402
+
+MODEL = "gpt-4o-mini"
+MESSAGES = [{"role": "system", "content": "You are helpful."}, {"role": "user", "content": "Hello!"}]
+
+
+async def deltas(client):
+    stream = await client.chat.completions.create(model=MODEL, messages=MESSAGES, temperature=0, stream=True)
+    try:
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        await stream.close()
+
+
+def source(client, flights):
+    if flights is None:
+        return deltas(client)
+    return flights.stream(flight_key(MODEL, MESSAGES, 0, 2000), lambda: deltas(client))
+
+
+async def request(client, flights, delay=0.0, read_delay=0.0, stop_after=None):
+    """(ttft, e2e, text) of one request arriving after delay seconds"""
+    await asyncio.sleep(delay)
+    start = time.perf_counter()
+    ttft = None
+    parts = []
+    stream = source(client, flights)
+    try:
+        async for delta in stream:
+            if ttft is None:
+                ttft = time.perf_counter() - start
+            parts.append(delta)
+            if stop_after is not None and len(parts) >= stop_after:
+                break
+            if read_delay:
+                await asyncio.sleep(read_delay)
+    finally:
+        await stream.aclose()
+    return ttft, time.perf_counter() - start, "".join(parts)
+
+
+def pct(samples, p):
+    samples = sorted(s for s in samples if s is not None)
+    return round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000, 1) if samples else None
+
+
+async def ramp(name, server, client, flights, args, expected):
+    before = server.requests
+    started = time.perf_counter()
+    results = await asyncio.gather(*(request(client, flights, args.stagger * i / args.requests)
+                                     for i in range(args.requests)))
+    ttfts = [r[0] for r in results]
+    result = {"mode": name, "requests": args.requests, "upstream_calls": server.requests - before,
+              "ttft_ms_p50": pct(ttfts, 0.5), "ttft_ms_p95": pct(ttfts, 0.95),
+              "wall_ms": round((time.perf_counter() - started) * 1000, 1),
+              "same_text": all(r[2] == expected for r in results)}
+    if flights is not None:
+        result.update(flights.stats())
+    return result
+
+
+async def slow_subscriber(server, client, args, expected):
+    """One reader far slower than the stream must not slow down the fast ones"""
+    flights = SingleFlight(queue_size=4, stall_seconds=args.token_delay * 2)
+    before = server.requests
+    slow, *fast = await asyncio.gather(
+        request(client, flights, read_delay=args.token_delay * 4),
+        *(request(client, flights) for _ in range(4)),
+    )
+    return {"case": "slow subscriber", "upstream_calls": server.requests - before,
+            "fast_e2e_ms_max": round(max(r[1] for r in fast) * 1000, 1), "slow_e2e_ms": round(slow[1] * 1000, 1),
+            "same_text": all(r[2] == expected for r in [slow, *fast]), "detached": flights.detached}
+
+
+async def leader_leaves(server, client, expected):
+    """The request that started the stream stops early; the others still get the whole answer"""
+    flights = SingleFlight()
+    before = server.requests
+    leader, *others = await asyncio.gather(request(client, flights, stop_after=3),
+                                           *(request(client, flights, delay=0.01) for _ in range(3)))
+    everyone_leaves = await request(client, flights, stop_after=3)
+    await asyncio.sleep(0.05)
+    return {"case": "leader leaves", "upstream_calls": server.requests - before,
+            "others_same_text": all(r[2] == expected for r in others), "leader_chars": len(leader[2]),
+            "cancelled_when_all_left": flights.cancelled == 1 and len(everyone_leaves[2]) < len(expected)}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--stagger", type=float, default=0.2, help="seconds over which the requests arrive")
+    parser.add_argument("--tokens", type=int, default=100)
+    parser.add_argument("--token-delay", type=float, default=0.005)
+    parser.add_argument("--first-token-delay", type=float, default=0.3)
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(tokens=args.tokens, token_delay=args.token_delay, first_token_delay=args.first_token_delay)
+    async with server:
+        pool = ClientPool(base_url=server.base_url)
+        client = pool.get("sk-bench")
+        _, _, expected = await request(client, None)
+        results = [
+            await ramp("no coalescing", server, client, None, args, expected),
+            await ramp("single-flight", server, client, SingleFlight(), args, expected),
+            await slow_subscriber(server, client, args, expected),
+            await leader_leaves(server, client, expected),
+        ]
+        await pool.aclose()
+    print(json.dumps({"results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
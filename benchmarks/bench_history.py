@@ -0,0 +1,149 @@
+"""Memory held by idle sessions, plain lists and dicts vs compact history
+
+Fills --sessions conversations of --turns turns each. Every session holds
+what the app keeps per browser tab: the UI transcript (ChatView) and the
+session's context window and persona prompt. "plain" is the same data as dicts in a list and
+Message objects in a deque; "compact" is ChatView and SessionState as they
+are now. Message text is Zipf-distributed words from a large vocabulary
+(so it compresses about as well as prose), and --shared-answers of the
+answers are identical across sessions, as cached or coalesced answers are.
+Reports traced bytes per session and the time to assemble one turn's API
+messages from the stored history.
+
+    python benchmarks/bench_history.py --sessions 10000 --turns 10
+"""
+import argparse
+import gc
+import itertools
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from collections import deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chat_view import ChatView  # noqa: E402
+from compact_history import block_store, prompt_table  # noqa: E402
+from context_window import Message  # noqa: E402
+from sessions import SessionState  # noqa: E402
+
+PERSONAS = [
+    "You are a helpful, creative, and intelligent AI assistant. You provide accurate, detailed, and engaging responses while being friendly and professional.",
+    "You are a programming expert. Provide clear, well-commented code solutions, explain programming concepts, and help debug issues. Focus on best practices and clean code.",
+    "You are a technical support specialist. Help troubleshoot technology issues, explain technical concepts simply, and provide step-by-step solutions.",
+]
+# Registered as app.py registers its personas
+prompt_table.register(PERSONAS)
+
+
+class Corpus:
+    def __init__(self, rng, vocabulary, shared_answers):
+        letters = "abcdefghijklmnopqrstuvwxyz"
+        self.rng = rng
+        self.words = ["".join(rng.choice(letters) for _ in range(rng.randint(2, 10))) for _ in range(vocabulary)]
+        self.cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(vocabulary)))
+        self.shared_answers = shared_answers
+        self.pool = [self.text(1500) for _ in range(50)]
+
+    def text(self, chars):
+        words = self.rng.choices(self.words, cum_weights=self.cum_weights, k=chars // 6)
+        # Lines of about 12 words, as answers with paragraphs and lists have
+        return "\n".join(" ".join(words[i:i + 12]) for i in range(0, len(words), 12))[:chars]
+
+    def answer(self, chars):
+        return self.rng.choice(self.pool) if self.rng.random() < self.shared_answers else self.text(chars)
+
+
+def conversation(corpus, args):
+    messages = []
+    for _ in range(args.turns):
+        messages.append({"role": "user", "content": corpus.text(args.question_chars)})
+        messages.append({"role": "assistant", "content": corpus.answer(args.answer_chars)})
+    return messages
+
+
+class PlainSession:
+    """The same data as the app held it in plain containers"""
+
+    def __init__(self, messages, persona):
+        # Restored from the shared state store, the persona is the session's own copy
+        self.system_prompt = json.loads(json.dumps(persona))
+        self.transcript = []
+        self.history = deque()
+        for message in messages:
+            self.transcript.append(message)
+            self.history.append(Message(message["role"], message["content"], len(message["content"]) // 4 + 4))
+
+    def api_messages(self):
+        return [{"role": "system", "content": self.system_prompt}] + [m.as_dict() for m in self.history]
+
+
+class CompactSession:
+    """ChatView and SessionState as the app keeps them"""
+
+    def __init__(self, messages, persona):
+        self.view = ChatView()
+        self.state = SessionState(None, system_prompt=json.loads(json.dumps(persona)), rolling_summary=False)
+        records = []
+        for message in messages:
+            self.view.messages.append(message)
+            records.append((message["role"], message["content"], len(message["content"]) // 4 + 4))
+        self.state.history.restore(records)
+        # The reply that just finished streamed through the view
+        self.view.render()
+        self.view.release()
+
+    def api_messages(self):
+        messages = [{"role": "system", "content": self.state.system_prompt}]
+        messages.extend(self.state.history.as_messages())
+        return messages
+
+
+def measure(name, factory, args):
+    corpus = Corpus(random.Random(args.seed), args.vocabulary, args.shared_answers)
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    sessions = []
+    text_chars = 0
+    for i in range(args.sessions):
+        messages = conversation(corpus, args)
+        text_chars += sum(len(m["content"]) for m in messages)
+        sessions.append(factory(messages, PERSONAS[i % len(PERSONAS)]))
+        del messages
+    # The corpus' shared answer pool stays alive in both modes
+    gc.collect()
+    held = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    blocks = block_store.stats()
+    started = time.perf_counter()
+    for session in sessions[:1000]:
+        session.api_messages()
+    assemble = (time.perf_counter() - started) / min(1000, len(sessions))
+    return {"mode": name, "sessions": args.sessions, "text_mb": round(text_chars / 1e6, 1),
+            "held_mb": round(held / 1e6, 1), "bytes_per_session": held // args.sessions,
+            "assemble_us_per_turn": round(assemble * 1e6, 1),
+            **({"blocks": blocks["blocks"], "block_mb": round(blocks["block_bytes"] / 1e6, 1)} if blocks["blocks"] else {})}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=10000)
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--question-chars", type=int, default=200)
+    parser.add_argument("--answer-chars", type=int, default=1500)
+    parser.add_argument("--vocabulary", type=int, default=20000, help="distinct words in generated text")
+    parser.add_argument("--shared-answers", type=float, default=0.1, help="share of answers identical across sessions")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    results = [measure("plain", PlainSession, args), measure("compact", CompactSession, args)]
+    results[-1]["interned_prompts"] = len(prompt_table)
+    print(json.dumps({"turns": args.turns, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Share of prompt tokens served from a provider prompt cache, by history trimming strategy
+
+Replays a long conversation through ContextWindow trimming as build_messages
+does and scores every prompt with the fake server's prefix cache model
+(OpenAI rules: prompts of 1024+ tokens, 128-token increments). Trimming the
+minimum each turn shifts the prefix every turn once the budget is full;
+trimming in chunks keeps it stable between trims.
+
+    python benchmarks/bench_prompt_prefix.py --turns 200 --chunks 0,0.1,0.25,0.5
+"""
+import argparse
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from context_window import MESSAGE_OVERHEAD_TOKENS, ContextWindow, count_tokens, prompt_budget  # noqa: E402
+from fake_openai import PromptCacheSim  # noqa: E402
+from metrics import PROMPT_CACHE_DISCOUNT  # noqa: E402
+
+SYSTEM_PROMPT = "You are a helpful, creative, and intelligent AI assistant. " * 20
+
+
+def text(rng, tokens):
+    return " ".join(rng.choice(("alpha", "beta", "gamma", "delta", "omega")) for _ in range(tokens))
+
+
+def run(chunk, args):
+    rng = random.Random(args.seed)
+    cache = PromptCacheSim()
+    history = ContextWindow(args.model)
+    budget = prompt_budget(args.model, args.max_tokens) - count_tokens(SYSTEM_PROMPT, args.model) - MESSAGE_OVERHEAD_TOKENS
+    prompt_total = cached_total = resets = 0
+    for _ in range(args.turns):
+        history.append("user", text(rng, rng.randint(20, args.message_tokens)))
+        if history.trim(budget, int(budget * chunk)):
+            resets += 1
+        messages = [{"role": "system", "content": SYSTEM_PROMPT}, *history.as_messages()]
+        prompt_tokens, cached_tokens = cache.usage(messages)
+        prompt_total += prompt_tokens
+        cached_total += cached_tokens
+        history.append("assistant", text(rng, rng.randint(50, args.message_tokens * 2)))
+    billed = prompt_total - cached_total * PROMPT_CACHE_DISCOUNT
+    return {
+        "trim_chunk": chunk,
+        "prefix_resets": resets,
+        "avg_prompt_tokens": round(prompt_total / args.turns),
+        "cached_share": round(cached_total / prompt_total, 4),
+        "billed_prompt_tokens": round(billed),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--chunks", default="0,0.1,0.25,0.5")
+    parser.add_argument("--model", default="gpt-4", help="8k context, so the budget fills quickly")
+    parser.add_argument("--max-tokens", type=int, default=1000)
+    parser.add_argument("--message-tokens", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    results = [run(float(chunk), args) for chunk in args.chunks.split(",")]
+    baseline = results[0]["billed_prompt_tokens"]
+    for result in results:
+        result["billed_vs_first"] = round(result["billed_prompt_tokens"] / baseline, 3)
+    print(json.dumps({"results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""RAG ingestion throughput and vector search latency
+
+Ingestion: chunks and embeds synthetic documents with the local hashing
+embedder and reports chunks/s and MB/s.
+
+Query: fills a memory-mapped index with --vectors clustered random vectors
+(1M by default, ~1.5 GB at 384 dimensions), then reports p50/p95 latency of
+exact search and of IVF search at several nprobe values, with recall@k
+against exact results.
+
+    python benchmarks/bench_rag.py --documents 2000 --vectors 1000000 --nprobe 4,8,16,32
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from retrieval import VectorIndex, ingest  # noqa: E402
+
+VOCABULARY = [f"term{i}" for i in range(20000)]
+
+
+def write_documents(directory, count, words, seed):
+    rng = random.Random(seed)
+    for i in range(count):
+        with open(os.path.join(directory, f"doc{i}.txt"), "w", encoding="utf-8") as f:
+            f.write(" ".join(rng.choice(VOCABULARY) for _ in range(words)))
+
+
+def bench_ingest(args, workdir):
+    docs = os.path.join(workdir, "docs")
+    os.makedirs(docs)
+    write_documents(docs, args.documents, args.document_words, args.seed)
+    return ingest([docs], os.path.join(workdir, "ingest_index"))
+
+
+def fill_index(index, n, dim, clusters, spread, seed, block=100000):
+    """Clustered unit vectors, so approximate search has structure to exploit"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    for start in range(0, n, block):
+        rows = min(block, n - start)
+        vectors = centers[rng.integers(0, clusters, rows)] + spread * rng.standard_normal((rows, dim)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        index.add(vectors)
+    return centers
+
+
+def latency(index, queries, k, nprobe=None):
+    times, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        ids, _ = index.search(query, k, nprobe)
+        times.append(time.perf_counter() - start)
+        results.append(set(ids.tolist()))
+    times.sort()
+    pct = lambda p: round(times[min(len(times) - 1, int(p * len(times)))] * 1000, 2)  # noqa: E731
+    return {"p50_ms": pct(0.5), "p95_ms": pct(0.95)}, results
+
+
+def bench_query(args, workdir):
+    index = VectorIndex(os.path.join(workdir, "query_index"), args.dim)
+    start = time.perf_counter()
+    centers = fill_index(index, args.vectors, args.dim, args.clusters, args.spread, args.seed)
+    fill_s = time.perf_counter() - start
+    start = time.perf_counter()
+    index.build_ivf(args.lists)
+    ivf_s = time.perf_counter() - start
+
+    rng = np.random.default_rng(args.seed + 1)
+    queries = centers[rng.integers(0, args.clusters, args.queries)] + args.spread * rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    exact, truth = latency(index, queries, args.k)
+    results = [{"mode": "exact", **exact, "recall": 1.0}]
+    for nprobe in (int(n) for n in args.nprobe.split(",")):
+        approx, found = latency(index, queries, args.k, nprobe)
+        recall = sum(len(a & b) for a, b in zip(found, truth)) / (args.k * len(truth))
+        results.append({"mode": f"ivf nprobe={nprobe}", **approx, "recall": round(recall, 4)})
+    return {"vectors": len(index), "dim": args.dim, "fill_s": round(fill_s, 2), "build_ivf_s": round(ivf_s, 2),
+            "results": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--documents", type=int, default=2000)
+    parser.add_argument("--document-words", type=int, default=1500)
+    parser.add_argument("--vectors", type=int, default=1000000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--clusters", type=int, default=2000, help="clusters in the synthetic vectors")
+    parser.add_argument("--spread", type=float, default=1.5, help="noise around cluster centers (higher = harder)")
+    parser.add_argument("--lists", type=int, help="IVF lists (default sqrt(vectors))")
+    parser.add_argument("--nprobe", default="4,8,16,32")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workdir", help="where to build the indexes (default: a temp dir, removed afterwards)")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench-rag-")
+    try:
+        report = {"ingest": bench_ingest(args, workdir), "query": bench_query(args, workdir)}
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Chatbot payload bytes and server CPU per streamed update, full history vs windowed view
+
+Streams a reply into a long conversation and runs every update through what
+Gradio does with a generator output: Chatbot.postprocess, model_dump, then
+the diff against the previous update that goes over the wire. Reports the
+bytes of the first frame (the full value, sent once per reply), of each
+later diff, of the full value per update (what the browser re-renders), of
+the Chatbot value uploaded with each message, and CPU per update.
+
+    python benchmarks/bench_render.py --history 200 --reply-chars 4000 --window 40
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import gradio as gr
+from gradio.utils import diff
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chat_view import ChatView  # noqa: E402
+
+TEXT = "Streaming **markdown** with `code`, lists and a [link](https://example.com). "
+
+
+def make_history(turns, message_chars):
+    history = []
+    for i in range(turns):
+        history.append({"role": "user", "content": f"Question {i}: " + TEXT[: message_chars // 4]})
+        history.append({"role": "assistant", "content": (f"Answer {i}. " + TEXT * (message_chars // len(TEXT) + 1))[:message_chars]})
+    return history
+
+
+def size(value):
+    return len(json.dumps(value, separators=(",", ":")))
+
+
+def run(name, render, messages, args):
+    """Stream one reply in frames of --frame-chars, as coalesce_deltas flushes it"""
+    chatbot = gr.Chatbot(type="messages")
+    messages.append({"role": "user", "content": "One more question"})
+    upload = size(render()[:-1]) if name == "full history" else 0
+    messages.append({"role": "assistant", "content": ""})
+    reply = (TEXT * (args.reply_chars // len(TEXT) + 1))[: args.reply_chars]
+    previous = None
+    first_frame = diff_bytes = full_bytes = updates = 0
+    cpu = 0.0
+    for end in range(args.frame_chars, len(reply) + args.frame_chars, args.frame_chars):
+        messages[-1]["content"] = reply[:end]
+        start = time.process_time()
+        value = chatbot.postprocess(render()).model_dump()
+        edits = diff(previous, value) if previous is not None else value
+        payload = size(edits)
+        cpu += time.process_time() - start
+        if previous is None:
+            first_frame = payload
+        else:
+            diff_bytes += payload
+        full_bytes += size(value)
+        previous = value
+        updates += 1
+    return {
+        "render": name,
+        "updates": updates,
+        "upload_bytes": upload,
+        "first_frame_bytes": first_frame,
+        "diff_bytes_per_update": round(diff_bytes / max(1, updates - 1)),
+        "full_value_bytes_per_update": round(full_bytes / updates),
+        "cpu_ms_per_update": round(cpu / updates * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--history", type=int, default=200, help="earlier turns in the conversation")
+    parser.add_argument("--message-chars", type=int, default=1500)
+    parser.add_argument("--reply-chars", type=int, default=4000)
+    parser.add_argument("--frame-chars", type=int, default=64, help="characters per update (STREAM_FLUSH_CHARS)")
+    parser.add_argument("--window", type=int, default=40, help="CHAT_WINDOW_MESSAGES")
+    args = parser.parse_args()
+
+    full = make_history(args.history, args.message_chars)
+    view = ChatView(window=args.window)
+    view.messages.extend(make_history(args.history, args.message_chars))
+    results = [
+        run("full history", lambda: full, full, args),
+        run(f"window {args.window}", view.render, view.messages, args),
+    ]
+    print(json.dumps({"messages": 2 * args.history + 2, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
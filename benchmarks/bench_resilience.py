@@ -0,0 +1,101 @@
+"""Success rate and tail time-to-first-token with retries and hedging
+
+The fake upstream injects errors (--error-rate) and a long-tailed first-token
+delay (--slow-rate of requests take --slow-delay seconds).
+
+    python benchmarks/bench_resilience.py --requests 200 --error-rate 0.2
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from client_pool import ClientPool  # noqa: E402
+from fake_openai import FakeOpenAIServer  # noqa: E402
+from resilience import ResilientStreamer  # noqa: E402
+
+MESSAGES = [{"role": "user", "content": "Hello!"}]
+
+
+class TailLatencyServer(FakeOpenAIServer):
+    """Fake server where a fraction of requests have a slow first token"""
+
+    def __init__(self, slow_rate, slow_delay, **kwargs):
+        super().__init__(**kwargs)
+        self.slow_rate = slow_rate
+        self.slow_delay = slow_delay
+
+    async def _complete(self, payload, writer):
+        if self.random.random() < self.slow_rate:
+            await asyncio.sleep(self.slow_delay)
+        await super()._complete(payload, writer)
+
+
+async def deltas(client):
+    stream = await client.chat.completions.create(model="gpt-4o-mini", messages=MESSAGES, stream=True)
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+async def run(name, client, streamer, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    ttfts = []
+    failures = 0
+
+    async def one():
+        nonlocal failures
+        async with semaphore:
+            start = time.perf_counter()
+            source = deltas(client) if streamer is None else streamer.stream(lambda: deltas(client))
+            try:
+                first = True
+                async for _ in source:
+                    if first:
+                        ttfts.append(time.perf_counter() - start)
+                        first = False
+            except Exception:
+                failures += 1
+
+    await asyncio.gather(*(one() for _ in range(requests)))
+    ttfts.sort()
+    pct = lambda p: round(ttfts[min(len(ttfts) - 1, int(p * len(ttfts)))] * 1000, 1) if ttfts else None  # noqa: E731
+    result = {"mode": name, "success_rate": round(1 - failures / requests, 4),
+              "ttft_ms_p50": pct(0.5), "ttft_ms_p95": pct(0.95), "ttft_ms_p99": pct(0.99)}
+    if streamer is not None:
+        result.update(streamer.stats())
+    return result
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--error-rate", type=float, default=0.2)
+    parser.add_argument("--slow-rate", type=float, default=0.05)
+    parser.add_argument("--slow-delay", type=float, default=1.0)
+    parser.add_argument("--first-token-delay", type=float, default=0.02)
+    args = parser.parse_args()
+
+    server = TailLatencyServer(args.slow_rate, args.slow_delay, tokens=10, error_rate=args.error_rate,
+                               retry_after=0, first_token_delay=args.first_token_delay, seed=1)
+    async with server:
+        pool = ClientPool(base_url=server.base_url)
+        client = pool.get("sk-bench")
+        results = [
+            await run("no-retry", client, None, args.requests, args.concurrency),
+            await run("retry", client, ResilientStreamer(base_delay=0.05), args.requests, args.concurrency),
+            await run("retry+hedge", client, ResilientStreamer(base_delay=0.05, hedge=True, hedge_default_delay=0.1),
+                      args.requests, args.concurrency),
+        ]
+        await pool.aclose()
+    print(json.dumps({"results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,92 @@
+"""Backend routing between two local stub servers of different speed
+
+Phase 1 sends traffic to a fast and a slow fake server and reports how the
+router splits it. Phase 2 stops the fast server and checks that requests
+fail over to the slow one without errors.
+
+    python benchmarks/bench_router.py --requests 300 --fast-delay 0.02 --slow-delay 0.2
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from client_pool import ClientPool  # noqa: E402
+from fake_openai import FakeOpenAIServer  # noqa: E402
+from router import Backend, ModelRouter  # noqa: E402
+
+MODEL = "local-model"
+MESSAGES = [{"role": "user", "content": "Hello!"}]
+
+
+async def deltas(client):
+    stream = await client.chat.completions.create(model=MODEL, messages=MESSAGES, stream=True)
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+async def run(name, router, pool, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    before = {backend.name: backend.requests for backend in router.backends}
+    ttfts = []
+    failures = 0
+
+    async def one():
+        nonlocal failures
+        async with semaphore:
+            start = time.perf_counter()
+            first = True
+            try:
+                async for _ in router.stream(MODEL, lambda b: deltas(pool.get(b.api_key, base_url=b.base_url))):
+                    if first:
+                        ttfts.append(time.perf_counter() - start)
+                        first = False
+            except Exception:
+                failures += 1
+
+    await asyncio.gather(*(one() for _ in range(requests)))
+    ttfts.sort()
+    pct = lambda p: round(ttfts[min(len(ttfts) - 1, int(p * len(ttfts)))] * 1000, 1) if ttfts else None  # noqa: E731
+    return {
+        "phase": name,
+        "success_rate": round(1 - failures / requests, 4),
+        "ttft_ms_p50": pct(0.5),
+        "ttft_ms_p95": pct(0.95),
+        "share": {b.name: round((b.requests - before[b.name]) / requests, 3) for b in router.backends},
+        "failovers": router.failovers,
+        "backends": router.stats(),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--fast-delay", type=float, default=0.02, help="first-token delay of the fast server")
+    parser.add_argument("--slow-delay", type=float, default=0.2, help="first-token delay of the slow server")
+    args = parser.parse_args()
+
+    fast = FakeOpenAIServer(tokens=10, first_token_delay=args.fast_delay, seed=1)
+    slow = FakeOpenAIServer(tokens=10, first_token_delay=args.slow_delay, seed=2)
+    async with slow:
+        await fast.start()
+        router = ModelRouter([
+            Backend("fast", base_url=fast.base_url, api_key="sk-fast", models=[MODEL]),
+            Backend("slow", base_url=slow.base_url, api_key="sk-slow", models=[MODEL]),
+        ])
+        pool = ClientPool()
+        results = [await run("both-up", router, pool, args.requests, args.concurrency)]
+        await fast.stop()
+        results.append(await run("fast-down", router, pool, args.requests, args.concurrency))
+        await pool.aclose()
+    print(json.dumps({"results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,92 @@
+"""Upstream 429s and queue wait with and without admission control
+
+The fake upstream rejects requests with 429 once more than --upstream-limit
+streams are in flight. Sessions fire requests in bursts, either straight at
+the upstream or through AdmissionController.
+
+    python benchmarks/bench_scheduler.py --sessions 50 --upstream-limit 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import openai  # noqa: E402
+
+from client_pool import ClientPool  # noqa: E402
+from fake_openai import FakeOpenAIServer  # noqa: E402
+from scheduler import AdmissionController  # noqa: E402
+
+MESSAGES = [{"role": "user", "content": "Hello!"}]
+
+
+async def complete(client):
+    """Run one streamed completion; returns False on a 429"""
+    try:
+        stream = await client.chat.completions.create(model="gpt-4o-mini", messages=MESSAGES, stream=True)
+        async for _ in stream:
+            pass
+        return True
+    except openai.RateLimitError:
+        return False
+
+
+async def run(name, server, controller, sessions, requests_per_session):
+    """Fire every session's requests at once and count rejections"""
+    pool = ClientPool(base_url=server.base_url)
+    client = pool.get("sk-bench")
+    client = client.with_options(max_retries=0)
+    rejected = 0
+
+    async def session(session_id):
+        nonlocal rejected
+        for _ in range(requests_per_session):
+            if controller is None:
+                ok = await complete(client)
+            else:
+                ticket = controller.ticket(session_id, "sk-bench", 100)
+                try:
+                    async for _ in ticket.wait():
+                        pass
+                    ok = await complete(client)
+                finally:
+                    ticket.release()
+            rejected += not ok
+
+    start = time.perf_counter()
+    await asyncio.gather(*(session(f"s{i}") for i in range(sessions)))
+    elapsed = time.perf_counter() - start
+    await pool.aclose()
+    result = {"mode": name, "requests": sessions * requests_per_session, "rejected_429": rejected,
+              "wall_s": round(elapsed, 3)}
+    if controller is not None:
+        result.update(controller.stats())
+    return result
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=3, help="requests per session")
+    parser.add_argument("--upstream-limit", type=int, default=8)
+    parser.add_argument("--tokens", type=int, default=30)
+    parser.add_argument("--token-delay", type=float, default=0.005)
+    args = parser.parse_args()
+
+    async with FakeOpenAIServer(tokens=args.tokens, token_delay=args.token_delay,
+                                max_concurrent=args.upstream_limit) as server:
+        results = [
+            await run("direct", server, None, args.sessions, args.requests),
+            await run("admission", server, AdmissionController(max_concurrent=args.upstream_limit),
+                      args.sessions, args.requests),
+        ]
+    print(json.dumps({"results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,118 @@
+"""Replay a recorded chunk stream and report server CPU per response
+
+Compares the old pipeline (re-yield the accumulated string for every chunk and
+push the whole history to the UI each time) against delta coalescing.
+
+    python benchmarks/bench_streaming.py --tokens 4000 --history 40
+    python benchmarks/bench_streaming.py --recording chunks.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from streaming import coalesce_deltas  # noqa: E402
+
+
+def load_chunks(args):
+    """Load a recorded list of content deltas, or synthesize one"""
+    if args.recording:
+        with open(args.recording, encoding="utf-8") as f:
+            return json.load(f)
+    words = ["stream", "ing", " token", "s", " are", " short", ",", " so", " we", " batch"]
+    return [words[i % len(words)] for i in range(args.tokens)]
+
+
+def make_history(turns):
+    """Build a chat history similar to what gr.Chatbot holds"""
+    history = []
+    for i in range(turns):
+        history.append({"role": "user", "content": f"Question {i} " * 20})
+        history.append({"role": "assistant", "content": f"Answer {i} " * 120})
+    return history
+
+
+async def replay(chunks, delay):
+    """Replay chunks like an upstream stream"""
+    for chunk in chunks:
+        if delay:
+            await asyncio.sleep(delay)
+        yield chunk
+
+
+async def old_pipeline(chunks, history, delay):
+    """Accumulate and yield the full string per chunk, serialize history per chunk"""
+    async def accumulate():
+        full_response = ""
+        async for content in replay(chunks, delay):
+            full_response += content
+            yield full_response
+
+    history.append({"role": "assistant", "content": ""})
+    updates = 0
+    async for partial in accumulate():
+        history[-1]["content"] = partial
+        json.dumps(history)
+        updates += 1
+    return updates
+
+
+async def new_pipeline(chunks, history, delay, interval, max_chars):
+    """Coalesce deltas and serialize history once per flush window"""
+    history.append({"role": "assistant", "content": ""})
+    full_response = ""
+    updates = 0
+    async for delta in coalesce_deltas(replay(chunks, delay), interval, max_chars):
+        full_response += delta
+        history[-1]["content"] = full_response
+        json.dumps(history)
+        updates += 1
+    return updates
+
+
+async def measure(name, factory, runs):
+    """Run a pipeline several times and return per-response CPU and update counts"""
+    cpu = []
+    updates = 0
+    for _ in range(runs):
+        start = time.process_time()
+        updates = await factory()
+        cpu.append(time.process_time() - start)
+    cpu.sort()
+    return {
+        "pipeline": name,
+        "updates_per_response": updates,
+        "cpu_ms_median": round(cpu[len(cpu) // 2] * 1000, 3),
+        "cpu_ms_min": round(cpu[0] * 1000, 3),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--recording", help="JSON file with a list of content deltas")
+    parser.add_argument("--tokens", type=int, default=4000)
+    parser.add_argument("--history", type=int, default=20, help="prior turns in the chat")
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds between chunks")
+    parser.add_argument("--interval", type=float, default=0.05)
+    parser.add_argument("--max-chars", type=int, default=64)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    chunks = load_chunks(args)
+    results = [
+        await measure("old", lambda: old_pipeline(chunks, make_history(args.history), args.delay), args.runs),
+        await measure(
+            "coalesced",
+            lambda: new_pipeline(chunks, make_history(args.history), args.delay, args.interval, args.max_chars),
+            args.runs,
+        ),
+    ]
+    print(json.dumps({"chunks": len(chunks), "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
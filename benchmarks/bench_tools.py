@@ -0,0 +1,111 @@
+"""Tool-calling rounds against a stub model that streams tool calls
+
+The fake server answers requests that offer tools with --calls streamed tool
+calls, then, once the conversation has their results, with an answer that
+quotes them. Each call goes to a blocking tool that sleeps --tool-delay
+seconds. Reports the time per answer with one tool thread (calls run one
+after another) and with one thread per call, how many calls started while
+the round was still streaming, the time of an answer whose tool runs past
+its timeout, and of a repeated answer served from the tool result cache.
+
+    python benchmarks/bench_tools.py --calls 4 --tool-delay 0.2
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from client_pool import ClientPool  # noqa: E402
+from fake_openai import FakeOpenAIServer  # noqa: E402
+from tools import Tool, ToolEngine, ToolRegistry, builtin_tools  # noqa: E402
+
+MESSAGES = [{"role": "system", "content": "You are a technical support specialist."},
+            {"role": "user", "content": "Check the routers."}]
+
+
+async def completion_items(client, messages, tools):
+    """Text and tool call deltas of one streamed completion, as app.stream_completion yields them"""
+    stream = await client.chat.completions.create(model="gpt-4o-mini", messages=messages, stream=True,
+                                                  **({"tools": tools} if tools else {}))
+    try:
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            elif chunk.choices and chunk.choices[0].delta.tool_calls:
+                for tool_call in chunk.choices[0].delta.tool_calls:
+                    yield tool_call
+    finally:
+        await stream.close()
+
+
+def make_registry(calls, delay, log):
+    def lookup(n):
+        log.append(time.perf_counter())
+        time.sleep(delay)
+        return {"router": n, "status": "ok"}
+
+    registry = ToolRegistry([builtin_tools()["calculator"]])
+    for i in range(calls - 1):
+        registry.register(Tool(f"lookup_{i}", "Status of a router", {"type": "object", "properties": {"n": {"type": "integer"}}}, lookup))
+    return registry
+
+
+async def answer(engine, client):
+    """(seconds, end time of each round's stream, text) of one answer"""
+    round_ends = []
+    started = time.perf_counter()
+
+    async def open_round(messages, tools):
+        async for item in completion_items(client, messages, tools):
+            yield item
+        round_ends.append(time.perf_counter())
+
+    text = "".join([delta async for delta in engine.run(MESSAGES, open_round)])
+    return time.perf_counter() - started, round_ends, text
+
+
+async def case(name, client, args, threads, timeout=5.0, repeat=1):
+    starts = []
+    engine = ToolEngine(make_registry(args.calls, args.tool_delay, starts), personas=["bench"], threads=threads, timeout=timeout)
+    for _ in range(repeat):
+        starts.clear()
+        seconds, round_ends, text = await answer(engine, client)
+    early = sum(1 for t in starts if t < round_ends[0])
+    stats = engine.stats()
+    return {"case": name, "answer_ms": round(seconds * 1000, 1), "rounds": len(round_ends),
+            "results_quoted": text.startswith("Tool results:") and text.count('"status": "ok"') + text.count("timed out"),
+            "started_while_streaming": early, "calculator": '"result": 42' in text,
+            "cache_hits": sum(s["cache_hits"] for s in stats.values()),
+            "timeouts": sum(s["timeouts"] for s in stats.values())}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=4, help="tool calls per round (one calculator, the rest blocking lookups)")
+    parser.add_argument("--tool-delay", type=float, default=0.2, help="seconds each lookup blocks")
+    parser.add_argument("--token-delay", type=float, default=0.005)
+    args = parser.parse_args()
+
+    arguments = {"calculator": {"expression": "6 * 7"}}
+    arguments.update({f"lookup_{i}": {"n": i} for i in range(args.calls - 1)})
+    server = FakeOpenAIServer(tokens=20, token_delay=args.token_delay, tool_calls=args.calls, tool_arguments=arguments)
+    async with server:
+        pool = ClientPool(base_url=server.base_url)
+        client = pool.get("sk-bench")
+        results = [
+            await case("one tool thread", client, args, threads=1),
+            await case("parallel", client, args, threads=args.calls),
+            await case("timeout", client, args, threads=args.calls, timeout=args.tool_delay / 2),
+            await case("cached repeat", client, args, threads=args.calls, repeat=2),
+        ]
+        await pool.aclose()
+    print(json.dumps({"calls": args.calls, "tool_delay_ms": args.tool_delay * 1000, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,126 @@
+"""Cost of streaming output transforms as answers grow
+
+Streams synthetic answers of increasing length in small deltas through the
+transform pipeline (PII regexes over a sliding window, an Aho-Corasick
+blocklist, code fence repair) and through the naive alternative of running
+the same regexes over the whole accumulated answer on every delta. Reports
+CPU per answer, per-delta latency and throughput: the pipeline stays linear
+in answer length, the naive approach grows quadratically.
+
+    python benchmarks/bench_transforms.py --lengths 1000,4000,16000,64000 --naive-max-chars 4000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transforms import PII_PATTERNS, FenceRepair, KeywordRedactor, RegexRedactor, TransformPipeline  # noqa: E402
+
+FILLER = ["the", "answer", "is", "here", "and", "it", "explains", "how", "to", "configure", "a", "router", "```", "\n"]
+
+
+def make_answer(rng, length, blocklist):
+    words = []
+    size = 0
+    while size < length:
+        roll = rng.random()
+        if roll < 0.01:
+            word = rng.choice(["jane.doe@example.com", "+1 415 555 0100", "4111 1111 1111 1111"])
+        elif roll < 0.03:
+            word = rng.choice(blocklist)
+        else:
+            word = rng.choice(FILLER)
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)
+
+
+def split(rng, text, max_delta):
+    deltas = []
+    i = 0
+    while i < len(text):
+        n = rng.randint(1, max_delta)
+        deltas.append(text[i:i + n])
+        i += n
+    return deltas
+
+
+async def replay(deltas):
+    for delta in deltas:
+        yield delta
+
+
+async def run_pipeline(pipeline, deltas):
+    latencies = []
+    output = []
+    started = time.process_time()
+    last = time.perf_counter()
+    async for text in pipeline.run(replay(deltas)):
+        now = time.perf_counter()
+        latencies.append(now - last)
+        output.append(text)
+        last = time.perf_counter()
+    return time.process_time() - started, latencies, "".join(output)
+
+
+def run_naive(pattern, blocklist_pattern, deltas):
+    """Re-run every pattern over the whole answer so far on each delta, as a loop over full_response would"""
+    latencies = []
+    full_response = ""
+    rendered = ""
+    started = time.process_time()
+    for delta in deltas:
+        start = time.perf_counter()
+        full_response += delta
+        rendered = blocklist_pattern.sub("[redacted]", pattern.sub("[redacted]", full_response))
+        latencies.append(time.perf_counter() - start)
+    return time.process_time() - started, latencies, rendered
+
+
+def summary(name, length, deltas, cpu, latencies):
+    latencies = sorted(latencies)
+    pct = lambda p: round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1e6, 1)  # noqa: E731
+    return {"mode": name, "answer_chars": length, "deltas": len(deltas), "cpu_ms": round(cpu * 1000, 2),
+            "delta_us_p50": pct(0.5), "delta_us_p99": pct(0.99), "delta_us_max": round(latencies[-1] * 1e6, 1),
+            "mb_per_s": round(length / cpu / 1e6, 2) if cpu else None}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lengths", default="1000,4000,16000,64000", help="answer lengths in characters")
+    parser.add_argument("--naive-max-chars", type=int, default=4000, help="longest answer to run the naive approach on")
+    parser.add_argument("--blocklist", type=int, default=1000, help="blocklisted words")
+    parser.add_argument("--max-delta", type=int, default=8, help="largest delta in characters")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    blocklist = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(4, 10)))
+                 for _ in range(args.blocklist)]
+    naive_pii = re.compile("|".join(f"(?:{p})" for p in PII_PATTERNS))
+    naive_blocklist = re.compile(r"(?<!\w)(?:" + "|".join(map(re.escape, sorted(blocklist, key=len, reverse=True))) + r")(?!\w)", re.I)
+    results = []
+    for length in (int(n) for n in args.lengths.split(",")):
+        text = make_answer(rng, length, blocklist)
+        deltas = split(rng, text, args.max_delta)
+        pipeline = TransformPipeline([RegexRedactor(), KeywordRedactor(blocklist), FenceRepair()], budget=float("inf"))
+        cpu, latencies, output = await run_pipeline(pipeline, deltas)
+        results.append(summary("pipeline", length, deltas, cpu, latencies))
+        results[-1]["stage_us_per_delta"] = {name: round(s["seconds"] / s["calls"] * 1e6, 2)
+                                            for name, s in pipeline.stats().items()}
+        if length > args.naive_max_chars:
+            continue
+        cpu, latencies, naive_output = run_naive(naive_pii, naive_blocklist, deltas)
+        results.append(summary("naive full_response", length, deltas, cpu, latencies))
+        results[-1]["same_output"] = naive_output == output.removesuffix("```").removesuffix("\n")
+    print(json.dumps({"blocklist": args.blocklist, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
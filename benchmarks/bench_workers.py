@@ -0,0 +1,88 @@
+"""Throughput scaling of serve.py with the number of worker processes
+
+For each worker count, starts serve.py (shared SQLite session state) against
+the local fake server and drives it through the Gradio API with
+load_test.py's simulated sessions. The proxy pins a new client to a worker
+by its address, and every simulated user comes from 127.0.0.1. So each
+user is given the worker cookie that a browser from its own address would
+receive, spreading users over the workers as distinct browsers would be.
+
+    python benchmarks/bench_workers.py --workers 1,2,4 --sessions 64
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import load_test  # noqa: E402
+from serve import COOKIE_NAME  # noqa: E402
+
+ROOT = load_test.ROOT
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--sessions", type=int, default=64)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--token-rate", type=float, default=0.0, help="0 = as fast as possible (CPU-bound)")
+    parser.add_argument("--output", default="bench_workers.json")
+    args = parser.parse_args()
+
+    # Settings load_test's helpers expect
+    args.model, args.max_tokens, args.think_time = "gpt-4o-mini", args.tokens, 0.0
+    args.first_token_delay, args.latency_sigma, args.error_rate = 0.0, 0.0, 0.0
+
+    fake, base_url = load_test.start_fake_server(args)
+    load_test.configure_environment(base_url)
+    results = []
+    try:
+        for workers in (int(w) for w in args.workers.split(",")):
+            port = load_test.free_port()
+            env = dict(os.environ, STATE_BACKEND="sqlite",
+                       STATE_DB_PATH=os.path.join(tempfile.mkdtemp(prefix="chat-state-"), "state.sqlite3"))
+            server = subprocess.Popen(
+                [sys.executable, os.path.join(ROOT, "serve.py"), "--workers", str(workers), "--port", str(port),
+                 "--worker-port", str(20000 + 100 * workers)],
+                env=env, stdout=subprocess.PIPE, text=True, cwd=ROOT,
+            )
+            try:
+                server.stdout.readline()  # "Serving N workers on ..."
+                start = time.perf_counter()
+                ttfts, latencies, errors = load_test.run_gradio(
+                    f"http://127.0.0.1:{port}/", args.sessions, args, cookies=lambda i: {COOKIE_NAME: str(i % workers)})
+                wall = time.perf_counter() - start
+            finally:
+                server.terminate()
+                server.wait()
+            requests = args.sessions * args.turns
+            result = {
+                "workers": workers,
+                "requests": requests,
+                "errors": len(errors),
+                "throughput_rps": round(requests / wall, 2),
+                "ttft_ms_p95": round(load_test.percentile(ttfts, 0.95) * 1000, 2) if ttfts else None,
+                "e2e_ms_p95": round(load_test.percentile(latencies, 0.95) * 1000, 2) if latencies else None,
+            }
+            results.append(result)
+            print(json.dumps(result), flush=True)
+    finally:
+        fake.terminate()
+        fake.wait()
+
+    base = results[0]["throughput_rps"] if results else None
+    for result in results:
+        result["speedup"] = round(result["throughput_rps"] / base, 2) if base else None
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"commit": load_test.git_commit(), "config": vars(args), "results": results}, f, indent=2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,374 @@
+"""Local OpenAI-compatible chat completions stub for benchmarks
+
+Serves POST /v1/chat/completions (streaming and non-streaming) over plain
+HTTP/1.1 with keep-alive. Token rate, first-token latency and error rate are
+configurable so benchmarks can run offline and reproducibly. The files and
+batches endpoints of the Batch API are served too, in memory; a batch
+completes batch_delay seconds after it is created. With tool_calls, a
+request offering tools is answered with that many streamed tool calls
+(arguments split across chunks) until the conversation has tool results,
+which the final answer then quotes.
+
+    python benchmarks/fake_openai.py --port 8089 --tokens 200 --token-delay 0.005
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import time
+from collections import OrderedDict, deque
+
+WORDS = ["The", " quick", " brown", " fox", " jumps", " over", " the", " lazy", " dog", "."]
+
+
+class PromptCacheSim:
+    """Provider-style prompt prefix cache: reports how many prompt tokens a request shares with earlier ones
+
+    Like OpenAI's, it only applies to prompts of at least min_tokens and
+    caches in increments of block_tokens; tokens are estimated as chars / 4.
+    """
+
+    def __init__(self, min_tokens=1024, block_tokens=128, max_entries=100000):
+        self.min_tokens = min_tokens
+        self.block_tokens = block_tokens
+        self.max_entries = max_entries
+        self._prefixes = OrderedDict()
+
+    def usage(self, messages):
+        """(prompt_tokens, cached_tokens) for a request, remembering its prefixes"""
+        digest = hashlib.sha256()
+        tokens = 0
+        cached = 0
+        for message in messages:
+            digest.update(json.dumps([message.get("role"), message.get("content")]).encode("utf-8"))
+            tokens += (len(str(message.get("content") or "")) + 3) // 4 + 4
+            key = digest.hexdigest()
+            if key in self._prefixes:
+                self._prefixes.move_to_end(key)
+                cached = tokens
+            else:
+                self._prefixes[key] = True
+                if len(self._prefixes) > self.max_entries:
+                    self._prefixes.popitem(last=False)
+        if tokens < self.min_tokens:
+            return tokens, 0
+        return tokens, min(cached, tokens - 1) // self.block_tokens * self.block_tokens
+
+
+class FakeOpenAIServer:
+    """Minimal streaming chat completions server"""
+
+    def __init__(self, host="127.0.0.1", port=0, tokens=50, token_delay=0.0, first_token_delay=0.0,
+                 first_token_jitter=0.0, error_rate=0.0, error_status=429, retry_after=None, max_concurrent=None,
+                 latency_sigma=0.0, seed=None, prefill_delay=0.0, batch_delay=0.0, tool_calls=0, tool_arguments=None):
+        self.host = host
+        self.port = port
+        self.tokens = tokens
+        self.token_delay = token_delay
+        self.first_token_delay = first_token_delay
+        self.first_token_jitter = first_token_jitter
+        # Log-normal spread of the first-token delay (0 = fixed delay plus uniform jitter)
+        self.latency_sigma = latency_sigma
+        # Extra first-token delay per 1000 prompt tokens not served from the prompt cache
+        self.prefill_delay = prefill_delay
+        self.prompt_cache = PromptCacheSim()
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        # Return 429 when more than this many streams are in flight, like an upstream concurrency limit
+        self.max_concurrent = max_concurrent
+        self.in_flight = 0
+        self.random = random.Random(seed)
+        # Batch API state: uploaded files by id, batches by id
+        self.batch_delay = batch_delay
+        # Tool calls per response to requests with tools, and their arguments by tool name
+        self.tool_calls = tool_calls
+        self.tool_arguments = tool_arguments or {}
+        self.files = {}
+        self.batches = {}
+        self._ready_at = {}
+        # Bodies of the latest chat completion requests, for tests to inspect
+        self.received = deque(maxlen=256)
+        self.requests = 0
+        self.connections = 0
+        self.errors = 0
+        self._server = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}/v1"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", "0")))
+                method, path = request_line.decode("latin-1").split(" ")[:2]
+                if path.rstrip("/").endswith("/chat/completions"):
+                    await self._respond(path, body, writer)
+                else:
+                    await self._batch_api(method, path.split("?")[0].rstrip("/"), headers, body, writer)
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, path, body, writer):
+        self.requests += 1
+        if not path.rstrip("/").endswith("/chat/completions"):
+            await self._send_json(writer, 404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+            return
+        overloaded = self.max_concurrent is not None and self.in_flight >= self.max_concurrent
+        if overloaded or (self.error_rate and self.random.random() < self.error_rate):
+            self.errors += 1
+            extra = {"retry-after": str(self.retry_after)} if self.retry_after is not None else {}
+            status = 429 if overloaded else self.error_status
+            await self._send_json(writer, status, {"error": {"message": "injected failure", "type": "rate_limit_error"}}, extra)
+            return
+
+        payload = json.loads(body or b"{}")
+        self.received.append(payload)
+        self.in_flight += 1
+        try:
+            await self._complete(payload, writer)
+        finally:
+            self.in_flight -= 1
+
+    async def _batch_api(self, method, path, headers, body, writer):
+        self.requests += 1
+        parts = path.split("/")
+        if method == "POST" and path.endswith("/files"):
+            content = self._multipart_file(headers.get("content-type", ""), body)
+            file_id = f"file-{len(self.files) + 1}"
+            self.files[file_id] = content
+            await self._send_json(writer, 200, self._file_object(file_id, "batch"))
+        elif method == "GET" and path.endswith("/content") and parts[-2] in self.files:
+            await self._send_bytes(writer, self.files[parts[-2]])
+        elif method == "POST" and path.endswith("/batches"):
+            request = json.loads(body or b"{}")
+            if request.get("input_file_id") not in self.files:
+                await self._send_json(writer, 400, {"error": {"message": "unknown input file", "type": "invalid_request_error"}})
+                return
+            batch_id = f"batch_{len(self.batches) + 1}"
+            self.batches[batch_id] = batch = {
+                "id": batch_id, "object": "batch", "endpoint": request.get("endpoint", "/v1/chat/completions"),
+                "input_file_id": request["input_file_id"], "completion_window": request.get("completion_window", "24h"),
+                "status": "in_progress", "output_file_id": None, "error_file_id": None, "created_at": int(time.time()),
+                "request_counts": {"total": 0, "completed": 0, "failed": 0}, "metadata": request.get("metadata"),
+            }
+            self._ready_at[batch_id] = time.monotonic() + self.batch_delay
+            await self._send_json(writer, 200, batch)
+        elif method == "GET" and parts[-2] == "batches" and parts[-1] in self.batches:
+            batch = self.batches[parts[-1]]
+            if batch["status"] == "in_progress" and time.monotonic() >= self._ready_at[batch["id"]]:
+                self._run_batch(batch)
+            await self._send_json(writer, 200, batch)
+        else:
+            await self._send_json(writer, 404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+
+    def _run_batch(self, batch):
+        """Answer every request line of a batch's input file at once (no delays or injected errors)"""
+        output, errors = [], []
+        for line in self.files[batch["input_file_id"]].decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            body = request.get("body") or {}
+            if request.get("url") != batch["endpoint"] or not body.get("messages"):
+                errors.append({"id": f"batch_req_{len(output) + len(errors)}", "custom_id": request.get("custom_id"),
+                               "response": None, "error": {"code": "invalid_request", "message": "bad request line"}})
+                continue
+            n_tokens = min(self.tokens, body.get("max_tokens") or self.tokens)
+            prompt_tokens, cached_tokens = self.prompt_cache.usage(body["messages"])
+            text = "".join(WORDS[i % len(WORDS)] for i in range(n_tokens))
+            output.append({"id": f"batch_req_{len(output) + len(errors)}", "custom_id": request.get("custom_id"), "error": None,
+                           "response": {"status_code": 200, "request_id": "req-fake", "body": {
+                               "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()),
+                               "model": body.get("model", "fake-model"),
+                               "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                               "usage": self._usage(prompt_tokens, cached_tokens, n_tokens)}}})
+        for key, lines in (("output_file_id", output), ("error_file_id", errors)):
+            if lines:
+                file_id = f"file-{len(self.files) + 1}"
+                self.files[file_id] = "".join(json.dumps(line) + "\n" for line in lines).encode("utf-8")
+                batch[key] = file_id
+        batch["status"] = "completed"
+        batch["completed_at"] = int(time.time())
+        batch["request_counts"] = {"total": len(output) + len(errors), "completed": len(output), "failed": len(errors)}
+
+    @staticmethod
+    def _multipart_file(content_type, body):
+        """Contents of the "file" part of a multipart/form-data upload"""
+        boundary = content_type.partition("boundary=")[2].strip('"').encode()
+        for part in body.split(b"--" + boundary):
+            head, _, content = part.partition(b"\r\n\r\n")
+            if b'name="file"' in head:
+                return content[:-2] if content.endswith(b"\r\n") else content
+        return b""
+
+    def _file_object(self, file_id, purpose):
+        return {"id": file_id, "object": "file", "bytes": len(self.files[file_id]), "created_at": int(time.time()),
+                "filename": f"{file_id}.jsonl", "purpose": purpose, "status": "processed"}
+
+    async def _complete(self, payload, writer):
+        model = payload.get("model", "fake-model")
+        n_tokens = min(self.tokens, payload.get("max_tokens") or self.tokens)
+        delay = self.first_token_delay
+        if self.latency_sigma:
+            delay *= self.random.lognormvariate(0, self.latency_sigma)
+        delay += self.random.random() * self.first_token_jitter
+        prompt_tokens, cached_tokens = self.prompt_cache.usage(payload.get("messages") or [])
+        delay += self.prefill_delay * (prompt_tokens - cached_tokens) / 1000
+        if delay:
+            await asyncio.sleep(delay)
+
+        if not payload.get("stream"):
+            text = "".join(WORDS[i % len(WORDS)] for i in range(n_tokens))
+            await self._send_json(writer, 200, {
+                "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": self._usage(prompt_tokens, cached_tokens, n_tokens),
+            })
+            return
+
+        writer.write(
+            b"HTTP/1.1 200 OK\r\ncontent-type: text/event-stream\r\n"
+            b"transfer-encoding: chunked\r\nconnection: keep-alive\r\n\r\n"
+        )
+        messages = payload.get("messages") or []
+        results = []
+        for message in reversed(messages):
+            if message.get("role") != "tool":
+                break
+            results.append(message.get("content") or "")
+        if payload.get("tools") and self.tool_calls and not results:
+            await self._stream_tool_calls(writer, model, payload["tools"])
+            return
+        if results:
+            self._write_event(writer, self._chunk(model, {"content": "Tool results: " + " | ".join(reversed(results)) + "\n"}, None))
+        for i in range(n_tokens):
+            if i and self.token_delay:
+                await asyncio.sleep(self.token_delay)
+            self._write_event(writer, self._chunk(model, {"content": WORDS[i % len(WORDS)]}, None))
+            await writer.drain()
+        self._write_event(writer, self._chunk(model, {}, "stop"))
+        if (payload.get("stream_options") or {}).get("include_usage"):
+            usage = self._usage(prompt_tokens, cached_tokens, n_tokens)
+            self._write_event(writer, {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": 0,
+                                       "model": model, "choices": [], "usage": usage})
+        self._write_raw(writer, b"data: [DONE]\n\n")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def _stream_tool_calls(self, writer, model, tools):
+        for i in range(self.tool_calls):
+            name = tools[i % len(tools)]["function"]["name"]
+            arguments = json.dumps(self.tool_arguments.get(name, {"n": i}))
+            self._write_event(writer, self._chunk(model, {"tool_calls": [{
+                "index": i, "id": f"call_{i}", "type": "function", "function": {"name": name, "arguments": ""}}]}, None))
+            for start in range(0, len(arguments), 7):
+                if self.token_delay:
+                    await asyncio.sleep(self.token_delay)
+                self._write_event(writer, self._chunk(model, {"tool_calls": [{
+                    "index": i, "function": {"arguments": arguments[start:start + 7]}}]}, None))
+                await writer.drain()
+        self._write_event(writer, self._chunk(model, {}, "tool_calls"))
+        self._write_raw(writer, b"data: [DONE]\n\n")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    @staticmethod
+    def _usage(prompt_tokens, cached_tokens, completion_tokens):
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": cached_tokens}}
+
+    @staticmethod
+    def _chunk(model, delta, finish_reason):
+        return {
+            "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": 0, "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+
+    def _write_event(self, writer, data):
+        self._write_raw(writer, b"data: " + json.dumps(data).encode() + b"\n\n")
+
+    @staticmethod
+    def _write_raw(writer, data):
+        writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+    @staticmethod
+    async def _send_bytes(writer, body):
+        headers = ["HTTP/1.1 200 OK", "content-type: application/octet-stream", f"content-length: {len(body)}",
+                   "connection: keep-alive"]
+        writer.write(("\r\n".join(headers) + "\r\n\r\n").encode() + body)
+        await writer.drain()
+
+    @staticmethod
+    async def _send_json(writer, status, data, extra_headers=None):
+        body = json.dumps(data).encode()
+        headers = [f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}", "content-type: application/json",
+                   f"content-length: {len(body)}", "connection: keep-alive"]
+        headers += [f"{k}: {v}" for k, v in (extra_headers or {}).items()]
+        writer.write(("\r\n".join(headers) + "\r\n\r\n").encode() + body)
+        await writer.drain()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--tokens", type=int, default=50)
+    parser.add_argument("--token-delay", type=float, default=0.0)
+    parser.add_argument("--first-token-delay", type=float, default=0.0)
+    parser.add_argument("--first-token-jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument("--max-concurrent", type=int)
+    parser.add_argument("--latency-sigma", type=float, default=0.0)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--prefill-delay", type=float, default=0.0, help="seconds per 1000 uncached prompt tokens")
+    parser.add_argument("--batch-delay", type=float, default=0.0, help="seconds until a Batch API batch completes")
+    parser.add_argument("--tool-calls", type=int, default=0, help="tool calls per response to requests with tools")
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(args.host, args.port, args.tokens, args.token_delay, args.first_token_delay,
+                              args.first_token_jitter, args.error_rate, args.error_status,
+                              max_concurrent=args.max_concurrent, latency_sigma=args.latency_sigma, seed=args.seed,
+                              prefill_delay=args.prefill_delay, batch_delay=args.batch_delay, tool_calls=args.tool_calls)
+    await server.start()
+    print(f"Fake OpenAI server listening on {server.base_url}", flush=True)
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
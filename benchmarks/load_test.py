@@ -0,0 +1,262 @@
+"""Load test app.py against a local fake OpenAI server
+
+Starts benchmarks/fake_openai.py in a subprocess (so its CPU is not counted),
+then drives N simulated concurrent sessions either straight through
+app.chat_response_stream ("direct") or through a running Gradio server and
+its queue ("gradio", via gradio_client). Session counts are ramped until the
+TTFT SLO or error budget is broken, and results are written as JSON for
+comparing commits.
+
+    python benchmarks/load_test.py --sessions 10,50,100,200 --output load.json
+    python benchmarks/load_test.py --mode gradio --sessions 10,20 --turns 2
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PLACEHOLDER_PREFIXES = ("🤔", "⏳")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def rss_bytes():
+    """Current resident set size of this process"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # macOS reports bytes, Linux kilobytes; this is peak, not current
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def percentile(samples, p):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def start_fake_server(args):
+    port = free_port()
+    cmd = [
+        sys.executable, os.path.join(ROOT, "benchmarks", "fake_openai.py"), "--port", str(port),
+        "--tokens", str(args.tokens), "--token-delay", str(1.0 / args.token_rate if args.token_rate else 0),
+        "--first-token-delay", str(args.first_token_delay), "--latency-sigma", str(args.latency_sigma),
+        "--error-rate", str(args.error_rate), "--seed", "1",
+    ]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+    proc.stdout.readline()  # wait for the listening banner
+    return proc, f"http://127.0.0.1:{port}/v1"
+
+
+def configure_environment(base_url):
+    """Point app.py at the stub with throwaway state before it is imported"""
+    state_dir = tempfile.mkdtemp(prefix="chat-load-")
+    os.environ.update({
+        "OPENAI_BASE_URL": base_url,
+        "OPENAI_API_KEY": "sk-load-test",
+        "RESPONSE_CACHE": "0",
+        "CHAT_LOG_PATH": os.path.join(state_dir, "chat_log.sqlite3"),
+        "CACHE_PATH": "",
+    })
+
+
+def is_content(history):
+    return history and history[-1]["content"] and not history[-1]["content"].startswith(PLACEHOLDER_PREFIXES)
+
+
+async def direct_session(app, index, args, ttfts, latencies, errors):
+    """One simulated user talking to chat_response_stream"""
+    history = []
+    for turn in range(args.turns):
+        start = time.perf_counter()
+        first = None
+        async for history, _ in app.chat_response_stream(
+            f"Question {turn} from user {index}", history, "sk-load-test", args.model, 0.7, args.max_tokens,
+            "Default Assistant", "", session_id=f"load-{index}",
+        ):
+            if first is None and is_content(history):
+                first = time.perf_counter() - start
+        latencies.append(time.perf_counter() - start)
+        if first is not None:
+            ttfts.append(first)
+        content = history[-1]["content"]
+        if content.startswith("❌") or "Error:" in content:
+            errors.append(index)
+        if args.think_time:
+            await asyncio.sleep(args.think_time)
+
+
+async def run_direct(n_sessions, args):
+    import app
+
+    ttfts, latencies, errors = [], [], []
+    await asyncio.gather(*(direct_session(app, i, args, ttfts, latencies, errors) for i in range(n_sessions)))
+    return ttfts, latencies, errors
+
+
+def gradio_session(url, index, args, ttfts, latencies, errors, cookies=None):
+    """One simulated user going through the Gradio queue, sending cookies if given"""
+    from gradio_client import Client
+
+    # The conversation so far lives in the server-side session state of this client
+    client = Client(url, verbose=False, httpx_kwargs={"cookies": cookies} if cookies else None)
+    for turn in range(args.turns):
+        start = time.perf_counter()
+        first = None
+        job = client.submit(f"Question {turn} from user {index}", "sk-load-test", args.model, 0.7,
+                            args.max_tokens, "Default Assistant", "", api_name="/chat")
+        for output in job:
+            history = output[0]
+            if first is None and is_content(history):
+                first = time.perf_counter() - start
+        latencies.append(time.perf_counter() - start)
+        if first is not None:
+            ttfts.append(first)
+        else:
+            errors.append(index)
+        if args.think_time:
+            time.sleep(args.think_time)
+
+
+def run_gradio(url, n_sessions, args, cookies=None):
+    """Run n_sessions simulated users at once; cookies(i) gives the cookies of user i"""
+    ttfts, latencies, errors = [], [], []
+    threads = [threading.Thread(target=gradio_session,
+                                args=(url, i, args, ttfts, latencies, errors, cookies(i) if cookies else None))
+               for i in range(n_sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return ttfts, latencies, errors
+
+
+def start_gradio_server():
+    import uvicorn
+
+    import app
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app.create_app(), host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}/"
+
+
+def measure(n_sessions, args, url=None, loop=None):
+    rss_before = rss_bytes()
+    cpu_before = time.process_time()
+    wall_before = time.perf_counter()
+    if args.mode == "direct":
+        ttfts, latencies, errors = loop.run_until_complete(run_direct(n_sessions, args))
+    else:
+        ttfts, latencies, errors = run_gradio(url, n_sessions, args)
+    wall = time.perf_counter() - wall_before
+    cpu = time.process_time() - cpu_before
+    requests = n_sessions * args.turns
+    to_ms = lambda v: round(v * 1000, 2) if v is not None else None  # noqa: E731
+    return {
+        "sessions": n_sessions,
+        "requests": requests,
+        "errors": len(errors),
+        "error_rate": round(len(errors) / requests, 4) if requests else 0,
+        "ttft_ms": {p: to_ms(percentile(ttfts, q)) for p, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))},
+        "e2e_ms": {p: to_ms(percentile(latencies, q)) for p, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))},
+        "throughput_rps": round(requests / wall, 2) if wall else None,
+        "server_cpu_s": round(cpu, 3),
+        "server_cpu_ms_per_request": round(cpu / requests * 1000, 3) if requests else None,
+        "rss_bytes_per_session": max(0, rss_bytes() - rss_before) // max(1, n_sessions),
+        "wall_s": round(wall, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", choices=["direct", "gradio"], default="direct")
+    parser.add_argument("--sessions", default="10,25,50,100,200", help="comma-separated ramp of concurrent sessions")
+    parser.add_argument("--warmup", type=int, default=2, help="sessions of an unmeasured level run first (0 = none)")
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--think-time", type=float, default=0.0)
+    parser.add_argument("--model", default="gpt-4o-mini")
+    parser.add_argument("--max-tokens", type=int, default=200)
+    parser.add_argument("--tokens", type=int, default=100, help="tokens per fake reply")
+    parser.add_argument("--token-rate", type=float, default=200.0, help="fake tokens per second (0 = unthrottled)")
+    parser.add_argument("--first-token-delay", type=float, default=0.2)
+    parser.add_argument("--latency-sigma", type=float, default=0.3)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--slo-ttft-ms", type=float, default=1000.0, help="p95 TTFT a level must meet")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--output", default="load_test_results.json")
+    args = parser.parse_args()
+
+    proc, base_url = start_fake_server(args)
+    configure_environment(base_url)
+    # One loop for every level: app.py's pooled HTTP transport is bound to the loop that created it
+    loop = asyncio.new_event_loop()
+    try:
+        url = start_gradio_server() if args.mode == "gradio" else None
+        if args.warmup:
+            # Lazy imports (the OpenAI SDK) and first connections would otherwise count against the first level
+            measure(args.warmup, args, url, loop)
+        levels = []
+        max_sustainable = 0
+        for n in (int(x) for x in args.sessions.split(",")):
+            result = measure(n, args, url, loop)
+            result["within_slo"] = (
+                result["ttft_ms"]["p95"] is not None
+                and result["ttft_ms"]["p95"] <= args.slo_ttft_ms
+                and result["error_rate"] <= args.max_error_rate
+            )
+            levels.append(result)
+            print(json.dumps(result), flush=True)
+            if not result["within_slo"]:
+                break
+            max_sustainable = n
+    finally:
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+        proc.terminate()
+        proc.wait()
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": vars(args),
+        "max_sustainable_sessions": max_sustainable,
+        "levels": levels,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Max sustainable sessions: {max_sustainable} (results in {args.output})")
+
+
+if __name__ == "__main__":
+    main()
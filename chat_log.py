@@ -0,0 +1,205 @@
+import argparse
+import gzip
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import zlib
+
+# Persistent, append-only conversation log
+CHAT_LOG_PATH = os.getenv("CHAT_LOG_PATH", "chat_log.sqlite3")
+CHAT_LOG_FLUSH_INTERVAL = float(os.getenv("CHAT_LOG_FLUSH_INTERVAL", "1.0"))
+CHAT_LOG_BATCH_SIZE = int(os.getenv("CHAT_LOG_BATCH_SIZE", "256"))
+# Messages shorter than this are stored uncompressed
+COMPRESS_MIN_BYTES = 256
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    ts REAL NOT NULL,
+    role TEXT NOT NULL,
+    persona TEXT,
+    model TEXT,
+    compressed INTEGER NOT NULL DEFAULT 0,
+    content BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_session_ts ON messages (session_id, ts);
+CREATE INDEX IF NOT EXISTS messages_ts ON messages (ts);
+"""
+
+
+def _encode(content):
+    data = content.encode("utf-8")
+    if len(data) >= COMPRESS_MIN_BYTES:
+        packed = zlib.compress(data, 6)
+        if len(packed) < len(data):
+            return 1, packed
+    return 0, data
+
+
+def _decode(compressed, data):
+    if compressed:
+        data = zlib.decompress(data)
+    return bytes(data).decode("utf-8")
+
+
+class ChatLog:
+    """Append-only SQLite (WAL) message log written by a background batching thread
+
+    append() only enqueues, so the event loop never waits on disk. The writer
+    commits a batch every flush_interval seconds (or batch_size messages) with
+    synchronous=FULL, i.e. one fsync per batch rather than per message.
+    """
+
+    def __init__(self, path=CHAT_LOG_PATH, flush_interval=CHAT_LOG_FLUSH_INTERVAL, batch_size=CHAT_LOG_BATCH_SIZE):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.written = 0
+        self._closed = False
+        self._queue = queue.Queue()
+        db = self._connect()
+        db.executescript(SCHEMA)
+        db.close()
+        self._writer = threading.Thread(target=self._run, name="chat-log-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    def append(self, session_id, role, content, persona=None, model=None):
+        """Queue a message for writing"""
+        self._queue.put((session_id, time.time(), role, persona, model, content))
+
+    def flush(self):
+        """Block until everything queued so far is committed; after close() that is already the case"""
+        if self._closed:
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait()
+
+    def close(self):
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+        self._queue.put(None)
+        self._writer.join()
+
+    def _run(self):
+        db = self._connect()
+        db.execute("PRAGMA synchronous=FULL")
+        batch = []
+        waiters = []
+        deadline = None
+        stop = False
+        while not stop:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = False
+            if item is None:
+                stop = True
+            elif isinstance(item, threading.Event):
+                waiters.append(item)
+            elif item is not False:
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+
+            if batch and (stop or waiters or len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                rows = [(sid, ts, role, persona, model, *_encode(content)) for sid, ts, role, persona, model, content in batch]
+                db.executemany(
+                    "INSERT INTO messages (session_id, ts, role, persona, model, compressed, content) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+                db.commit()
+                self.written += len(batch)
+                batch = []
+                deadline = None
+            for waiter in waiters:
+                waiter.set()
+            waiters = []
+        db.close()
+
+    def iter_messages(self, session_id=None, since=None, until=None, batch_size=500):
+        """Stream stored messages oldest first without loading them all into memory"""
+        clauses, params = [], []
+        if session_id is not None:
+            clauses.append("session_id = ?")
+            params.append(session_id)
+        if since is not None:
+            clauses.append("ts >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("ts < ?")
+            params.append(until)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        order = "ORDER BY ts, id" if session_id is not None else "ORDER BY session_id, ts, id"
+        db = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        try:
+            cursor = db.execute(
+                f"SELECT session_id, ts, role, persona, model, compressed, content FROM messages {where} {order}", params
+            )
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for session_id_, ts, role, persona, model, compressed, content in rows:
+                    yield {"session_id": session_id_, "ts": ts, "role": role, "persona": persona,
+                           "model": model, "content": _decode(compressed, content)}
+        finally:
+            db.close()
+
+    def first_turns(self, since=None):
+        """(persona, model, content, sessions) for each distinct opening user message, most frequent first"""
+        where = "AND ts >= ?" if since is not None else ""
+        params = (since,) if since is not None else ()
+        db = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        try:
+            rows = db.execute(
+                "SELECT persona, model, compressed, content, COUNT(*) AS sessions FROM messages "
+                "WHERE id IN (SELECT MIN(id) FROM messages WHERE role = 'user' GROUP BY session_id) "
+                f"{where} GROUP BY persona, model, compressed, content ORDER BY sessions DESC",
+                params,
+            ).fetchall()
+        finally:
+            db.close()
+        return [(persona, model, _decode(compressed, content), sessions) for persona, model, compressed, content, sessions in rows]
+
+    def export(self, path, session_id=None, since=None, until=None, header=None):
+        """Write messages to a gzip-compressed JSONL file; returns the number of messages"""
+        count = 0
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            if header is not None:
+                f.write(json.dumps(header, ensure_ascii=False) + "\n")
+            for message in self.iter_messages(session_id, since, until):
+                f.write(json.dumps(message, ensure_ascii=False) + "\n")
+                count += 1
+        return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the persistent chat log as gzip JSONL")
+    parser.add_argument("output", help="e.g. conversations.jsonl.gz")
+    parser.add_argument("--db", default=CHAT_LOG_PATH)
+    parser.add_argument("--session", help="only this session id")
+    parser.add_argument("--since", type=float, help="unix timestamp")
+    parser.add_argument("--until", type=float, help="unix timestamp")
+    args = parser.parse_args()
+
+    log = ChatLog(args.db)
+    count = log.export(args.output, args.session, args.since, args.until)
+    log.close()
+    print(f"Exported {count} messages to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import os
+
+from compact_history import Transcript
+
+# Messages shown in the Chatbot (0 = the whole conversation); older ones are paged in CHAT_PAGE_MESSAGES at a time
+CHAT_WINDOW_MESSAGES = int(os.getenv("CHAT_WINDOW_MESSAGES", "40"))
+CHAT_PAGE_MESSAGES = int(os.getenv("CHAT_PAGE_MESSAGES", "40"))
+
+
+class ChatView:
+    """A browser session's full transcript and the window of it shown in the Chatbot
+
+    Only the newest messages go to the Chatbot, so each streamed update
+    serializes and diffs a bounded list however long the conversation gets;
+    earlier ones are paged in on request. The transcript keeps older messages
+    compactly (see compact_history).
+    """
+
+    __slots__ = ("messages", "window", "page", "shown", "streaming")
+
+    def __init__(self, window=CHAT_WINDOW_MESSAGES, page=CHAT_PAGE_MESSAGES):
+        # {"role", "content"} dicts, as chat_response_stream reads and appends them
+        self.messages = Transcript()
+        self.window = window
+        self.page = page
+        self.shown = window
+        # Replies being written into the transcript; it is compacted once there are none
+        self.streaming = 0
+
+    def hidden(self):
+        """Messages before the visible window"""
+        return max(0, len(self.messages) - self.shown) if self.shown else 0
+
+    def show_earlier(self):
+        self.shown += self.page
+
+    def reset_window(self):
+        """Back to the newest messages only, e.g. when a new message is sent"""
+        self.shown = self.window
+
+    def begin_reply(self):
+        self.streaming += 1
+
+    def end_reply(self):
+        self.streaming -= 1
+        self.release()
+
+    def release(self):
+        """Compact the transcript unless a reply is being written, so an idle session holds only compact messages"""
+        if not self.streaming:
+            self.messages.compact()
+
+    def clear(self):
+        self.messages.clear()
+        self.reset_window()
+
+    def render(self):
+        """Chatbot value: the visible messages
+
+        gr.Chatbot deep-copies every message on every update, whatever its
+        type, so the window is what bounds the work; the messages go as they are.
+        """
+        return self.messages[-self.shown:] if self.hidden() else self.messages[:]
@@ -0,0 +1,119 @@
+import hashlib
+import importlib.util
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import httpx
+
+# Client pool and shared HTTP transport settings
+CLIENT_POOL_SIZE = int(os.getenv("CLIENT_POOL_SIZE", "256"))
+CLIENT_IDLE_SECONDS = float(os.getenv("CLIENT_IDLE_SECONDS", "900"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "200"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "50"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "120"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "1") == "1"
+
+
+def key_fingerprint(api_key):
+    """Stable, non-reversible pool key for an API key"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:32]
+
+
+def http2_available():
+    """HTTP/2 needs the optional h2 package (pip install 'httpx[http2]')"""
+    return importlib.util.find_spec("h2") is not None
+
+
+class ClientPool:
+    """Bounded pool of AsyncOpenAI clients sharing one keep-alive HTTP transport
+
+    Clients are keyed by a hash of the API key so the raw key is never used as
+    a dict key, and all of them share a single httpx.AsyncClient so
+    connections (and TLS sessions) are reused across users.
+    """
+
+    def __init__(self, max_clients=CLIENT_POOL_SIZE, idle_timeout=CLIENT_IDLE_SECONDS, base_url=None,
+                 max_connections=HTTP_MAX_CONNECTIONS, max_keepalive=HTTP_MAX_KEEPALIVE,
+                 keepalive_expiry=HTTP_KEEPALIVE_EXPIRY, http2=HTTP2_ENABLED):
+        self.max_clients = max_clients
+        self.idle_timeout = idle_timeout
+        self.base_url = base_url
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.http2 = http2 and http2_available()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._http_client = None
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def http_client(self):
+        """Shared transport, created on first use"""
+        if self._http_client is None or self._http_client.is_closed:
+            self._http_client = httpx.AsyncClient(
+                http2=self.http2,
+                limits=self.limits,
+                timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            )
+        return self._http_client
+
+    def get(self, api_key, base_url=None):
+        """Return the pooled client for api_key (and endpoint), creating it on a miss"""
+        if not api_key:
+            return None
+        base_url = base_url or self.base_url
+        fingerprint = key_fingerprint(api_key if base_url == self.base_url else f"{base_url}\n{api_key}")
+        now = time.monotonic()
+        with self._lock:
+            entry = self._clients.get(fingerprint)
+            if entry is not None:
+                self._clients.move_to_end(fingerprint)
+                entry[1] = now
+                self.hits += 1
+            else:
+                self.misses += 1
+                # Imported on first use: the SDK is slow to import and not needed to serve the UI
+                from openai import AsyncOpenAI
+
+                # Retries are handled by resilience.ResilientStreamer, which knows when a stream is safe to restart
+                client = AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=self.http_client, max_retries=0)
+                entry = self._clients[fingerprint] = [client, now]
+            self._prune(now)
+            return entry[0]
+
+    def prune(self):
+        """Drop clients that have been idle longer than idle_timeout"""
+        with self._lock:
+            self._prune(time.monotonic())
+
+    def _prune(self, now):
+        # Oldest entries first; the shared transport stays open, so dropping a
+        # client only releases its wrapper, never a socket in use by others
+        while self._clients:
+            fingerprint, (_, last_used) = next(iter(self._clients.items()))
+            if len(self._clients) > self.max_clients or now - last_used > self.idle_timeout:
+                del self._clients[fingerprint]
+                self.evictions += 1
+            else:
+                break
+
+    async def aclose(self):
+        """Close the shared transport and forget all clients"""
+        with self._lock:
+            self._clients.clear()
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
+
+    def stats(self):
+        """Pool counters for status display"""
+        return {"clients": len(self._clients), "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
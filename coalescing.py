@@ -0,0 +1,182 @@
+import asyncio
+import hashlib
+import json
+import os
+from contextlib import aclosing
+
+# Identical in-flight deterministic requests (temperature 0, or a fixed REQUEST_SEED) share one upstream stream
+COALESCE_ENABLED = os.getenv("COALESCE", "1") == "1"
+# Deltas a subscriber may fall behind before the shared stream waits for it, and for how long it waits
+COALESCE_QUEUE_SIZE = int(os.getenv("COALESCE_QUEUE_SIZE", "64"))
+COALESCE_STALL_SECONDS = float(os.getenv("COALESCE_STALL_SECONDS", "2"))
+
+_END = object()
+
+
+def flight_key(model, messages, temperature, max_tokens, seed=None, api_key_fingerprint=None):
+    """Requests with the same key produce the same answer, so one upstream stream can serve them all"""
+    context = [(m["role"], m["content"]) for m in messages]
+    data = [model, float(temperature), int(max_tokens), seed, api_key_fingerprint, context]
+    return hashlib.sha256(json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+
+class _Subscriber:
+    __slots__ = ("queue", "position", "detached")
+
+    def __init__(self, size):
+        self.queue = asyncio.Queue(size)
+        # Index into the flight's parts of the next delta this subscriber gets
+        self.position = 0
+        # Fell too far behind: reads the flight's parts at its own pace instead of its queue
+        self.detached = False
+
+
+class _Flight:
+    __slots__ = ("parts", "subscribers", "task", "done", "error", "progress")
+
+    def __init__(self):
+        self.parts = []
+        self.subscribers = []
+        self.task = None
+        self.done = False
+        self.error = None
+        # Wakes detached subscribers when parts grow
+        self.progress = asyncio.Condition()
+
+
+class SingleFlight:
+    """Shares one upstream stream between identical requests that are in flight at the same time
+
+    The first request for a key starts the stream in a task of its own; the
+    others subscribe to it, starting with what it produced so far. Every
+    subscriber has a bounded queue: the stream waits for a full one (so a
+    slow reader slows the upstream read instead of growing memory) but only
+    up to stall_seconds, after which that subscriber is detached and reads
+    the already received deltas at its own pace. The stream is cancelled
+    when its last subscriber goes away.
+    """
+
+    def __init__(self, queue_size=COALESCE_QUEUE_SIZE, stall_seconds=COALESCE_STALL_SECONDS):
+        self.queue_size = queue_size
+        self.stall_seconds = stall_seconds
+        self._flights = {}
+        self.flights = 0
+        self.coalesced = 0
+        self.detached = 0
+        self.cancelled = 0
+
+    @staticmethod
+    def eligible(temperature, seed=None):
+        """Only requests whose answer is meant to be reproducible may be shared"""
+        return float(temperature) == 0 or seed is not None
+
+    async def stream(self, key, producer):
+        """Deltas of the flight for key, starting one with producer() if none is in flight"""
+        flight = self._flights.get(key)
+        subscriber = _Subscriber(self.queue_size)
+        if flight is None:
+            flight = self._flights[key] = _Flight()
+            flight.subscribers.append(subscriber)
+            flight.task = asyncio.get_running_loop().create_task(self._pump(key, flight, producer))
+            self.flights += 1
+        else:
+            self.coalesced += 1
+            flight.subscribers.append(subscriber)
+            if flight.parts:
+                # Catch up on what the flight produced before this subscriber joined
+                subscriber.queue.put_nowait("".join(flight.parts))
+                subscriber.position = len(flight.parts)
+        try:
+            while True:
+                if subscriber.detached and subscriber.queue.empty():
+                    async for delta in self._read_parts(flight, subscriber):
+                        yield delta
+                    break
+                if flight.done and subscriber.queue.empty():
+                    break
+                item = await subscriber.queue.get()
+                if item is _END:
+                    break
+                yield item
+            if flight.error is not None:
+                raise flight.error
+        finally:
+            flight.subscribers.remove(subscriber)
+            if not flight.subscribers and not flight.done:
+                self.cancelled += 1
+                flight.task.cancel()
+
+    async def _read_parts(self, flight, subscriber):
+        while True:
+            while subscriber.position < len(flight.parts):
+                subscriber.position += 1
+                yield flight.parts[subscriber.position - 1]
+            if flight.done:
+                return
+            async with flight.progress:
+                await flight.progress.wait_for(lambda: flight.done or subscriber.position < len(flight.parts))
+
+    async def _deliver(self, subscriber, delta):
+        try:
+            await asyncio.wait_for(subscriber.queue.put(delta), self.stall_seconds)
+            subscriber.position += 1
+        except asyncio.TimeoutError:
+            subscriber.detached = True
+            self.detached += 1
+
+    async def _pump(self, key, flight, producer):
+        try:
+            async with aclosing(producer()) as deltas:
+                async for delta in deltas:
+                    flight.parts.append(delta)
+                    for subscriber in list(flight.subscribers):
+                        if subscriber.detached:
+                            continue
+                        if subscriber.queue.full():
+                            await self._deliver(subscriber, delta)
+                        else:
+                            subscriber.queue.put_nowait(delta)
+                            subscriber.position += 1
+                    async with flight.progress:
+                        flight.progress.notify_all()
+        except asyncio.CancelledError:
+            flight.error = asyncio.CancelledError()
+            raise
+        except Exception as e:
+            flight.error = e
+        finally:
+            flight.done = True
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            # A full queue gets no end marker: its subscriber stops once it has drained it and sees done
+            for subscriber in flight.subscribers:
+                if not subscriber.detached and not subscriber.queue.full():
+                    subscriber.queue.put_nowait(_END)
+            async with flight.progress:
+                flight.progress.notify_all()
+
+    def stats(self):
+        """Upstream streams started and requests that shared one instead"""
+        requests = self.flights + self.coalesced
+        return {
+            "in_flight": len(self._flights),
+            "upstream_streams": self.flights,
+            "coalesced": self.coalesced,
+            "saved_share": self.coalesced / requests if requests else 0.0,
+            "detached": self.detached,
+            "cancelled": self.cancelled,
+        }
+
+    def export(self):
+        """Prometheus text lines for the coalescing counters"""
+        stats = self.stats()
+        lines = []
+        for name, help_text, kind, field in (
+            ("chat_coalesce_upstream_streams_total", "Upstream streams started for coalescable requests", "counter", "upstream_streams"),
+            ("chat_coalesce_saved_total", "Requests served by an identical in-flight stream (upstream calls saved)", "counter", "coalesced"),
+            ("chat_coalesce_detached_total", "Subscribers too slow for the shared stream, detached to read at their own pace", "counter", "detached"),
+            ("chat_coalesce_cancelled_total", "Shared streams cancelled because every subscriber left", "counter", "cancelled"),
+            ("chat_coalesce_in_flight", "Shared streams in flight", "gauge", "in_flight"),
+        ):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", f"{name} {stats[field]}"]
+        return lines
@@ -0,0 +1,292 @@
+"""Compact storage for the conversations idle sessions keep in memory
+
+* The built-in persona prompts are registered in a PromptTable; sessions
+  using one hold a small id instead of a copy of the text.
+* Message text older than the newest HISTORY_HOT_MESSAGES turns is frozen
+  into a TextBlock shared by every holder of the same text (the UI
+  transcript and the context window of a session, identical answers across
+  sessions) and zlib-compressed when that makes it smaller.
+* Roles and token counts live in arrays next to the text references rather
+  than in one object or dict per message.
+"""
+import hashlib
+import os
+import weakref
+import zlib
+from array import array
+
+# Newest messages of a conversation kept as plain strings; older ones are frozen into shared blocks
+HISTORY_HOT_MESSAGES = max(2, int(os.getenv("HISTORY_HOT_MESSAGES", "4")))
+# Frozen text at least this long is deduplicated and compressed; shorter text is kept as it is
+HISTORY_BLOCK_MIN_CHARS = int(os.getenv("HISTORY_BLOCK_MIN_CHARS", "256"))
+
+ROLES = ("system", "user", "assistant", "tool")
+ROLE_CODES = {role: code for code, role in enumerate(ROLES)}
+# Role code of a transcript item kept as the original dict (extra keys, non-text content)
+RAW = 255
+
+
+class PromptTable:
+    """Registered system prompts by small integer id, so a session holds an id instead of its own copy of the text
+
+    Only registered prompts get ids, so the table never grows with the
+    custom prompts users type; those stay with their session and go away
+    with it.
+    """
+
+    def __init__(self, texts=()):
+        self._texts = []
+        self._ids = {}
+        self.register(texts)
+
+    def register(self, texts):
+        for text in texts:
+            if text not in self._ids:
+                self._ids[text] = len(self._texts)
+                self._texts.append(text)
+
+    def intern(self, text):
+        """Id for a registered prompt, or the text itself"""
+        return self._ids.get(text, text)
+
+    def text(self, prompt):
+        return self._texts[prompt] if isinstance(prompt, int) else prompt
+
+    def __len__(self):
+        return len(self._texts)
+
+
+class TextBlock:
+    """Frozen message text, shared by every holder of the same text"""
+
+    __slots__ = ("data", "__weakref__")
+
+    def __init__(self, data):
+        # The text, or its zlib-compressed UTF-8 when that is smaller
+        self.data = data
+
+    def text(self):
+        return self.data if isinstance(self.data, str) else zlib.decompress(self.data).decode("utf-8")
+
+    @property
+    def nbytes(self):
+        return len(self.data)
+
+
+class BlockStore:
+    """Deduplicates frozen text; a block lives as long as some conversation still holds it"""
+
+    def __init__(self, min_chars=HISTORY_BLOCK_MIN_CHARS):
+        self.min_chars = min_chars
+        self._blocks = weakref.WeakValueDictionary()
+        self.frozen = 0
+        self.shared = 0
+
+    def freeze(self, text):
+        """A shared block for text, or text itself when it is too short to be worth one"""
+        if not isinstance(text, str) or len(text) < self.min_chars:
+            return text
+        encoded = text.encode("utf-8")
+        key = hashlib.blake2b(encoded, digest_size=16).digest()
+        block = self._blocks.get(key)
+        if block is not None:
+            self.shared += 1
+            return block
+        packed = zlib.compress(encoded, 6)
+        block = self._blocks[key] = TextBlock(packed if len(packed) < len(text) else text)
+        self.frozen += 1
+        return block
+
+    def stats(self):
+        blocks = list(self._blocks.values())
+        return {"blocks": len(blocks), "block_bytes": sum(block.nbytes for block in blocks),
+                "frozen": self.frozen, "shared": self.shared}
+
+
+def thaw(item):
+    """Text of an item held by a MessageLog or Transcript"""
+    return item.text() if isinstance(item, TextBlock) else item
+
+
+def stored_bytes(item):
+    return item.nbytes if isinstance(item, TextBlock) else len(item)
+
+
+prompt_table = PromptTable()
+block_store = BlockStore()
+
+
+class MessageLog:
+    """Roles, token counts and text of a conversation in parallel arrays, oldest first
+
+    popleft() only advances a start offset; the arrays are compacted once
+    most of them is dead, so trimming from the front is O(1) amortized. Text
+    is frozen (see BlockStore) once hot newer messages follow it.
+    """
+
+    __slots__ = ("roles", "tokens", "texts", "start", "hot", "nbytes")
+
+    def __init__(self, hot=HISTORY_HOT_MESSAGES):
+        self.roles = array("B")
+        self.tokens = array("I")
+        self.texts = []
+        self.start = 0
+        self.hot = hot
+        # Stored text size (compressed size for blocks)
+        self.nbytes = 0
+
+    def append(self, role, text, tokens):
+        self.roles.append(ROLE_CODES[role])
+        self.tokens.append(tokens)
+        self.texts.append(text)
+        self.nbytes += len(text)
+        cold = len(self.texts) - self.hot - 1
+        if cold >= self.start:
+            self._freeze(cold)
+
+    def _freeze(self, index):
+        text = self.texts[index]
+        frozen = block_store.freeze(text)
+        if frozen is not text:
+            self.texts[index] = frozen
+            self.nbytes += frozen.nbytes - len(text)
+
+    def get(self, index):
+        """(role, text, tokens) of the index-th live message"""
+        index += self.start
+        return ROLES[self.roles[index]], thaw(self.texts[index]), self.tokens[index]
+
+    def role(self, index):
+        return ROLES[self.roles[(len(self.roles) + index if index < 0 else self.start + index)]]
+
+    def pop(self):
+        """(role, text, tokens) of the newest message, removed"""
+        item = self.texts.pop()
+        self.nbytes -= stored_bytes(item)
+        message = ROLES[self.roles.pop()], thaw(item), self.tokens.pop()
+        if len(self.texts) == self.start:
+            self.clear()
+        return message
+
+    def popleft(self):
+        """(role, text, tokens) of the oldest message, removed"""
+        message = self.get(0)
+        self.nbytes -= stored_bytes(self.texts[self.start])
+        self.texts[self.start] = None
+        self.start += 1
+        if self.start * 2 >= len(self.texts):
+            del self.roles[:self.start]
+            del self.tokens[:self.start]
+            del self.texts[:self.start]
+            self.start = 0
+        return message
+
+    def clear(self):
+        del self.roles[:]
+        del self.tokens[:]
+        self.texts.clear()
+        self.start = 0
+        self.nbytes = 0
+
+    def __len__(self):
+        return len(self.texts) - self.start
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.get(index)
+
+
+class MessageView:
+    """API-format dicts of a MessageLog, made on access instead of stored"""
+
+    __slots__ = ("log",)
+
+    def __init__(self, log):
+        self.log = log
+
+    def __len__(self):
+        return len(self.log)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.log)
+        if not 0 <= index < len(self.log):
+            raise IndexError(index)
+        role, text, _ = self.log.get(index)
+        return {"role": role, "content": text}
+
+    def __iter__(self):
+        for role, text, _ in self.log:
+            yield {"role": role, "content": text}
+
+
+class Transcript:
+    """The chat's list of {"role", "content"} messages, holding all but the newest compactly
+
+    Supports what the UI handlers do with a plain list: append and extend,
+    edit items in place, index, slice and iterate. Items are the dicts that
+    were appended until compact(), which freezes all but the newest hot ones
+    into a role code and shared text, read back as new dicts; so compact()
+    only once no reply is being written into its dict any more.
+    """
+
+    __slots__ = ("roles", "items", "recent", "hot")
+
+    def __init__(self, messages=(), hot=HISTORY_HOT_MESSAGES):
+        self.roles = array("B")
+        self.items = []
+        # The newest messages as the dicts that were appended
+        self.recent = []
+        self.hot = hot
+        self.extend(messages)
+
+    def append(self, message):
+        self.recent.append(message)
+
+    def extend(self, messages):
+        for message in messages:
+            self.append(message)
+
+    def compact(self):
+        """Freeze all but the newest hot messages"""
+        if len(self.recent) > self.hot:
+            for message in self.recent[:-self.hot]:
+                self._freeze(message)
+            del self.recent[:-self.hot]
+
+    def _freeze(self, message):
+        role = ROLE_CODES.get(message.get("role"))
+        if role is None or len(message) != 2 or not isinstance(message.get("content"), str):
+            self.roles.append(RAW)
+            self.items.append(message)
+        else:
+            self.roles.append(role)
+            self.items.append(block_store.freeze(message["content"]))
+
+    def _message(self, index):
+        if index >= len(self.items):
+            return self.recent[index - len(self.items)]
+        if self.roles[index] == RAW:
+            return self.items[index]
+        return {"role": ROLES[self.roles[index]], "content": thaw(self.items[index])}
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._message(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self._message(index)
+
+    def __len__(self):
+        return len(self.items) + len(self.recent)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self._message(index)
+
+    def clear(self):
+        del self.roles[:]
+        self.items.clear()
+        self.recent.clear()
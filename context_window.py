@@ -0,0 +1,153 @@
+import os
+from functools import lru_cache
+
+from compact_history import MessageLog, MessageView
+
+# Context window sizes in tokens for the models offered in the UI
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-4o-mini": 128000,
+    "gpt-4o": 128000,
+    "gpt-4-turbo": 128000,
+    "gpt-4": 8192,
+    "gpt-3.5-turbo": 16385,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+
+# Optional hard cap on prompt tokens, independent of the model's window
+CONTEXT_MAX_PROMPT_TOKENS = int(os.getenv("CONTEXT_MAX_PROMPT_TOKENS", "0")) or None
+
+# When history overflows the budget, trim this fraction of the budget beyond what is needed, so the
+# prompt prefix (which providers cache) stays unchanged for the next several turns
+PROMPT_TRIM_CHUNK = float(os.getenv("PROMPT_TRIM_CHUNK", "0.25"))
+
+# Per-message framing overhead of the chat format (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+# Tokens reserved for the assistant reply priming
+REPLY_OVERHEAD_TOKENS = 3
+
+
+@lru_cache(maxsize=None)
+def _encoding(model):
+    """tiktoken encoding for model, or None when tiktoken is not installed"""
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(text, model="gpt-4o-mini"):
+    """Count tokens in text, falling back to a ~4 chars/token estimate without tiktoken"""
+    encoding = _encoding(model)
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def prompt_budget(model, max_tokens):
+    """Tokens available for the prompt: model context minus the reply allowance"""
+    budget = MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW) - max_tokens - REPLY_OVERHEAD_TOKENS
+    if CONTEXT_MAX_PROMPT_TOKENS:
+        budget = min(budget, CONTEXT_MAX_PROMPT_TOKENS)
+    return max(0, budget)
+
+
+class Message:
+    """A chat message with its token count computed once"""
+
+    __slots__ = ("role", "content", "tokens")
+
+    def __init__(self, role, content, tokens):
+        self.role = role
+        self.content = content
+        self.tokens = tokens
+
+    def as_dict(self):
+        return {"role": self.role, "content": self.content}
+
+
+class ContextWindow:
+    """Conversation messages trimmed from the oldest end to fit a token budget
+
+    Running totals are kept incrementally and each message is tokenized and
+    evicted at most once, so appending and trimming are O(1) amortized per
+    turn regardless of conversation length. Messages are kept in a compact
+    MessageLog; Message objects and API dicts are only made when asked for.
+    """
+
+    def __init__(self, model="gpt-4o-mini"):
+        self.model = model
+        self.log = MessageLog()
+        self.tokens = 0
+        self.evicted_tokens = 0
+
+    @property
+    def nbytes(self):
+        return self.log.nbytes
+
+    def append(self, role, content):
+        """Add a message, tokenizing it once"""
+        message = Message(role, content, count_tokens(content, self.model) + MESSAGE_OVERHEAD_TOKENS)
+        self.log.append(role, content, message.tokens)
+        self.tokens += message.tokens
+        return message
+
+    def pop(self):
+        """Remove and return the newest message"""
+        message = Message(*self.log.pop())
+        self.tokens -= message.tokens
+        return message
+
+    def popleft(self):
+        """Remove and return the oldest message"""
+        message = Message(*self.log.popleft())
+        self.tokens -= message.tokens
+        self.evicted_tokens += message.tokens
+        return message
+
+    def last_role(self):
+        return self.log.role(-1) if self.log else None
+
+    def trim(self, budget, slack=0):
+        """Drop the oldest messages until the window fits budget; returns what was dropped
+
+        Once over budget, trimming goes down to budget - slack, so history is
+        dropped in chunks and stays append-only between them. The newest
+        message is always kept, and the window never starts with an assistant
+        reply whose question was dropped.
+        """
+        dropped = []
+        if self.tokens > budget:
+            while len(self.log) > 1 and self.tokens > budget - slack:
+                dropped.append(self.popleft())
+        while len(self.log) > 1 and self.log.role(0) == "assistant":
+            dropped.append(self.popleft())
+        return dropped
+
+    def restore(self, records):
+        """Replace the contents with (role, content, tokens) records without re-tokenizing"""
+        self.clear()
+        for role, content, tokens in records:
+            self.log.append(role, content, tokens)
+            self.tokens += tokens
+
+    def records(self):
+        """Serializable (role, content, tokens) records, oldest first"""
+        return list(self.log)
+
+    def as_messages(self):
+        """Messages in API format, oldest first, as a view made on access"""
+        return MessageView(self.log)
+
+    def clear(self):
+        self.log.clear()
+        self.tokens = 0
+
+    def __len__(self):
+        return len(self.log)
+
+    def __bool__(self):
+        return bool(self.log)
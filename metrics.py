@@ -0,0 +1,328 @@
+import json
+import math
+import os
+import threading
+import time
+
+# Quantiles shown in the Prometheus summaries
+EXPORT_QUANTILES = (0.5, 0.9, 0.95, 0.99)
+# Price discount on prompt tokens served from the provider's prompt cache, for the savings estimate
+PROMPT_CACHE_DISCOUNT = float(os.getenv("PROMPT_CACHE_DISCOUNT", "0.5"))
+# USD per million prompt and completion tokens, for cost estimates; MODEL_PRICES (JSON) overrides or adds models
+DEFAULT_MODEL_PRICES = {
+    "gpt-3.5-turbo": (0.5, 1.5),
+    "gpt-4": (30.0, 60.0),
+    "gpt-4-turbo": (10.0, 30.0),
+    "gpt-4o": (2.5, 10.0),
+    "gpt-4o-mini": (0.15, 0.6),
+}
+MODEL_PRICES = {**DEFAULT_MODEL_PRICES, **json.loads(os.getenv("MODEL_PRICES", "{}"))}
+
+
+class Histogram:
+    """HDR-style histogram with log-spaced buckets of bounded relative error
+
+    Recording is one log() and a list increment; memory is fixed regardless
+    of how many samples are recorded.
+    """
+
+    def __init__(self, name, help_text, lowest=1e-4, highest=3600.0, precision=0.02):
+        self.name = name
+        self.help = help_text
+        self.lowest = lowest
+        self.highest = highest
+        self._log_base = math.log1p(precision)
+        self.counts = [0] * (self._index(highest) + 2)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def _index(self, value):
+        if value <= self.lowest:
+            return 0
+        return int(math.log(value / self.lowest) / self._log_base) + 1
+
+    def record(self, value):
+        index = min(self._index(value), len(self.counts) - 1)
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """Approximate value at quantile q (upper edge of the bucket it falls in)"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= target:
+                if index == 0:
+                    return self.lowest
+                return min(self.max, self.lowest * math.exp(index * self._log_base))
+        return self.max
+
+    def export(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} summary"]
+        for q in EXPORT_QUANTILES:
+            lines.append(f'{self.name}{{quantile="{q}"}} {self.quantile(q):.6g}')
+        lines.append(f"{self.name}_sum {self.sum:.6g}")
+        lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+
+class Counter:
+    """Monotonic counter"""
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def export(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter", f"{self.name} {self.value}"]
+
+
+def request_cost(model, prompt_tokens, completion_tokens, cached_tokens=None):
+    """Estimated USD cost of a request, or None for models without a price"""
+    price = MODEL_PRICES.get(model)
+    if price is None or prompt_tokens is None:
+        return None
+    billed_prompt = prompt_tokens - (cached_tokens or 0) * PROMPT_CACHE_DISCOUNT
+    return (billed_prompt * price[0] + (completion_tokens or 0) * price[1]) / 1e6
+
+
+class ModelLatency:
+    """Measured time to first token, speed and cost of one model"""
+
+    __slots__ = ("ttft", "tokens_per_second", "requests", "errors", "cost", "priced")
+
+    def __init__(self):
+        self.ttft = Histogram("ttft", "")
+        self.tokens_per_second = Histogram("tokens_per_second", "", lowest=0.1, highest=100000.0)
+        self.requests = 0
+        self.errors = 0
+        self.cost = 0.0
+        self.priced = 0
+
+
+class ModelStats:
+    """Per-model latency from every finished request, for the model info panel and /metrics"""
+
+    def __init__(self):
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def record(self, model, ttft=None, tokens_per_second=None, cost=None, error=False):
+        with self._lock:
+            entry = self._models.get(model)
+            if entry is None:
+                entry = self._models[model] = ModelLatency()
+            entry.requests += 1
+            entry.errors += error
+            if ttft is not None:
+                entry.ttft.record(ttft)
+            if tokens_per_second is not None:
+                entry.tokens_per_second.record(tokens_per_second)
+            if cost is not None:
+                entry.cost += cost
+                entry.priced += 1
+
+    def summary(self, model):
+        """Measured figures for a model, or None before its first answer"""
+        entry = self._models.get(model)
+        if entry is None or not entry.ttft.count:
+            return None
+        return {
+            "requests": entry.requests,
+            "error_rate": entry.errors / entry.requests,
+            "ttft_p50": entry.ttft.quantile(0.5),
+            "ttft_p95": entry.ttft.quantile(0.95),
+            "tokens_per_second": entry.tokens_per_second.quantile(0.5) if entry.tokens_per_second.count else None,
+            "cost_per_request": entry.cost / entry.priced if entry.priced else None,
+        }
+
+    def export(self):
+        with self._lock:
+            models = list(self._models.items())
+        lines = ["# HELP chat_model_time_to_first_token_seconds Time to first token per model",
+                 "# TYPE chat_model_time_to_first_token_seconds summary"]
+        for model, entry in models:
+            for q in EXPORT_QUANTILES:
+                lines.append(f'chat_model_time_to_first_token_seconds{{model="{model}",quantile="{q}"}} {entry.ttft.quantile(q):.6g}')
+        for name, help_text, field in (
+            ("chat_model_requests_total", "Requests per model", "requests"),
+            ("chat_model_errors_total", "Failed requests per model", "errors"),
+            ("chat_model_cost_usd_total", "Estimated cost per model", "cost"),
+        ):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+            lines += [f'{name}{{model="{model}"}} {getattr(entry, field):.6g}' for model, entry in models]
+        return lines
+
+
+class MetricsRegistry:
+    """Named histograms and counters exported in Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name, help_text, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = Histogram(name, help_text, **kwargs)
+            return metric
+
+    def counter(self, name, help_text):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = Counter(name, help_text)
+            return metric
+
+    def register(self, name, collector):
+        """Export another object's Prometheus lines (anything with an export() method) under name"""
+        with self._lock:
+            self._metrics[name] = collector
+
+    def export(self):
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.export())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+QUEUE_WAIT = registry.histogram("chat_queue_wait_seconds", "Time waiting for admission (rate limits and queue)")
+CLIENT_ACQUIRE = registry.histogram("chat_client_acquire_seconds", "Time to obtain a pooled API client")
+TIME_TO_FIRST_TOKEN = registry.histogram("chat_time_to_first_token_seconds", "Upstream request start to first content chunk")
+INTER_TOKEN_LATENCY = registry.histogram("chat_inter_token_latency_seconds", "Gap between consecutive content chunks")
+STREAM_DURATION = registry.histogram("chat_stream_duration_seconds", "Upstream request start to end of stream")
+TOKENS_PER_SECOND = registry.histogram("chat_tokens_per_second", "Completion tokens per second of streaming", lowest=0.1, highest=100000.0)
+PROMPT_TOKENS = registry.histogram("chat_prompt_tokens", "Prompt tokens per request", lowest=1.0, highest=2000000.0)
+COMPLETION_TOKENS = registry.histogram("chat_completion_tokens", "Completion tokens per request", lowest=1.0, highest=200000.0)
+REQUESTS = registry.counter("chat_requests_total", "Chat requests that reached the upstream API")
+REQUEST_ERRORS = registry.counter("chat_request_errors_total", "Chat requests that ended in an error")
+model_stats = ModelStats()
+registry.register("chat_model", model_stats)
+PROMPT_TOKENS_TOTAL = registry.counter("chat_prompt_tokens_total", "Prompt tokens sent")
+COMPLETION_TOKENS_TOTAL = registry.counter("chat_completion_tokens_total", "Completion tokens received")
+PROMPT_CACHED_TOKENS_TOTAL = registry.counter("chat_prompt_cached_tokens_total", "Prompt tokens the provider served from its prompt cache")
+PROMPT_PREFIX_RESETS = registry.counter("chat_prompt_prefix_resets_total", "Turns whose prompt prefix changed (history trimmed or summary republished)")
+SUMMARY_UPDATES = registry.counter("chat_summary_updates_total", "Rolling summary updates that folded evicted turns in")
+SUMMARY_FAILURES = registry.counter("chat_summary_failures_total", "Evicted turns left out of the rolling summary because summarizing failed")
+TTFT_PREFIX_CACHED = registry.histogram("chat_time_to_first_token_prefix_cached_seconds", "Time to first token of requests with cached prompt tokens")
+TTFT_PREFIX_UNCACHED = registry.histogram("chat_time_to_first_token_prefix_uncached_seconds", "Time to first token of requests without cached prompt tokens")
+
+
+class RequestSpan:
+    """Timing marks for one chat request, recorded into the registry when finished"""
+
+    __slots__ = ("created", "started", "first_token", "last_token", "chunks", "prompt_tokens", "completion_tokens",
+                 "cached_tokens", "error", "model")
+
+    def __init__(self, model=None):
+        # Requests with a model also feed the per-model stats
+        self.model = model
+        self.created = time.perf_counter()
+        self.started = None
+        self.first_token = None
+        self.last_token = None
+        self.chunks = 0
+        self.prompt_tokens = None
+        self.completion_tokens = None
+        self.cached_tokens = None
+        self.error = False
+
+    def admitted(self):
+        QUEUE_WAIT.record(time.perf_counter() - self.created)
+
+    def client_acquired(self, started):
+        CLIENT_ACQUIRE.record(time.perf_counter() - started)
+
+    def request_started(self):
+        # Retries and hedges keep the first start, so TTFT is what the user waited
+        if self.started is None:
+            self.started = time.perf_counter()
+
+    def token(self):
+        now = time.perf_counter()
+        if self.first_token is None:
+            self.first_token = now
+            if self.started is not None:
+                TIME_TO_FIRST_TOKEN.record(now - self.started)
+        else:
+            INTER_TOKEN_LATENCY.record(now - self.last_token)
+        self.last_token = now
+        self.chunks += 1
+
+    def usage(self, prompt_tokens, completion_tokens, cached_tokens=None):
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.cached_tokens = cached_tokens
+
+    def ttft(self):
+        if self.started is None or self.first_token is None:
+            return None
+        return self.first_token - self.started
+
+    def tokens_per_second(self):
+        completion = self.completion_tokens if self.completion_tokens is not None else self.chunks
+        if self.first_token is None or self.last_token is None or self.last_token <= self.first_token or not completion:
+            return None
+        return completion / (self.last_token - self.first_token)
+
+    def cost(self):
+        completion = self.completion_tokens if self.completion_tokens is not None else self.chunks
+        return request_cost(self.model, self.prompt_tokens, completion, self.cached_tokens)
+
+    def finish(self):
+        if self.started is None:
+            # Served without an upstream call, e.g. from the response cache
+            return
+        REQUESTS.inc()
+        if self.error:
+            REQUEST_ERRORS.inc()
+        end = self.last_token or time.perf_counter()
+        STREAM_DURATION.record(end - self.started)
+        completion = self.completion_tokens if self.completion_tokens is not None else self.chunks
+        tokens_per_second = self.tokens_per_second()
+        if tokens_per_second is not None:
+            TOKENS_PER_SECOND.record(tokens_per_second)
+        if self.model is not None:
+            model_stats.record(self.model, self.ttft(), tokens_per_second, self.cost(), self.error)
+        if self.prompt_tokens is not None:
+            PROMPT_TOKENS.record(self.prompt_tokens)
+            PROMPT_TOKENS_TOTAL.inc(self.prompt_tokens)
+        if self.cached_tokens is not None:
+            PROMPT_CACHED_TOKENS_TOTAL.inc(self.cached_tokens)
+            if self.first_token is not None:
+                ttft = TTFT_PREFIX_CACHED if self.cached_tokens else TTFT_PREFIX_UNCACHED
+                ttft.record(self.first_token - self.started)
+        if completion:
+            COMPLETION_TOKENS.record(completion)
+            COMPLETION_TOKENS_TOTAL.inc(completion)
+
+
+def status_summary():
+    """One-line latency summary for the status bar"""
+    if not TIME_TO_FIRST_TOKEN.count:
+        return ""
+    summary = (
+        f"TTFT p50 {TIME_TO_FIRST_TOKEN.quantile(0.5) * 1000:.0f} ms / p95 {TIME_TO_FIRST_TOKEN.quantile(0.95) * 1000:.0f} ms"
+        f" | {TOKENS_PER_SECOND.quantile(0.5):.0f} tok/s"
+    )
+    if PROMPT_CACHED_TOKENS_TOTAL.value and PROMPT_TOKENS_TOTAL.value:
+        cached = PROMPT_CACHED_TOKENS_TOTAL.value
+        summary += (
+            f" | Prompt cache {cached / PROMPT_TOKENS_TOTAL.value:.0%} of prompt tokens"
+            f" (~{cached * PROMPT_CACHE_DISCOUNT:.0f} tokens' cost saved)"
+        )
+    return summary
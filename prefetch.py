@@ -0,0 +1,195 @@
+import asyncio
+import os
+import time
+from contextlib import aclosing
+
+from response_cache import cache_keys
+
+# Speculative prefetch of frequent opening questions (needs the response cache and the chat log)
+PREFETCH_ENABLED = os.getenv("PREFETCH", "0") == "1"
+# Questions prefetched per persona, and how many sessions in the lookback window must have opened with one
+PREFETCH_TOP_K = int(os.getenv("PREFETCH_TOP_K", "5"))
+PREFETCH_MIN_SESSIONS = int(os.getenv("PREFETCH_MIN_SESSIONS", "3"))
+PREFETCH_LOOKBACK_SECONDS = float(os.getenv("PREFETCH_LOOKBACK_SECONDS", str(7 * 24 * 3600)))
+# Refresh period; answers older than PREFETCH_MAX_AGE are regenerated unless they served fewer than PREFETCH_MIN_HITS turns
+PREFETCH_INTERVAL = float(os.getenv("PREFETCH_INTERVAL", "3600"))
+PREFETCH_MAX_AGE = float(os.getenv("PREFETCH_MAX_AGE", str(6 * 3600)))
+PREFETCH_MIN_HITS = int(os.getenv("PREFETCH_MIN_HITS", "1"))
+# Request settings the answers are generated and cached with; only requests with the same settings are served them
+PREFETCH_TEMPERATURE = float(os.getenv("PREFETCH_TEMPERATURE", "0"))
+PREFETCH_MAX_TOKENS = int(os.getenv("PREFETCH_MAX_TOKENS", "2000"))
+PREFETCH_CONCURRENCY = int(os.getenv("PREFETCH_CONCURRENCY", "2"))
+
+
+class PrefetchEntry:
+    """A prefetched opening question and how often its answer has been served"""
+
+    __slots__ = ("persona", "model", "prompt", "key", "namespace", "sessions", "hits", "generated")
+
+    def __init__(self, persona, model, prompt, key, namespace, sessions):
+        self.persona = persona
+        self.model = model
+        self.prompt = prompt
+        self.key = key
+        self.namespace = namespace
+        self.sessions = sessions
+        self.hits = 0
+        self.generated = None
+
+
+class FirstTurnPrefetcher:
+    """Keeps answers to the most frequent first-turn questions per persona in the response cache
+
+    The questions are learned from the chat log. Every refresh warms the
+    pooled connections, then generates answers for new questions and for
+    stale ones that were actually served (hit-rate control); questions whose
+    answer went unused are retired until more sessions open with them.
+    """
+
+    def __init__(self, cache, chat_log, produce, system_prompts, warm=None, top_k=PREFETCH_TOP_K,
+                 min_sessions=PREFETCH_MIN_SESSIONS, lookback=PREFETCH_LOOKBACK_SECONDS, interval=PREFETCH_INTERVAL,
+                 max_age=PREFETCH_MAX_AGE, min_hits=PREFETCH_MIN_HITS, temperature=PREFETCH_TEMPERATURE,
+                 max_tokens=PREFETCH_MAX_TOKENS, seed=None, concurrency=PREFETCH_CONCURRENCY):
+        self.cache = cache
+        self.chat_log = chat_log
+        # produce(messages, model, temperature, max_tokens) -> async iterator of deltas, bypassing the cache
+        self.produce = produce
+        self.system_prompts = system_prompts
+        self.warm = warm
+        self.top_k = top_k
+        self.min_sessions = min_sessions
+        self.lookback = lookback
+        self.interval = interval
+        self.max_age = max_age
+        self.min_hits = min_hits
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        # Sent with every request; part of the cache key
+        self.seed = seed
+        self.concurrency = concurrency
+        self.entries = {}
+        # key -> session count when retired; reconsidered once that many more sessions open with it
+        self.retired = {}
+        self.first_turns = 0
+        self.hits = 0
+        self.generated = 0
+        self.failures = 0
+        self.last_refresh = None
+        self._task = None
+
+    def messages(self, persona, prompt):
+        return [{"role": "system", "content": self.system_prompts[persona]}, {"role": "user", "content": prompt}]
+
+    def candidates(self, rows):
+        """Top questions per persona and model that opened enough sessions"""
+        per_persona = {}
+        for persona, model, prompt, sessions in rows:
+            if persona not in self.system_prompts or sessions < self.min_sessions or not prompt.strip():
+                continue
+            picked = per_persona.setdefault(persona, [])
+            if len(picked) < self.top_k:
+                picked.append((persona, model, prompt, sessions))
+        return [candidate for picked in per_persona.values() for candidate in picked]
+
+    def keys(self, model, messages):
+        """Cache key and namespace of a prefetched answer, made with the full request settings like any other"""
+        return cache_keys(model, messages, self.temperature, self.max_tokens, self.seed)
+
+    def due(self, persona, model, prompt, sessions):
+        """The entry to (re)generate for a candidate, or None if its cached answer is fresh or it is retired"""
+        if not self.cache.cacheable(self.temperature, self.seed):
+            # The cache would never serve answers made with these settings
+            return None
+        key, namespace = self.keys(model, self.messages(persona, prompt))
+        retired_at = self.retired.get(key)
+        if retired_at is not None:
+            if sessions < retired_at + self.min_sessions:
+                return None
+            del self.retired[key]
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = PrefetchEntry(persona, model, prompt, key, namespace, sessions)
+        entry.sessions = sessions
+        age = self.cache.age(key)
+        if age is not None and age < self.max_age:
+            return None
+        if entry.generated is not None and entry.hits < self.min_hits:
+            del self.entries[key]
+            self.retired[key] = sessions
+            return None
+        return entry
+
+    async def generate(self, entry):
+        parts = []
+        async with aclosing(self.produce(self.messages(entry.persona, entry.prompt), entry.model,
+                                         self.temperature, self.max_tokens)) as deltas:
+            async for delta in deltas:
+                parts.append(delta)
+        if parts:
+            await asyncio.to_thread(self.cache.put, entry.key, entry.namespace, "".join(parts))
+            entry.generated = time.time()
+            entry.hits = 0
+            self.generated += 1
+
+    async def refresh(self):
+        """Warm connections and bring the prefetched answers up to date"""
+        if self.warm is not None:
+            await self.warm()
+        rows = await asyncio.to_thread(self.chat_log.first_turns, time.time() - self.lookback)
+        due = [entry for entry in (self.due(*candidate) for candidate in self.candidates(rows)) if entry is not None]
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run(entry):
+            async with semaphore:
+                try:
+                    await self.generate(entry)
+                except Exception:
+                    self.failures += 1
+
+        await asyncio.gather(*(run(entry) for entry in due))
+        self.last_refresh = time.time()
+
+    def record_first_turn(self, model, messages, temperature, max_tokens):
+        """Count a conversation's opening request and whether a prefetched answer covers it"""
+        if len(messages) != 2:
+            return
+        self.first_turns += 1
+        entry = self.entries.get(cache_keys(model, messages, temperature, max_tokens, self.seed)[0])
+        if entry is not None and self.cache.age(entry.key) is not None:
+            entry.hits += 1
+            self.hits += 1
+
+    async def run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception:
+                self.failures += 1
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """Start refreshing in the background on the running loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        """Coverage of opening questions by prefetched answers"""
+        return {
+            "entries": len(self.entries),
+            "retired": len(self.retired),
+            "first_turns": self.first_turns,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.first_turns if self.first_turns else 0.0,
+            "generated": self.generated,
+            "failures": self.failures,
+            "last_refresh": self.last_refresh,
+        }
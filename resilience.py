@@ -0,0 +1,156 @@
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from functools import lru_cache
+
+# Retry and hedging settings for the streaming completion call
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "4"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "20"))
+HEDGE_ENABLED = os.getenv("HEDGE_REQUESTS", "0") == "1"
+HEDGE_QUANTILE = float(os.getenv("HEDGE_QUANTILE", "0.95"))
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "2.0"))
+HEDGE_MIN_SAMPLES = 20
+
+
+@lru_cache(maxsize=None)
+def retryable_errors():
+    """OpenAI errors worth retrying; the SDK is imported on first use to keep startup cheap"""
+    import openai
+
+    return (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+
+def retry_after_seconds(error):
+    """Server-requested delay from Retry-After / retry-after-ms headers, if any"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        return None
+    return None
+
+
+class ResilientStreamer:
+    """Retries and optional hedging around a stream of text deltas
+
+    A stream is only restarted before its first token arrives; once text has
+    been shown to the user a failure is raised, since a fresh completion would
+    not continue the same answer.
+    """
+
+    def __init__(self, max_attempts=RETRY_MAX_ATTEMPTS, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY,
+                 hedge=HEDGE_ENABLED, hedge_quantile=HEDGE_QUANTILE, hedge_default_delay=HEDGE_DEFAULT_DELAY):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_default_delay = hedge_default_delay
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._ttft = deque(maxlen=500)
+
+    def backoff(self, attempt, error=None):
+        """Full-jitter exponential backoff, never shorter than the server's Retry-After"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        requested = retry_after_seconds(error) if error is not None else None
+        if requested is not None:
+            delay = max(delay, min(requested, self.max_delay))
+        return delay
+
+    def hedge_delay(self):
+        """Observed TTFT quantile after which a duplicate request is started"""
+        if len(self._ttft) < HEDGE_MIN_SAMPLES:
+            return self.hedge_default_delay
+        samples = sorted(self._ttft)
+        return samples[min(len(samples) - 1, int(self.hedge_quantile * len(samples)))]
+
+    async def stream(self, open_stream):
+        """Yield deltas from open_stream(), retrying failures that happen before the first token"""
+        attempt = 0
+        while True:
+            try:
+                iterator, first = await self._first_token(open_stream)
+            except StopAsyncIteration:
+                return
+            except retryable_errors() as e:
+                attempt += 1
+                if attempt >= self.max_attempts:
+                    raise
+                self.retries += 1
+                await asyncio.sleep(self.backoff(attempt - 1, e))
+                continue
+            break
+
+        try:
+            yield first
+            async for delta in iterator:
+                yield delta
+        finally:
+            await _aclose(iterator)
+
+    async def _first_token(self, open_stream):
+        """Start the stream (and a hedge if it is slow); return the winner's iterator and first delta"""
+        start = time.monotonic()
+        primary = asyncio.ensure_future(_first(open_stream))
+        tasks = {primary}
+        started = [primary]
+        winner = None
+        try:
+            if self.hedge:
+                done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay())
+                if not done:
+                    self.hedges += 1
+                    hedge = asyncio.ensure_future(_first(open_stream))
+                    tasks.add(hedge)
+                    started.append(hedge)
+
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.hedge_wins += 1
+                        self._ttft.append(time.monotonic() - start)
+                        winner = task
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+            # A loser may still have got its first token (in the same round, or despite the cancel); close its stream too
+            losers = [task for task in started if task is not winner]
+            for result in await asyncio.gather(*losers, return_exceptions=True):
+                if not isinstance(result, BaseException):
+                    await _aclose(result[0])
+
+    def stats(self):
+        return {"retries": self.retries, "hedges": self.hedges, "hedge_wins": self.hedge_wins,
+                "hedge_delay": self.hedge_delay() if self.hedge else None}
+
+
+async def _first(open_stream):
+    iterator = open_stream().__aiter__()
+    try:
+        return iterator, await iterator.__anext__()
+    except BaseException:
+        await _aclose(iterator)
+        raise
+
+
+async def _aclose(iterator):
+    aclose = getattr(iterator, "aclose", None)
+    if aclose is not None:
+        await aclose()
@@ -0,0 +1,258 @@
+import asyncio
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from contextlib import aclosing
+
+# Response cache settings
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE", "1") == "1"
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "5000"))
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", str(24 * 3600)))
+# Only answers this deterministic are replayed (or any temperature with a fixed seed); sampled answers differ per request
+CACHE_MAX_TEMPERATURE = float(os.getenv("CACHE_MAX_TEMPERATURE", "0"))
+CACHE_PATH = os.getenv("CACHE_PATH", "response_cache.sqlite3")
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE", "0") == "1"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+
+# Replayed answers are streamed in chunks of this many characters
+REPLAY_CHUNK_CHARS = 24
+REPLAY_CHUNK_DELAY = float(os.getenv("CACHE_REPLAY_DELAY", "0.005"))
+
+
+def temperature_bucket(temperature):
+    """Temperatures within 0.1 of each other share cache entries"""
+    return round(float(temperature), 1)
+
+
+def _digest(data):
+    return hashlib.sha256(json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+
+def cache_keys(model, messages, temperature, max_tokens, seed=None):
+    """Exact key over the whole request, and the semantic namespace (everything but the last message)"""
+    bucket = temperature_bucket(temperature)
+    context = [(m["role"], m["content"]) for m in messages]
+    params = [model, bucket, int(max_tokens), seed]
+    return _digest([*params, context]), _digest([*params, context[:-1]])
+
+
+async def replay_stream(text, chunk_chars=REPLAY_CHUNK_CHARS, delay=REPLAY_CHUNK_DELAY):
+    """Yield a cached answer as a simulated stream of deltas"""
+    for start in range(0, len(text), chunk_chars):
+        if start and delay:
+            await asyncio.sleep(delay)
+        yield text[start:start + chunk_chars]
+
+
+class OpenAIEmbedder:
+    """Embeds text with the OpenAI embeddings endpoint"""
+
+    def __init__(self, client, model=EMBEDDING_MODEL):
+        self.client = client
+        self.model = model
+
+    async def embed(self, texts):
+        response = await self.client.embeddings.create(model=self.model, input=texts)
+        return [item.embedding for item in response.data]
+
+
+class CacheEntry:
+    """A cached answer with an optional unit-length embedding of its question"""
+
+    __slots__ = ("key", "namespace", "response", "created", "embedding")
+
+    def __init__(self, key, namespace, response, created, embedding=None):
+        self.key = key
+        self.namespace = namespace
+        self.response = response
+        self.created = created
+        self.embedding = embedding
+
+
+def _normalize(vector):
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return array("f", (x / norm for x in vector))
+
+
+class ResponseCache:
+    """Exact-match LRU with TTL, an optional semantic index and a SQLite backing store"""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS, path=CACHE_PATH,
+                 max_temperature=CACHE_MAX_TEMPERATURE, similarity_threshold=SEMANTIC_CACHE_THRESHOLD):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_temperature = max_temperature
+        self.similarity_threshold = similarity_threshold
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        # namespace -> {key: entry} for entries that have an embedding
+        self._semantic = {}
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, namespace TEXT NOT NULL, "
+                "response TEXT NOT NULL, created REAL NOT NULL, embedding BLOB)"
+            )
+            self._db.commit()
+            self._load()
+
+    def _load(self):
+        """Warm the in-memory LRU from disk, newest entries first"""
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            self._db.execute("DELETE FROM responses WHERE created < ?", (cutoff,))
+            # Rows over max_entries, e.g. left by a run with a larger limit, would never be loaded again
+            self._db.execute("DELETE FROM responses WHERE key NOT IN (SELECT key FROM responses ORDER BY created DESC LIMIT ?)",
+                             (self.max_entries,))
+            self._db.commit()
+            rows = self._db.execute(
+                "SELECT key, namespace, response, created, embedding FROM responses ORDER BY created DESC LIMIT ?",
+                (self.max_entries,),
+            ).fetchall()
+        for key, namespace, response, created, blob in reversed(rows):
+            embedding = array("f", blob) if blob else None
+            self._insert(CacheEntry(key, namespace, response, created, embedding))
+
+    def _insert(self, entry):
+        self._entries[entry.key] = entry
+        self._entries.move_to_end(entry.key)
+        if entry.embedding is not None:
+            self._semantic.setdefault(entry.namespace, {})[entry.key] = entry
+        while len(self._entries) > self.max_entries:
+            _, old = self._entries.popitem(last=False)
+            self._forget(old)
+
+    def _forget(self, entry):
+        """Drop an evicted or expired entry from the semantic index and from disk (committed by the caller)"""
+        if self._db is not None:
+            self._db.execute("DELETE FROM responses WHERE key = ?", (entry.key,))
+        bucket = self._semantic.get(entry.namespace)
+        if bucket is not None:
+            bucket.pop(entry.key, None)
+            if not bucket:
+                del self._semantic[entry.namespace]
+
+    def cacheable(self, temperature, seed=None):
+        return seed is not None or temperature_bucket(temperature) <= self.max_temperature
+
+    def get(self, key):
+        """Exact lookup, honoring TTL"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry.created > self.ttl:
+                del self._entries[key]
+                self._forget(entry)
+                if self._db is not None:
+                    self._db.commit()
+                return None
+            self._entries.move_to_end(key)
+            return entry.response
+
+    def age(self, key):
+        """Seconds since key was cached, or None if it is missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return None
+        age = time.time() - entry.created
+        return age if age <= self.ttl else None
+
+    def get_similar(self, namespace, embedding):
+        """Best semantic match above the similarity threshold within a namespace"""
+        query = _normalize(embedding)
+        now = time.time()
+        best, best_score = None, self.similarity_threshold
+        with self._lock:
+            for entry in list(self._semantic.get(namespace, {}).values()):
+                if now - entry.created > self.ttl:
+                    continue
+                score = sum(a * b for a, b in zip(query, entry.embedding))
+                if score >= best_score:
+                    best, best_score = entry, score
+        return best.response if best is not None else None
+
+    def put(self, key, namespace, response, embedding=None):
+        """Store a response in memory and write it through to disk"""
+        entry = CacheEntry(key, namespace, response, time.time(), _normalize(embedding) if embedding else None)
+        with self._lock:
+            self._insert(entry)
+            if self._db is not None:
+                blob = entry.embedding.tobytes() if entry.embedding is not None else None
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                    (key, namespace, response, entry.created, blob),
+                )
+                self._db.commit()
+
+    async def stream(self, messages, model, temperature, max_tokens, producer, seed=None, embedder=None):
+        """Serve from cache as a simulated stream, or run producer() and cache its full output
+
+        producer is a zero-argument callable returning an async iterator of
+        text deltas; anything it raises propagates and nothing is cached.
+        """
+        if not self.cacheable(temperature, seed):
+            async with aclosing(producer()) as deltas:
+                async for delta in deltas:
+                    yield delta
+            return
+
+        key, namespace = cache_keys(model, messages, temperature, max_tokens, seed)
+        cached = self.get(key)
+        if cached is not None:
+            self.exact_hits += 1
+        embedding = None
+        if cached is None and embedder is not None:
+            try:
+                embedding = (await embedder.embed([messages[-1]["content"]]))[0]
+            except Exception:
+                embedding = None
+            if embedding is not None:
+                cached = self.get_similar(namespace, embedding)
+                if cached is not None:
+                    self.semantic_hits += 1
+
+        if cached is not None:
+            async for delta in replay_stream(cached):
+                yield delta
+            return
+
+        self.misses += 1
+        parts = []
+        async with aclosing(producer()) as deltas:
+            async for delta in deltas:
+                parts.append(delta)
+                yield delta
+        if parts:
+            await asyncio.to_thread(self.put, key, namespace, "".join(parts), embedding)
+
+    def stats(self):
+        """Hit-rate metrics"""
+        hits = self.exact_hits + self.semantic_hits
+        total = hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": hits / total if total else 0.0,
+        }
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
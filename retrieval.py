@@ -0,0 +1,388 @@
+"""Retrieval-augmented answers from a local, memory-mapped vector index
+
+Ingest documents, then point the app at the index with RAG_INDEX_PATH:
+
+    python retrieval.py ingest docs/ --index rag_index
+    python retrieval.py build-ivf --index rag_index      # optional, for approximate search
+    python retrieval.py query "How do I reset my router?" --index rag_index
+
+Vectors are float32 rows in vectors.f32 (searched through np.memmap, so the
+index does not need to fit in RAM); chunk texts live in chunks.sqlite3.
+"""
+import argparse
+import json
+import math
+import os
+import re
+import sqlite3
+import sys
+import time
+import zlib
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed when RAG is used (gradio installs it anyway)
+    np = None
+
+from context_window import MESSAGE_OVERHEAD_TOKENS, count_tokens
+
+# Retrieval settings; RAG is off unless RAG_INDEX_PATH points at an ingested index
+RAG_INDEX_PATH = os.getenv("RAG_INDEX_PATH", "")
+RAG_PERSONAS = [p.strip() for p in os.getenv("RAG_PERSONAS", "Tech Support,Academic Tutor").split(",") if p.strip()]
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "4"))
+RAG_MIN_SCORE = float(os.getenv("RAG_MIN_SCORE", "0.05"))
+# Prompt tokens reserved for retrieved chunks whenever a grounded persona is used
+RAG_MAX_TOKENS = int(os.getenv("RAG_MAX_TOKENS", "1500"))
+RAG_EMBEDDER = os.getenv("RAG_EMBEDDER", "hashing")
+RAG_NPROBE = int(os.getenv("RAG_NPROBE", "8"))
+RAG_CHUNK_WORDS = int(os.getenv("RAG_CHUNK_WORDS", "200"))
+RAG_CHUNK_OVERLAP = int(os.getenv("RAG_CHUNK_OVERLAP", "40"))
+RAG_BATCH_SIZE = int(os.getenv("RAG_BATCH_SIZE", "256"))
+
+# Rows scored per matrix product in exact search, bounding memory on large indexes
+SEARCH_BLOCK_ROWS = 65536
+DOCUMENT_EXTENSIONS = (".txt", ".md", ".rst", ".html", ".csv", ".json")
+CONTEXT_PREFIX = "Use the following reference material if it is relevant. Cite the source names you rely on.\n\n"
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def chunk_text(text, words=RAG_CHUNK_WORDS, overlap=RAG_CHUNK_OVERLAP):
+    """Split text into overlapping windows of about `words` words"""
+    tokens = text.split()
+    step = max(1, words - overlap)
+    for start in range(0, max(1, len(tokens) - overlap), step):
+        chunk = " ".join(tokens[start:start + words])
+        if chunk:
+            yield chunk
+
+
+class HashingEmbedder:
+    """Local embedder: signed feature hashing of words and word pairs, L2-normalized
+
+    Needs no model download and embeds thousands of chunks per second;
+    swap in a neural model with RAG_EMBEDDER=sentence-transformers:<name>.
+    """
+
+    def __init__(self, dim=1024):
+        self.dim = dim
+
+    def _features(self, text):
+        words = _WORD.findall(text.lower())
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            counts = {}
+            for feature in self._features(text):
+                counts[feature] = counts.get(feature, 0) + 1
+            for feature, count in counts.items():
+                h = zlib.crc32(feature.encode("utf-8"))
+                # Sublinear term frequency, so repeated words do not drown out the rest
+                weight = 1.0 + math.log(count)
+                vectors[row, h % self.dim] += weight if h >> 31 else -weight
+        return _normalize(vectors)
+
+
+class SentenceTransformerEmbedder:
+    """Local neural embedder (pip install sentence-transformers)"""
+
+    def __init__(self, model_name="all-MiniLM-L6-v2"):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name)
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def embed(self, texts):
+        return _normalize(np.asarray(self.model.encode(list(texts), batch_size=64), dtype=np.float32))
+
+
+def create_embedder(spec=RAG_EMBEDDER):
+    """Embedder from a spec: "hashing[:dim]" or "sentence-transformers[:model]" """
+    kind, _, arg = spec.partition(":")
+    if kind == "hashing":
+        return HashingEmbedder(int(arg) if arg else 1024)
+    if kind == "sentence-transformers":
+        return SentenceTransformerEmbedder(arg or "all-MiniLM-L6-v2")
+    raise ValueError(f"Unknown RAG_EMBEDDER {spec!r}")
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _top_k(scores, k):
+    """Indices of the k largest scores, best first"""
+    if len(scores) <= k:
+        return np.argsort(-scores)
+    part = np.argpartition(-scores, k)[:k]
+    return part[np.argsort(-scores[part])]
+
+
+class VectorIndex:
+    """Append-only float32 vector file searched through np.memmap, with an optional IVF layout
+
+    Exact search scores the whole file in blocks. build_ivf() clusters the
+    vectors with k-means and writes them grouped by cluster, so approximate
+    search reads only the nprobe closest clusters as contiguous slices.
+    """
+
+    def __init__(self, path, dim):
+        self.path = path
+        self.dim = dim
+        os.makedirs(path, exist_ok=True)
+        self._vectors = None
+        self._ivf = None
+
+    @classmethod
+    def open(cls, path):
+        with open(os.path.join(path, "index.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        return cls(path, meta["dim"])
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def __len__(self):
+        path = self._file("vectors.f32")
+        return os.path.getsize(path) // (4 * self.dim) if os.path.exists(path) else 0
+
+    def add(self, vectors):
+        """Append normalized float32 vectors; returns the id of the first one"""
+        first = len(self)
+        with open(self._file("vectors.f32"), "ab") as f:
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        with open(self._file("index.json"), "w", encoding="utf-8") as f:
+            json.dump({"dim": self.dim, "count": first + len(vectors)}, f)
+        self._vectors = None
+        self._ivf = None
+        return first
+
+    def vectors(self):
+        if self._vectors is None or len(self._vectors) != len(self):
+            self._vectors = np.memmap(self._file("vectors.f32"), dtype=np.float32, mode="r", shape=(len(self), self.dim))
+        return self._vectors
+
+    def search(self, query, k=RAG_TOP_K, nprobe=None):
+        """(ids, scores) of the k most similar vectors; approximate when an IVF layout exists and nprobe is set"""
+        if not len(self):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        if nprobe and self.load_ivf():
+            return self._search_ivf(query, k, nprobe)
+        vectors = self.vectors()
+        best_ids, best_scores = [], []
+        for start in range(0, len(vectors), SEARCH_BLOCK_ROWS):
+            scores = vectors[start:start + SEARCH_BLOCK_ROWS] @ query
+            top = _top_k(scores, k)
+            best_ids.append(top + start)
+            best_scores.append(scores[top])
+        ids, scores = np.concatenate(best_ids), np.concatenate(best_scores)
+        top = _top_k(scores, k)
+        return ids[top], scores[top]
+
+    def build_ivf(self, n_lists=None, sample=100000, iterations=10, seed=0):
+        """Cluster the vectors (spherical k-means on a sample) and write them grouped by cluster"""
+        vectors = self.vectors()
+        n = len(vectors)
+        n_lists = n_lists or max(1, int(np.sqrt(n)))
+        rng = np.random.default_rng(seed)
+        train = np.asarray(vectors[np.sort(rng.choice(n, size=min(n, sample), replace=False))])
+        centroids = train[rng.choice(len(train), size=n_lists, replace=False)]
+        for _ in range(iterations):
+            assign = np.argmax(train @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, train)
+            empty = np.bincount(assign, minlength=n_lists) == 0
+            sums[empty] = centroids[empty]
+            centroids = _normalize(sums)
+
+        assign = np.empty(n, dtype=np.int32)
+        for start in range(0, n, SEARCH_BLOCK_ROWS):
+            assign[start:start + SEARCH_BLOCK_ROWS] = np.argmax(vectors[start:start + SEARCH_BLOCK_ROWS] @ centroids.T, axis=1)
+        order = np.argsort(assign, kind="stable").astype(np.int64)
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=n_lists))]).astype(np.int64)
+        grouped = np.memmap(self._file("ivf_vectors.f32"), dtype=np.float32, mode="w+", shape=(n, self.dim))
+        for start in range(0, n, SEARCH_BLOCK_ROWS):
+            grouped[start:start + SEARCH_BLOCK_ROWS] = vectors[order[start:start + SEARCH_BLOCK_ROWS]]
+        grouped.flush()
+        del grouped
+        np.savez(self._file("ivf.npz"), centroids=centroids, order=order, offsets=offsets, count=n)
+        self._ivf = None
+
+    def load_ivf(self):
+        """IVF layout if one was built for the current vectors"""
+        if self._ivf is None:
+            path = self._file("ivf.npz")
+            if not os.path.exists(path):
+                return None
+            data = np.load(path)
+            if int(data["count"]) != len(self):
+                return None  # vectors were added since; fall back to exact search
+            grouped = np.memmap(self._file("ivf_vectors.f32"), dtype=np.float32, mode="r", shape=(len(self), self.dim))
+            self._ivf = (data["centroids"], data["order"], data["offsets"], grouped)
+        return self._ivf
+
+    def _search_ivf(self, query, k, nprobe):
+        centroids, order, offsets, grouped = self._ivf
+        probes = _top_k(centroids @ query, nprobe)
+        ids, scores = [], []
+        for c in probes:
+            start, end = offsets[c], offsets[c + 1]
+            if start == end:
+                continue
+            ids.append(order[start:end])
+            scores.append(grouped[start:end] @ query)
+        if not ids:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        ids, scores = np.concatenate(ids), np.concatenate(scores)
+        top = _top_k(scores, k)
+        return ids[top], scores[top]
+
+
+class ChunkStore:
+    """Chunk texts and their source names, keyed by vector id"""
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS chunks (id INTEGER PRIMARY KEY, source TEXT NOT NULL, text TEXT NOT NULL)")
+
+    def add(self, first_id, sources, texts):
+        self.db.executemany("INSERT INTO chunks VALUES (?, ?, ?)",
+                            [(first_id + i, source, text) for i, (source, text) in enumerate(zip(sources, texts))])
+        self.db.commit()
+
+    def get(self, ids):
+        ids = [int(i) for i in ids]
+        if not ids:
+            return {}
+        rows = self.db.execute(f"SELECT id, source, text FROM chunks WHERE id IN ({','.join('?' * len(ids))})", ids)
+        return {row[0]: (row[1], row[2]) for row in rows}
+
+
+def iter_documents(paths):
+    """(name, text) for every document file under paths"""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    if name.lower().endswith(DOCUMENT_EXTENSIONS):
+                        yield from iter_documents([os.path.join(root, name)])
+        else:
+            with open(path, encoding="utf-8", errors="replace") as f:
+                yield os.path.relpath(path), f.read()
+
+
+def ingest(paths, index_path, embedder=None, batch_size=RAG_BATCH_SIZE):
+    """Chunk, embed in batches and append documents to the index; returns ingestion stats"""
+    embedder = embedder or create_embedder()
+    index = VectorIndex(index_path, embedder.dim)
+    store = ChunkStore(os.path.join(index_path, "chunks.sqlite3"))
+    start = time.perf_counter()
+    documents = chunks = nbytes = 0
+    sources, texts = [], []
+
+    def flush():
+        first = index.add(embedder.embed(texts))
+        store.add(first, sources, texts)
+        sources.clear()
+        texts.clear()
+
+    for name, text in iter_documents(paths):
+        documents += 1
+        nbytes += len(text.encode("utf-8"))
+        for chunk in chunk_text(text):
+            sources.append(name)
+            texts.append(chunk)
+            chunks += 1
+            if len(texts) >= batch_size:
+                flush()
+    if texts:
+        flush()
+    elapsed = time.perf_counter() - start
+    return {"documents": documents, "chunks": chunks, "bytes": nbytes, "seconds": round(elapsed, 3),
+            "chunks_per_s": round(chunks / elapsed, 1) if elapsed else None,
+            "mb_per_s": round(nbytes / 1e6 / elapsed, 2) if elapsed else None}
+
+
+class Retriever:
+    """Top-k chunk retrieval for grounded personas, packed into a token budget"""
+
+    def __init__(self, index_path=RAG_INDEX_PATH, embedder=None, personas=RAG_PERSONAS, k=RAG_TOP_K,
+                 min_score=RAG_MIN_SCORE, max_tokens=RAG_MAX_TOKENS, nprobe=RAG_NPROBE):
+        if np is None:
+            raise RuntimeError("RAG needs numpy (pip install numpy)")
+        self.index = VectorIndex.open(index_path)
+        self.store = ChunkStore(os.path.join(index_path, "chunks.sqlite3"))
+        self.embedder = embedder or create_embedder()
+        if self.embedder.dim != self.index.dim:
+            raise ValueError(f"RAG_EMBEDDER has dimension {self.embedder.dim}, the index {self.index.dim}")
+        self.personas = set(personas)
+        self.k = k
+        self.min_score = min_score
+        self.max_tokens = max_tokens
+        self.nprobe = nprobe
+        self.queries = 0
+        self.hits = 0
+
+    def applies_to(self, persona):
+        return persona in self.personas
+
+    def search(self, question):
+        """[(score, source, text)] for the best chunks above min_score"""
+        query = self.embedder.embed([question])[0]
+        ids, scores = self.index.search(query, self.k, self.nprobe)
+        chunks = self.store.get(ids)
+        return [(float(score), *chunks[int(i)]) for i, score in zip(ids, scores)
+                if score >= self.min_score and int(i) in chunks]
+
+    def retrieve(self, question, model="gpt-4o-mini"):
+        """A system message with the best chunks that fit max_tokens, or None"""
+        self.queries += 1
+        parts = []
+        used = count_tokens(CONTEXT_PREFIX, model) + MESSAGE_OVERHEAD_TOKENS
+        for _, source, text in self.search(question):
+            part = f"[{source}]\n{text}"
+            tokens = count_tokens(part, model) + 2
+            if used + tokens > self.max_tokens:
+                break
+            parts.append(part)
+            used += tokens
+        if not parts:
+            return None
+        self.hits += 1
+        return {"role": "system", "content": CONTEXT_PREFIX + "\n\n".join(parts)}
+
+    def stats(self):
+        return {"vectors": len(self.index), "queries": self.queries, "hits": self.hits}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and query the local RAG index")
+    commands = parser.add_subparsers(dest="command", required=True)
+    ingest_parser = commands.add_parser("ingest", help="chunk, embed and add documents")
+    ingest_parser.add_argument("paths", nargs="+")
+    ivf_parser = commands.add_parser("build-ivf", help="cluster the index for approximate search")
+    ivf_parser.add_argument("--lists", type=int)
+    query_parser = commands.add_parser("query", help="show the chunks retrieved for a question")
+    query_parser.add_argument("question")
+    for sub in (ingest_parser, ivf_parser, query_parser):
+        sub.add_argument("--index", default=RAG_INDEX_PATH or "rag_index")
+    args = parser.parse_args()
+
+    if np is None:
+        sys.exit("RAG needs numpy (pip install numpy)")
+    if args.command == "ingest":
+        print(json.dumps(ingest(args.paths, args.index)))
+    elif args.command == "build-ivf":
+        VectorIndex.open(args.index).build_ivf(args.lists)
+    else:
+        for score, source, text in Retriever(args.index).search(args.question):
+            print(f"{score:.3f}  {source}: {text[:200]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+import json
+import os
+import random
+import time
+from contextlib import aclosing
+
+from resilience import retryable_errors
+
+# Models offered by the default backend (OpenAI, or OPENAI_BASE_URL) when MODEL_BACKENDS is not set
+DEFAULT_MODELS = ["gpt-4o-mini", "gpt-4o", "gpt-4-turbo", "gpt-4", "gpt-3.5-turbo"]
+
+# JSON list of backends, or a path to a JSON file, e.g.
+# [{"name": "openai", "models": ["gpt-4o-mini"]},
+#  {"name": "local", "base_url": "http://127.0.0.1:8080/v1", "api_key": "none", "models": ["llama-3.1-8b"]}]
+MODEL_BACKENDS = os.getenv("MODEL_BACKENDS", "")
+
+# Routing: smoothing of the EWMAs, seconds of TTFT one unit of error rate is worth,
+# consecutive failures that open a backend's circuit and for how long, and exploration rate
+ROUTER_EWMA_ALPHA = float(os.getenv("ROUTER_EWMA_ALPHA", "0.2"))
+ROUTER_ERROR_PENALTY = float(os.getenv("ROUTER_ERROR_PENALTY", "10"))
+ROUTER_FAILURE_THRESHOLD = int(os.getenv("ROUTER_FAILURE_THRESHOLD", "3"))
+ROUTER_COOLDOWN_SECONDS = float(os.getenv("ROUTER_COOLDOWN_SECONDS", "30"))
+ROUTER_EXPLORE = float(os.getenv("ROUTER_EXPLORE", "0.05"))
+# TTFT assumed for a backend before it has served anything
+ROUTER_INITIAL_TTFT = 0.5
+
+
+class BackendUnavailable(Exception):
+    """A backend cannot take this request (e.g. it needs an API key the user has not given)"""
+
+
+class Backend:
+    """An OpenAI-compatible endpoint and its observed latency and health"""
+
+    __slots__ = ("name", "base_url", "api_key", "models", "ttft", "error_rate", "inflight",
+                 "failures", "open_until", "requests", "errors")
+
+    def __init__(self, name, base_url=None, api_key=None, models=()):
+        self.name = name
+        self.base_url = base_url
+        # None means the user's own API key is used
+        self.api_key = api_key
+        self.models = list(models)
+        self.ttft = None
+        self.error_rate = 0.0
+        self.inflight = 0
+        self.failures = 0
+        self.open_until = 0.0
+        self.requests = 0
+        self.errors = 0
+
+    @classmethod
+    def from_config(cls, config):
+        api_key = config.get("api_key")
+        if config.get("api_key_env"):
+            api_key = os.getenv(config["api_key_env"])
+        return cls(config["name"], base_url=config.get("base_url"), api_key=api_key,
+                   models=config.get("models", DEFAULT_MODELS))
+
+    def score(self, error_penalty=ROUTER_ERROR_PENALTY):
+        """Expected wait in seconds: smoothed TTFT scaled by requests already in flight, plus an error penalty"""
+        ttft = self.ttft if self.ttft is not None else ROUTER_INITIAL_TTFT
+        return ttft * (1 + self.inflight) + error_penalty * self.error_rate
+
+
+def load_backends(spec=MODEL_BACKENDS):
+    """Backends from a MODEL_BACKENDS value, defaulting to the single OpenAI endpoint"""
+    if not spec.strip():
+        return [Backend("openai", base_url=os.getenv("OPENAI_BASE_URL"), models=DEFAULT_MODELS)]
+    if not spec.lstrip().startswith("["):
+        with open(spec, encoding="utf-8") as f:
+            spec = f.read()
+    return [Backend.from_config(config) for config in json.loads(spec)]
+
+
+class ModelRouter:
+    """Picks the backend for each request from EWMAs of TTFT and error rate and the current queue depth
+
+    A backend that fails before its first token is skipped for the rest of
+    the request, so a request fails over to the next best backend at once;
+    after repeated failures its circuit opens for a cooldown. A small share
+    of requests goes to a random healthy backend so stale estimates recover.
+    """
+
+    def __init__(self, backends, alpha=ROUTER_EWMA_ALPHA, error_penalty=ROUTER_ERROR_PENALTY,
+                 failure_threshold=ROUTER_FAILURE_THRESHOLD, cooldown=ROUTER_COOLDOWN_SECONDS, explore=ROUTER_EXPLORE):
+        self.backends = list(backends)
+        self.alpha = alpha
+        self.error_penalty = error_penalty
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.explore = explore
+        self.failovers = 0
+
+    def models(self):
+        """All models served by any backend, in configuration order"""
+        return list(dict.fromkeys(model for backend in self.backends for model in backend.models))
+
+    def backends_for(self, model):
+        return [backend for backend in self.backends if model in backend.models]
+
+    def choose(self, model, exclude=()):
+        """Best-scoring backend for model not in exclude, or None if none is left"""
+        candidates = [b for b in self.backends_for(model) if b not in exclude]
+        if not candidates:
+            return None
+        now = time.monotonic()
+        healthy = [b for b in candidates if b.open_until <= now]
+        if not healthy:
+            # Every circuit is open: probe the one that has been cooling down longest
+            return min(candidates, key=lambda b: b.open_until)
+        if len(healthy) > 1 and random.random() < self.explore:
+            return random.choice(healthy)
+        return min(healthy, key=lambda b: b.score(self.error_penalty))
+
+    def _observe(self, backend, error, ttft=None):
+        backend.error_rate += self.alpha * ((1.0 if error else 0.0) - backend.error_rate)
+        if ttft is not None:
+            backend.ttft = ttft if backend.ttft is None else backend.ttft + self.alpha * (ttft - backend.ttft)
+
+    def record_success(self, backend, ttft):
+        backend.requests += 1
+        backend.failures = 0
+        backend.open_until = 0.0
+        self._observe(backend, False, ttft)
+
+    def record_failure(self, backend):
+        backend.requests += 1
+        backend.errors += 1
+        backend.failures += 1
+        if backend.failures >= self.failure_threshold:
+            backend.open_until = time.monotonic() + self.cooldown
+        self._observe(backend, True)
+
+    async def stream(self, model, open_stream):
+        """Yield deltas from open_stream(backend) on the best backend, failing over until one produces a token"""
+        tried = set()
+        error = None
+        while True:
+            backend = self.choose(model, tried)
+            if backend is None:
+                if error is not None:
+                    raise error
+                raise BackendUnavailable(f"No backend serves model {model!r}")
+            tried.add(backend)
+            if error is not None:
+                self.failovers += 1
+
+            backend.inflight += 1
+            start = time.monotonic()
+            first_token = False
+            try:
+                async with aclosing(open_stream(backend)) as deltas:
+                    async for delta in deltas:
+                        if not first_token:
+                            first_token = True
+                            self.record_success(backend, time.monotonic() - start)
+                        yield delta
+                if not first_token:
+                    self.record_success(backend, time.monotonic() - start)
+                return
+            except (BackendUnavailable, *retryable_errors()) as e:
+                if first_token:
+                    # Text has already been shown, so the stream cannot move to another backend
+                    self._observe(backend, True)
+                    raise
+                if not isinstance(e, BackendUnavailable):
+                    self.record_failure(backend)
+                error = e
+            except Exception:
+                self.record_failure(backend)
+                raise
+            finally:
+                backend.inflight -= 1
+
+    def stats(self):
+        """Per-backend routing state for the status bar and /metrics"""
+        now = time.monotonic()
+        return {
+            backend.name: {
+                "ttft": backend.ttft,
+                "error_rate": backend.error_rate,
+                "inflight": backend.inflight,
+                "requests": backend.requests,
+                "errors": backend.errors,
+                "open": backend.open_until > now,
+            }
+            for backend in self.backends
+        }
+
+    def export(self):
+        """Prometheus text lines for the per-backend gauges and counters"""
+        stats = self.stats()
+        lines = []
+        for name, help_text, kind, field in (
+            ("chat_backend_ttft_ewma_seconds", "Smoothed time to first token per backend", "gauge", "ttft"),
+            ("chat_backend_error_rate", "Smoothed error rate per backend", "gauge", "error_rate"),
+            ("chat_backend_inflight", "Requests in flight per backend", "gauge", "inflight"),
+            ("chat_backend_requests_total", "Requests routed per backend", "counter", "requests"),
+            ("chat_backend_errors_total", "Failed requests per backend", "counter", "errors"),
+        ):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            for backend, values in stats.items():
+                value = values[field]
+                if value is not None:
+                    lines.append(f'{name}{{backend="{backend}"}} {value:.6g}')
+        return lines
@@ -0,0 +1,240 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+
+# Admission control between the UI and the upstream API
+MAX_CONCURRENT_STREAMS = int(os.getenv("MAX_CONCURRENT_STREAMS", "32"))
+KEY_REQUESTS_PER_MIN = float(os.getenv("KEY_REQUESTS_PER_MIN", "500"))
+KEY_TOKENS_PER_MIN = float(os.getenv("KEY_TOKENS_PER_MIN", "200000"))
+QUEUE_POLL_SECONDS = 1.0
+
+# Number of recent wait times kept for percentile reporting
+WAIT_SAMPLES = 1000
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at rate_per_min
+
+    reserve() takes tokens immediately, going into debt if needed, and returns
+    how long the caller must wait; that keeps callers ordered first come,
+    first served without a separate queue.
+    """
+
+    def __init__(self, rate_per_min, capacity=None):
+        self.rate = rate_per_min / 60.0
+        self.capacity = capacity or rate_per_min
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount):
+        """Take amount tokens and return the seconds until they are actually available"""
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+        if self.tokens >= 0 or self.rate <= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    def refund(self, amount):
+        """Give back tokens that were reserved but not used"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+async def _wait_or_cancel(timeout, cancel, future=None):
+    """Wait up to timeout seconds for future (if any), returning early once the cancel event is set"""
+    waiters = set() if future is None else {future}
+    cancelled = None
+    if cancel is not None:
+        cancelled = asyncio.ensure_future(cancel.wait())
+        waiters.add(cancelled)
+    if not waiters:
+        await asyncio.sleep(timeout)
+        return
+    try:
+        await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        if cancelled is not None:
+            cancelled.cancel()
+
+
+class Ticket:
+    """One request's passage through admission control"""
+
+    def __init__(self, controller, session_id, key, tokens):
+        self.controller = controller
+        self.session_id = session_id
+        self.key = key
+        self.tokens = tokens
+        self.created = time.monotonic()
+        self.admitted = False
+        self.released = False
+        self.wait_time = 0.0
+        self._future = None
+
+    async def wait(self, cancel=None):
+        """Wait for admission, yielding ("rate", seconds) and ("queue", position) updates
+
+        Returns without admission as soon as the optional cancel event is
+        set, rather than at the end of the current delay or poll.
+        """
+        controller = self.controller
+        delay = controller.reserve_rate(self.key, self.tokens)
+        if delay > 0:
+            yield "rate", delay
+            await _wait_or_cancel(delay, cancel)
+            if cancel is not None and cancel.is_set():
+                return
+
+        if controller.try_acquire():
+            self._admit()
+            return
+
+        self._future = asyncio.get_running_loop().create_future()
+        controller.enqueue(self)
+        try:
+            last_position = None
+            while not self._future.done():
+                if cancel is not None and cancel.is_set():
+                    return
+                position = controller.position(self)
+                if position != last_position:
+                    last_position = position
+                    yield "queue", position
+                await _wait_or_cancel(QUEUE_POLL_SECONDS, cancel, self._future)
+            self._admit()
+        finally:
+            if not self.admitted:
+                if self._future.done() and not self._future.cancelled():
+                    # Slot was granted after the caller gave up; hand it on
+                    controller.release_slot()
+                else:
+                    self._future.cancel()
+                    controller.dequeue(self)
+
+    def _admit(self):
+        self.admitted = True
+        self.wait_time = time.monotonic() - self.created
+        self.controller.record_wait(self.wait_time)
+
+    def release(self, used_tokens=None):
+        """Free the concurrency slot and refund unused reserved tokens"""
+        if self.released:
+            return
+        self.released = True
+        if self.admitted:
+            self.controller.release_slot()
+        if used_tokens is not None and used_tokens < self.tokens:
+            self.controller.refund_tokens(self.key, self.tokens - used_tokens)
+
+
+class AdmissionController:
+    """Global concurrency limit, per-key request/token rate limits and a fair queue across sessions"""
+
+    def __init__(self, max_concurrent=MAX_CONCURRENT_STREAMS, requests_per_min=KEY_REQUESTS_PER_MIN,
+                 tokens_per_min=KEY_TOKENS_PER_MIN):
+        self.max_concurrent = max_concurrent
+        self.requests_per_min = requests_per_min
+        self.tokens_per_min = tokens_per_min
+        self.active = 0
+        self.admitted = 0
+        self.max_queue_depth = 0
+        self.rate_limited = 0
+        self._queues = OrderedDict()
+        self._buckets = {}
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+
+    def ticket(self, session_id, key, tokens):
+        """Create a ticket for a request estimated to use `tokens` (prompt + max_tokens)"""
+        return Ticket(self, session_id, key, tokens)
+
+    def _key_buckets(self, key):
+        buckets = self._buckets.get(key)
+        if buckets is None:
+            buckets = self._buckets[key] = (TokenBucket(self.requests_per_min), TokenBucket(self.tokens_per_min))
+        return buckets
+
+    def reserve_rate(self, key, tokens):
+        requests, token_bucket = self._key_buckets(key)
+        delay = max(requests.reserve(1), token_bucket.reserve(tokens))
+        if delay > 0:
+            self.rate_limited += 1
+        return delay
+
+    def refund_tokens(self, key, tokens):
+        self._key_buckets(key)[1].refund(tokens)
+
+    def try_acquire(self):
+        if self.active < self.max_concurrent and not self._queues:
+            self.active += 1
+            self.admitted += 1
+            return True
+        return False
+
+    def enqueue(self, ticket):
+        self._queues.setdefault(ticket.session_id, deque()).append(ticket)
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth())
+
+    def dequeue(self, ticket):
+        queue = self._queues.get(ticket.session_id)
+        if queue is not None and ticket in queue:
+            queue.remove(ticket)
+            if not queue:
+                del self._queues[ticket.session_id]
+
+    def release_slot(self):
+        self.active -= 1
+        self._grant_next()
+
+    def _grant_next(self):
+        """Hand free slots to queued tickets, one session at a time in round-robin order"""
+        while self.active < self.max_concurrent and self._queues:
+            session_id, queue = next(iter(self._queues.items()))
+            ticket = queue.popleft()
+            if queue:
+                self._queues.move_to_end(session_id)
+            else:
+                del self._queues[session_id]
+            if ticket._future.done():
+                continue
+            self.active += 1
+            self.admitted += 1
+            ticket._future.set_result(None)
+
+    def position(self, ticket):
+        """1-based position of a queued ticket under round-robin service"""
+        index = self._queues[ticket.session_id].index(ticket)
+        ahead = index
+        before = True
+        for session_id, queue in self._queues.items():
+            if session_id == ticket.session_id:
+                before = False
+                continue
+            ahead += min(len(queue), index + 1 if before else index)
+        return ahead + 1
+
+    def queue_depth(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def record_wait(self, seconds):
+        self._waits.append(seconds)
+
+    def stats(self):
+        """Queue depth and wait-time metrics"""
+        waits = sorted(self._waits)
+        pct = lambda p: waits[min(len(waits) - 1, int(p * len(waits)))] if waits else 0.0  # noqa: E731
+        return {
+            "active": self.active,
+            "queue_depth": self.queue_depth(),
+            "max_queue_depth": self.max_queue_depth,
+            "admitted": self.admitted,
+            "rate_limited": self.rate_limited,
+            "wait_p50": pct(0.50),
+            "wait_p95": pct(0.95),
+            "wait_max": waits[-1] if waits else 0.0,
+        }
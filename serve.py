@@ -0,0 +1,189 @@
+"""Production launcher: several app.py worker processes behind one port
+
+Each worker is a uvicorn process serving app.create_app() on a private port.
+A small reverse proxy on the public port pins every browser to one worker
+with a cookie, because Gradio's queue (join request + event stream) and
+served files live in the worker that created them. Conversation state is
+kept in the shared STATE_BACKEND=sqlite store, so if a worker goes away
+its sessions continue on another one.
+
+    python serve.py --workers 4 --port 7860
+"""
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+import zlib
+
+COOKIE_NAME = "chat_worker"
+HEADER_LIMIT = 64 * 1024
+
+
+def start_workers(count, host, first_port):
+    """Spawn uvicorn workers on consecutive private ports"""
+    env = dict(os.environ, STATE_BACKEND=os.getenv("STATE_BACKEND", "sqlite"))
+    workers = []
+    for i in range(count):
+        port = first_port + i
+        cmd = [sys.executable, "-m", "uvicorn", "app:create_app", "--factory", "--host", host, "--port", str(port),
+               "--log-level", "warning"]
+        workers.append((port, subprocess.Popen(cmd, env=env, cwd=os.path.dirname(os.path.abspath(__file__)))))
+    return workers
+
+
+async def wait_until_ready(host, ports, timeout=120):
+    deadline = time.monotonic() + timeout
+    for port in ports:
+        while True:
+            try:
+                _, writer = await asyncio.open_connection(host, port)
+                writer.close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"worker on port {port} did not start")
+                await asyncio.sleep(0.2)
+
+
+def worker_from_cookie(head, count):
+    """Worker index from the chat_worker cookie, if present and valid"""
+    for line in head.split(b"\r\n")[1:]:
+        name, _, value = line.partition(b":")
+        if name.strip().lower() != b"cookie":
+            continue
+        for part in value.split(b";"):
+            key, _, val = part.strip().partition(b"=")
+            if key == COOKIE_NAME.encode() and val.isdigit() and int(val) < count:
+                return int(val)
+    return None
+
+
+def worker_for_peer(peer, count):
+    """Worker index for a client without the cookie, the same for every connection from its address
+
+    All of a new browser's first requests (page, queue join, event stream)
+    may arrive before any Set-Cookie comes back, so they must not be spread.
+    """
+    host = peer[0] if isinstance(peer, tuple) else str(peer)
+    return zlib.crc32(host.encode()) % count
+
+
+async def pipe(reader, writer):
+    try:
+        while data := await reader.read(65536):
+            writer.write(data)
+            await writer.drain()
+    except (ConnectionError, asyncio.CancelledError):
+        pass
+    finally:
+        try:
+            writer.close()
+        except Exception:
+            pass
+
+
+async def pipe_response(reader, writer, cookie=None):
+    """pipe() for the worker's responses, adding cookie to the first response head"""
+    if cookie is not None:
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, asyncio.CancelledError):
+            writer.close()
+            return
+        writer.write(head[:-2] + cookie + b"\r\n")
+    await pipe(reader, writer)
+
+
+class StickyProxy:
+    """Pins each client connection to a worker chosen by cookie, or by client address for new browsers"""
+
+    def __init__(self, host, ports):
+        self.host = host
+        self.ports = ports
+        # Open client and worker writers; workers only shut down once these are closed
+        self._writers = set()
+
+    async def aclose(self):
+        """Close every proxied connection"""
+        writers = list(self._writers)
+        for writer in writers:
+            writer.close()
+        await asyncio.gather(*(writer.wait_closed() for writer in writers), return_exceptions=True)
+
+    async def handle(self, client_reader, client_writer):
+        self._writers.add(client_writer)
+        try:
+            await self._proxy(client_reader, client_writer)
+        finally:
+            self._writers.discard(client_writer)
+
+    async def _proxy(self, client_reader, client_writer):
+        try:
+            head = await client_reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            client_writer.close()
+            return
+
+        index = worker_from_cookie(head, len(self.ports))
+        new_client = index is None
+        if new_client:
+            index = worker_for_peer(client_writer.get_extra_info("peername"), len(self.ports))
+        try:
+            upstream_reader, upstream_writer = await asyncio.open_connection(self.host, self.ports[index])
+        except OSError:
+            client_writer.write(b"HTTP/1.1 502 Bad Gateway\r\ncontent-length: 0\r\nconnection: close\r\n\r\n")
+            await client_writer.drain()
+            client_writer.close()
+            return
+
+        self._writers.add(upstream_writer)
+        upstream_writer.write(head)
+        cookie = None
+        if new_client:
+            # Added to the first response so later connections find this worker
+            cookie = f"Set-Cookie: {COOKIE_NAME}={index}; Path=/; HttpOnly; SameSite=Lax\r\n".encode()
+        # Both directions start at once: the worker may need the request body before it sends a response head
+        try:
+            await asyncio.gather(pipe(client_reader, upstream_writer), pipe_response(upstream_reader, client_writer, cookie))
+        finally:
+            self._writers.discard(upstream_writer)
+
+
+async def serve(args):
+    ports = list(range(args.worker_port, args.worker_port + args.workers))
+    workers = start_workers(args.workers, args.worker_host, args.worker_port)
+    try:
+        await wait_until_ready(args.worker_host, ports)
+        proxy = StickyProxy(args.worker_host, ports)
+        server = await asyncio.start_server(proxy.handle, args.host, args.port, limit=HEADER_LIMIT)
+        print(f"Serving {args.workers} workers on http://{args.host}:{args.port}", flush=True)
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        async with server:
+            await stop.wait()
+            await proxy.aclose()
+    finally:
+        for _, proc in workers:
+            proc.terminate()
+        for _, proc in workers:
+            proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default=os.getenv("GRADIO_SERVER_NAME", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("GRADIO_SERVER_PORT", "7860")))
+    parser.add_argument("--worker-host", default="127.0.0.1")
+    parser.add_argument("--worker-port", type=int, default=17860, help="first private worker port")
+    args = parser.parse_args()
+    asyncio.run(serve(args))
+
+
+if __name__ == "__main__":
+    main()
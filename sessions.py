@@ -0,0 +1,227 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from compact_history import prompt_table
+from context_window import ContextWindow
+from state_store import InProcessBackend
+from summarizer import ROLLING_SUMMARY_ENABLED, RollingSummary
+
+# Session store limits
+SESSION_MAX_COUNT = int(os.getenv("SESSION_MAX_COUNT", "1000"))
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "3600"))
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(64 * 1024 * 1024)))
+
+DEFAULT_SESSION_ID = "default"
+
+
+class SessionState:
+    """Conversation state for a single Gradio session"""
+
+    __slots__ = ("session_id", "api_key", "model", "_system_prompt", "history", "summary", "run", "version", "last_seen")
+
+    def __init__(self, session_id, api_key=None, model="gpt-4o-mini", system_prompt="", rolling_summary=ROLLING_SUMMARY_ENABLED):
+        self.session_id = session_id
+        self.api_key = api_key
+        self.model = model
+        self.system_prompt = system_prompt
+        # User/assistant messages trimmed to the token budget; the system prompt is kept separately
+        self.history = ContextWindow(model)
+        # Running summary of turns trimmed out of the window, when enabled
+        self.summary = RollingSummary() if rolling_summary else None
+        # Cancel event of the reply currently streaming, if any
+        self.run = None
+        # Version of the shared-store row this state corresponds to
+        self.version = 0
+        self.last_seen = time.monotonic()
+
+    @property
+    def system_prompt(self):
+        return prompt_table.text(self._system_prompt)
+
+    @system_prompt.setter
+    def system_prompt(self, text):
+        # Sessions with the same built-in persona share one registered copy of its prompt
+        self._system_prompt = prompt_table.intern(text)
+
+    @property
+    def nbytes(self):
+        return self.history.nbytes
+
+    def add_message(self, role, content):
+        """Append a message to the session's context window"""
+        return self.history.append(role, content)
+
+    def start_run(self):
+        """Begin streaming a new reply, cancelling the one still in flight"""
+        self.stop_run()
+        self.run = asyncio.Event()
+        return self.run
+
+    def stop_run(self):
+        """Ask the in-flight reply to stop and close its upstream stream"""
+        if self.run is not None:
+            self.run.set()
+
+    def finish_run(self, run):
+        if self.run is run:
+            self.run = None
+
+    def clear(self):
+        """Forget the conversation but keep the settings"""
+        self.history.clear()
+        if self.summary is not None:
+            self.summary.cancel()
+            self.summary = RollingSummary()
+
+    def to_dict(self):
+        """Shareable state; the API key is not stored, it arrives with every request"""
+        return {
+            "model": self.model,
+            "system_prompt": self.system_prompt,
+            "history": self.history.records(),
+            "summary": self.summary.to_dict() if self.summary is not None else None,
+        }
+
+    def load_dict(self, data, version):
+        """Replace the conversation with state saved by another worker"""
+        self.model = data["model"]
+        self.system_prompt = data["system_prompt"]
+        self.history.model = self.model
+        self.history.restore(data["history"])
+        if data["summary"] is not None:
+            if self.summary is not None:
+                self.summary.cancel()
+            self.summary = RollingSummary.from_dict(data["summary"])
+        self.version = version
+
+    def message_count(self):
+        """Number of messages including the system prompt"""
+        return len(self.history) + 1 if self.history else 0
+
+
+class SessionStore:
+    """LRU/TTL store of SessionState records bounded by count and approximate memory
+
+    Records are cached locally; with a shared backend (see state_store) a
+    session changed by another worker is reloaded on the next get(), and
+    save() publishes this worker's changes.
+    """
+
+    def __init__(self, max_sessions=SESSION_MAX_COUNT, ttl=SESSION_TTL_SECONDS, max_bytes=SESSION_MAX_BYTES,
+                 factory=SessionState, backend=None):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.factory = factory
+        self.backend = backend if backend is not None else InProcessBackend()
+        self.evictions = 0
+        self._sessions = OrderedDict()
+        # Bytes of each session as of its last save or load, and their running total, so evicting costs no scan
+        self._counted = {}
+        self.nbytes = 0
+        self._lock = threading.Lock()
+
+    def _touch(self, session_id, defaults):
+        """The locally cached session for session_id, created if needed, marked as just used"""
+        session_id = session_id or DEFAULT_SESSION_ID
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None and now - session.last_seen > self.ttl:
+                self._remove(session_id)
+                self.evictions += 1
+                session = None
+            if session is None:
+                session = self.factory(session_id, **defaults)
+                self._sessions[session_id] = session
+            else:
+                self._sessions.move_to_end(session_id)
+            session.last_seen = now
+            self._evict(now)
+        return session
+
+    def get(self, session_id, **defaults):
+        """Return the session for session_id, creating it if needed"""
+        session = self._touch(session_id, defaults)
+        shared = self.backend.load(session.session_id, newer_than=session.version)
+        if shared is not None:
+            session.load_dict(shared[1], shared[0])
+            self._recount(session)
+        return session
+
+    async def aget(self, session_id, **defaults):
+        """get() for the event loop: a shared backend is read and decoded in a worker thread"""
+        session = self._touch(session_id, defaults)
+        if self.backend.shared:
+            shared = await asyncio.to_thread(self.backend.load, session.session_id, session.version)
+            if shared is not None:
+                session.load_dict(shared[1], shared[0])
+                self._recount(session)
+        return session
+
+    def save(self, session):
+        """Publish a session's state to the shared backend"""
+        self._recount(session)
+        if not self.backend.shared:
+            # Nothing reads it back, so skip thawing and serializing the whole conversation
+            session.version += 1
+            return
+        session.version = self.backend.save(session.session_id, session.version + 1, session.to_dict())
+
+    async def asave(self, session):
+        """save() for the event loop: the state is taken here, encoded and written in a worker thread"""
+        self._recount(session)
+        if not self.backend.shared:
+            session.version += 1
+            return
+        data = session.to_dict()
+        session.version = await asyncio.to_thread(self.backend.save, session.session_id, session.version + 1, data)
+
+    def peek(self, session_id):
+        """Return the session if present, without touching LRU order"""
+        return self._sessions.get(session_id or DEFAULT_SESSION_ID)
+
+    def discard(self, session_id):
+        """Drop a session, e.g. when the browser tab is closed"""
+        with self._lock:
+            session = self._remove(session_id or DEFAULT_SESSION_ID)
+        if session is not None:
+            session.stop_run()
+        self.backend.delete(session_id or DEFAULT_SESSION_ID)
+
+    def _evict(self, now):
+        """Evict expired sessions, then least recently used ones over the caps"""
+        while self._sessions:
+            oldest_id, oldest = next(iter(self._sessions.items()))
+            if now - oldest.last_seen > self.ttl:
+                self._remove(oldest_id)
+                self.evictions += 1
+            else:
+                break
+
+        while len(self._sessions) > 1 and (len(self._sessions) > self.max_sessions or self.nbytes > self.max_bytes):
+            self._remove(next(iter(self._sessions)))
+            self.evictions += 1
+
+    def _remove(self, session_id):
+        """Drop a session and its bytes from the total (caller holds the lock)"""
+        self.nbytes -= self._counted.pop(session_id, 0)
+        return self._sessions.pop(session_id, None)
+
+    def _recount(self, session):
+        """Bring the byte total up to date with a session's current size"""
+        with self._lock:
+            if self._sessions.get(session.session_id) is session:
+                nbytes = session.nbytes
+                self.nbytes += nbytes - self._counted.get(session.session_id, 0)
+                self._counted[session.session_id] = nbytes
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def stats(self):
+        """Size and eviction counters for the status bar"""
+        return {"sessions": len(self._sessions), "evictions": self.evictions, **self.backend.stats()}
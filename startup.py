@@ -0,0 +1,66 @@
+"""Cold start helpers: background warm-up and the --profile-startup report"""
+import os
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+class PhaseTimer:
+    """Wall time of named startup phases, in the order they ran"""
+
+    def __init__(self):
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start))
+
+
+def import_breakdown(code="import app", top=15):
+    """Slowest top-level imports of a fresh interpreter running code, from python -X importtime"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            capture_output=True, text=True, cwd=ROOT)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Nested imports are indented by two spaces per level
+        if name[1:2] != " ":
+            rows.append((name.strip(), int(cumulative) / 1e6))
+    rows.sort(key=lambda row: row[1], reverse=True)
+    return rows[:top]
+
+
+def warm_imports(modules=("openai",)):
+    """Import modules that were deferred for startup in a background thread, so first use does not pay for them"""
+    def run():
+        for module in modules:
+            try:
+                __import__(module)
+            except ImportError:
+                pass
+
+    thread = threading.Thread(target=run, name="warm-imports", daemon=True)
+    thread.start()
+    return thread
+
+
+def print_report(timer, imports):
+    """Print the phase and import breakdown"""
+    total = sum(seconds for _, seconds in timer.phases)
+    print("Startup phases")
+    for name, seconds in timer.phases:
+        print(f"  {name:<32} {seconds * 1000:9.1f} ms  {seconds / total:6.1%}" if total else f"  {name:<32} {seconds * 1000:9.1f} ms")
+    print(f"  {'total':<32} {total * 1000:9.1f} ms")
+    print("\nSlowest imports (cumulative, fresh interpreter)")
+    for name, seconds in imports:
+        print(f"  {name:<32} {seconds * 1000:9.1f} ms")
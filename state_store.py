@@ -0,0 +1,111 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+# Where session state lives: "memory" (this process only) or "sqlite" (shared by all workers)
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+# On Linux /dev/shm keeps the shared database in RAM
+STATE_DB_PATH = os.getenv(
+    "STATE_DB_PATH",
+    "/dev/shm/chat_state.sqlite3" if os.path.isdir("/dev/shm") else "chat_state.sqlite3",
+)
+# Remove stale rows every this many saves
+EXPIRE_EVERY_SAVES = 500
+
+
+class InProcessBackend:
+    """Session state lives only in this process's SessionStore (single worker)"""
+
+    shared = False
+
+    def load(self, session_id, newer_than=0):
+        return None
+
+    def save(self, session_id, version, data):
+        return version
+
+    def delete(self, session_id):
+        pass
+
+    def stats(self):
+        return {"backend": "memory"}
+
+
+class SQLiteBackend:
+    """Session state shared between worker processes through one SQLite (WAL) database
+
+    Rows carry a version so a worker only deserializes a session when another
+    worker has changed it since it last looked.
+    """
+
+    shared = True
+
+    def __init__(self, path=STATE_DB_PATH, ttl=3600):
+        self.path = path
+        self.ttl = ttl
+        self.loads = 0
+        self.saves = 0
+        self._local = threading.local()
+        db = self._db()
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, version INTEGER NOT NULL, "
+            "updated REAL NOT NULL, data BLOB NOT NULL)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated)")
+        db.commit()
+
+    def _db(self):
+        # One connection per thread; SQLite connections are not thread-safe
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def load(self, session_id, newer_than=0):
+        """Return (version, data) if the stored version is newer than newer_than"""
+        row = self._db().execute(
+            "SELECT version, data FROM sessions WHERE session_id = ? AND version > ?", (session_id, newer_than)
+        ).fetchone()
+        if row is None:
+            return None
+        self.loads += 1
+        return row[0], json.loads(zlib.decompress(row[1]))
+
+    def save(self, session_id, version, data):
+        """Store data and return the row's new version (always above any version seen before)"""
+        db = self._db()
+        blob = zlib.compress(json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        version = db.execute(
+            "INSERT INTO sessions (session_id, version, updated, data) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(session_id) DO UPDATE SET version = max(excluded.version, sessions.version + 1), "
+            "updated = excluded.updated, data = excluded.data RETURNING version",
+            (session_id, version, time.time(), blob),
+        ).fetchone()[0]
+        self.saves += 1
+        if self.saves % EXPIRE_EVERY_SAVES == 0:
+            db.execute("DELETE FROM sessions WHERE updated < ?", (time.time() - self.ttl,))
+        db.commit()
+        return version
+
+    def delete(self, session_id):
+        db = self._db()
+        db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        db.commit()
+
+    def stats(self):
+        return {"backend": "sqlite", "loads": self.loads, "saves": self.saves}
+
+
+def create_backend(name=STATE_BACKEND, **kwargs):
+    """Backend selected by STATE_BACKEND"""
+    if name == "sqlite":
+        return SQLiteBackend(**kwargs)
+    if name == "memory":
+        return InProcessBackend()
+    raise ValueError(f"Unknown STATE_BACKEND: {name}")
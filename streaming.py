@@ -0,0 +1,73 @@
+import asyncio
+import os
+import time
+
+# Coalescing window for streamed deltas: flush every N seconds or M characters
+STREAM_FLUSH_INTERVAL = float(os.getenv("STREAM_FLUSH_INTERVAL", "0.05"))
+STREAM_FLUSH_CHARS = int(os.getenv("STREAM_FLUSH_CHARS", "64"))
+
+
+async def coalesce_deltas(deltas, interval=STREAM_FLUSH_INTERVAL, max_chars=STREAM_FLUSH_CHARS, cancel_event=None):
+    """Group small text deltas into larger ones on a time/size window
+
+    Yields only the new text since the previous flush, so the caller never
+    has to diff or re-send what it already has. If cancel_event is set, the
+    upstream iterator is closed immediately rather than at its next chunk.
+    """
+    iterator = deltas.__aiter__()
+    buffer = []
+    size = 0
+    last_flush = time.monotonic()
+    pending = None
+    cancelled = asyncio.ensure_future(cancel_event.wait()) if cancel_event is not None else None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+
+            timeout = None
+            if buffer:
+                timeout = max(0.0, interval - (time.monotonic() - last_flush))
+
+            waiters = {pending} if cancelled is None else {pending, cancelled}
+            done, _ = await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if cancelled is not None and cancelled in done:
+                break
+            if pending not in done:
+                # Window elapsed while waiting on upstream: flush what we have
+                yield "".join(buffer)
+                buffer.clear()
+                size = 0
+                last_flush = time.monotonic()
+                continue
+
+            task, pending = pending, None
+            try:
+                delta = task.result()
+            except StopAsyncIteration:
+                break
+
+            if not delta:
+                continue
+            buffer.append(delta)
+            size += len(delta)
+            if size >= max_chars or time.monotonic() - last_flush >= interval:
+                yield "".join(buffer)
+                buffer.clear()
+                size = 0
+                last_flush = time.monotonic()
+
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        if cancelled is not None:
+            cancelled.cancel()
+        if pending is not None:
+            pending.cancel()
+            try:
+                await pending
+            except (asyncio.CancelledError, Exception):
+                pass
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
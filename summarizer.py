@@ -0,0 +1,157 @@
+import asyncio
+import os
+
+from context_window import MESSAGE_OVERHEAD_TOKENS, count_tokens
+from metrics import SUMMARY_FAILURES, SUMMARY_UPDATES
+
+# Rolling summarization of turns that fall out of the token budget
+ROLLING_SUMMARY_ENABLED = os.getenv("ROLLING_SUMMARY", "0") == "1"
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "gpt-4o-mini")
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "400"))
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a conversation between a user and an AI assistant. "
+    "Update the existing summary with the new messages. Keep facts, decisions, names, numbers "
+    "and open questions; drop small talk. Reply with the updated summary only."
+)
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+
+class Summarizer:
+    """Condenses older messages into a running summary"""
+
+    async def summarize(self, previous_summary, messages):
+        """Return previous_summary updated with messages (a list of context_window.Message)"""
+        raise NotImplementedError
+
+
+class OpenAISummarizer(Summarizer):
+    """Summarizer backed by a chat completion call"""
+
+    def __init__(self, client, model=SUMMARY_MODEL, max_tokens=SUMMARY_MAX_TOKENS):
+        if client is None:
+            raise ValueError("OpenAISummarizer needs an OpenAI client")
+        self.client = client
+        self.model = model
+        self.max_tokens = max_tokens
+
+    async def summarize(self, previous_summary, messages):
+        transcript = "\n".join(f"{m.role}: {m.content}" for m in messages)
+        response = await self.client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+                {"role": "user", "content": f"Existing summary:\n{previous_summary or '(none)'}\n\nNew messages:\n{transcript}"},
+            ],
+            temperature=0.2,
+            max_tokens=self.max_tokens,
+        )
+        return response.choices[0].message.content.strip()
+
+
+class TruncatingSummarizer(Summarizer):
+    """Offline summarizer that keeps the first sentence of each message, bounded in length"""
+
+    def __init__(self, max_chars=2000):
+        self.max_chars = max_chars
+
+    async def summarize(self, previous_summary, messages):
+        lines = [previous_summary] if previous_summary else []
+        for m in messages:
+            first = m.content.strip().split("\n", 1)[0].split(". ", 1)[0]
+            lines.append(f"{m.role}: {first[:200]}")
+        summary = "\n".join(lines)
+        return summary[-self.max_chars:]
+
+
+class RollingSummary:
+    """Per-session running summary, updated in the background as turns are evicted
+
+    Background updates go to a draft; the text sent to the model only changes
+    when publish() is called at a history trim, so the prompt prefix stays
+    stable between trims.
+    """
+
+    __slots__ = ("text", "tokens", "evicted_tokens", "saved_tokens", "draft", "draft_tokens", "draft_evicted_tokens",
+                 "_pending", "_task")
+
+    def __init__(self):
+        self.text = ""
+        self.tokens = 0
+        # Tokens of all evicted messages the summary stands in for
+        self.evicted_tokens = 0
+        # Cumulative prompt tokens not sent thanks to the summary
+        self.saved_tokens = 0
+        self.draft = ""
+        self.draft_tokens = 0
+        self.draft_evicted_tokens = 0
+        self._pending = []
+        self._task = None
+
+    def as_message(self):
+        """Summary as a system message to place right after the system prompt"""
+        if not self.text:
+            return None
+        return {"role": "system", "content": SUMMARY_PREFIX + self.text}
+
+    def publish(self):
+        """Use the latest completed summary from now on; returns True if the text changed"""
+        changed = self.draft != self.text
+        self.text = self.draft
+        self.tokens = self.draft_tokens
+        self.evicted_tokens = self.draft_evicted_tokens
+        return changed
+
+    def record_turn(self):
+        """Account the savings of one request that sent the summary instead of the evicted turns"""
+        if self.text:
+            self.saved_tokens += max(0, self.evicted_tokens - self.tokens)
+
+    def schedule(self, dropped, summarizer, model="gpt-4o-mini"):
+        """Queue evicted messages and fold them into the summary without blocking the turn"""
+        if not dropped:
+            return
+        self._pending.extend(dropped)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run(summarizer, model))
+
+    async def _run(self, summarizer, model):
+        while self._pending:
+            batch, self._pending = self._pending, []
+            try:
+                text = await summarizer.summarize(self.draft, batch)
+            except Exception:
+                # Keep the old summary; the evicted turns are simply not represented
+                SUMMARY_FAILURES.inc(len(batch))
+                continue
+            SUMMARY_UPDATES.inc()
+            self.draft = text
+            self.draft_tokens = count_tokens(SUMMARY_PREFIX + text, model) + MESSAGE_OVERHEAD_TOKENS
+            self.draft_evicted_tokens += sum(m.tokens for m in batch)
+
+    def to_dict(self):
+        return {"text": self.text, "tokens": self.tokens, "evicted_tokens": self.evicted_tokens,
+                "saved_tokens": self.saved_tokens, "draft": self.draft, "draft_tokens": self.draft_tokens,
+                "draft_evicted_tokens": self.draft_evicted_tokens}
+
+    @classmethod
+    def from_dict(cls, data):
+        summary = cls()
+        summary.text = data["text"]
+        summary.tokens = data["tokens"]
+        summary.evicted_tokens = data["evicted_tokens"]
+        summary.saved_tokens = data["saved_tokens"]
+        summary.draft = data.get("draft", summary.text)
+        summary.draft_tokens = data.get("draft_tokens", summary.tokens)
+        summary.draft_evicted_tokens = data.get("draft_evicted_tokens", summary.evicted_tokens)
+        return summary
+
+    async def wait(self):
+        """Wait for any in-flight update (used by offline tests and benchmarks)"""
+        if self._task is not None:
+            await self._task
+
+    def cancel(self):
+        if self._task is not None:
+            self._task.cancel()
+        self._pending = []
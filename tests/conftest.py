@@ -0,0 +1,69 @@
+"""Offline test setup: a local fake OpenAI server, and app state kept out of the working tree
+
+Tests that go through app.py share one event loop and one FakeOpenAIServer
+for the whole run, since app.py's pooled HTTP transport is bound to the
+loop that first used it. Tests of single modules make their own loop with
+asyncio.run() and their own server.
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+# Read by app.py at import: no API key from .env, no chat log or cache files, nothing slowed down on purpose
+os.environ.update({
+    "OPENAI_API_KEY": "",
+    "CHAT_LOG_PATH": "",
+    "CACHE_PATH": "",
+    "CACHE_REPLAY_DELAY": "0",
+    "STATE_BACKEND": "memory",
+    "MODEL_BACKENDS": "",
+    "PREFETCH": "0",
+    "ROLLING_SUMMARY": "0",
+    "HEDGE_REQUESTS": "0",
+    "RAG_INDEX_PATH": "",
+})
+
+from fake_openai import FakeOpenAIServer  # noqa: E402
+
+# Server settings a test may change; restored after each test
+SERVER_SETTINGS = ("tokens", "token_delay", "first_token_delay", "first_token_jitter", "latency_sigma", "error_rate",
+                   "error_status", "retry_after", "max_concurrent", "tool_calls", "tool_arguments")
+
+
+@pytest.fixture(scope="session")
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.run_until_complete(loop.shutdown_asyncgens())
+    loop.close()
+
+
+@pytest.fixture(scope="session")
+def shared_server(loop):
+    server = loop.run_until_complete(FakeOpenAIServer(tokens=10).start())
+    os.environ["OPENAI_BASE_URL"] = server.base_url
+    yield server
+    loop.run_until_complete(server.stop())
+
+
+@pytest.fixture
+def fake_server(shared_server):
+    """The shared fake server, with its settings and request log reset after the test"""
+    saved = {name: getattr(shared_server, name) for name in SERVER_SETTINGS}
+    shared_server.received.clear()
+    yield shared_server
+    for name, value in saved.items():
+        setattr(shared_server, name, value)
+
+
+@pytest.fixture(scope="session")
+def app(shared_server):
+    """app.py, imported once the shared server is up so its default backend points there"""
+    import app
+    return app
@@ -0,0 +1,110 @@
+import argparse
+import json
+
+import pytest
+
+from resilience import ResilientStreamer
+
+ANSWER = "The quick brown fox jumps over the lazy dog."
+
+
+@pytest.fixture
+def batch(app):
+    import batch
+    return batch
+
+
+def write_prompts(path, n):
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(n):
+            f.write(json.dumps({"id": f"p{i}", "prompt": f"Question {i}?", "max_tokens": 100}) + "\n")
+
+
+def read_results(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def arguments(tmp_path, mode="stream", base_url=None):
+    return argparse.Namespace(input=str(tmp_path / "prompts.jsonl"), output=str(tmp_path / "results.jsonl"), mode=mode,
+                              concurrency=4, api_key="sk-test", base_url=base_url, poll_interval=0.01,
+                              max_requests=3)
+
+
+def test_stream_mode_answers_every_prompt(batch, fake_server, loop, tmp_path):
+    write_prompts(tmp_path / "prompts.jsonl", 10)
+    summary = loop.run_until_complete(batch.run(arguments(tmp_path)))
+
+    assert summary["mode"] == "stream" and summary["ok"] == 10 and summary["errors"] == 0
+    results = read_results(tmp_path / "results.jsonl")
+    assert sorted(r["id"] for r in results) == [f"p{i}" for i in range(10)]
+    assert all(r["status"] == "ok" and r["output"] == ANSWER for r in results)
+    assert all(r["usage"]["completion_tokens"] == 10 for r in results)
+    assert len(fake_server.received) == 10
+
+
+def test_rerun_retries_only_failed_prompts(batch, fake_server, loop, tmp_path):
+    write_prompts(tmp_path / "prompts.jsonl", 6)
+    fake_server.error_rate, fake_server.error_status = 1.0, 400
+    first = loop.run_until_complete(batch.run(arguments(tmp_path)))
+    assert first["ok"] == 0 and first["errors"] == 6
+
+    fake_server.error_rate = 0.0
+    with open(tmp_path / "results.jsonl", "a", encoding="utf-8") as f:
+        f.write(json.dumps({"id": "p0", "status": "ok", "output": "kept", "usage": None, "error": None}) + "\n")
+        f.write('{"id": "p1", "stat')  # a line cut short by a crash
+    second = loop.run_until_complete(batch.run(arguments(tmp_path)))
+
+    assert second["ok"] == 5 and second["skipped"] == 1
+    assert batch.completed_ids(str(tmp_path / "results.jsonl")) == {f"p{i}" for i in range(6)}
+
+
+def test_complete_retries_transient_upstream_errors(app, fake_server, loop, monkeypatch):
+    monkeypatch.setattr(app, "resilient_streamer", ResilientStreamer(max_attempts=10, base_delay=0.001, max_delay=0.01))
+    fake_server.error_rate, fake_server.error_status = 0.5, 503
+
+    async def run():
+        return [await app.complete(f"Retry {i}", api_key="sk-test", max_tokens=100) for i in range(10)]
+
+    results = loop.run_until_complete(run())
+    assert [r["output"] for r in results] == [ANSWER] * 10
+    assert app.resilient_streamer.retries > 0
+
+
+def test_batch_api_mode_submits_files_and_collects_results(batch, fake_server, loop, tmp_path):
+    write_prompts(tmp_path / "prompts.jsonl", 7)
+    batches_before = len(fake_server.batches)
+    summary = loop.run_until_complete(batch.run(arguments(tmp_path, mode="batch-api")))
+
+    assert summary["mode"] == "batch-api" and summary["ok"] == 7
+    # max_requests=3 splits the prompts over three batches
+    assert len(fake_server.batches) == batches_before + 3
+    assert {r["id"] for r in read_results(tmp_path / "results.jsonl")} == {f"p{i}" for i in range(7)}
+    assert not (tmp_path / "results.jsonl.batch.json").exists()
+    assert not fake_server.received
+
+
+def test_interrupted_batch_api_run_collects_instead_of_resubmitting(batch, fake_server, loop, tmp_path):
+    write_prompts(tmp_path / "prompts.jsonl", 4)
+    args = arguments(tmp_path, mode="auto")
+    state_path = args.output + ".batch.json"
+
+    async def submit_only():
+        client = batch.app.client_pool.get("sk-test")
+        state = batch.load_state(state_path)
+        await batch.submit_batches(client, batch.read_items(args.input), state, state_path, max_requests=10)
+
+    loop.run_until_complete(submit_only())
+    batches_before = len(fake_server.batches)
+    summary = loop.run_until_complete(batch.run(args))
+
+    assert summary["mode"] == "batch-api" and summary["ok"] == 4
+    assert len(fake_server.batches) == batches_before
+
+
+def test_auto_mode_streams_when_there_is_no_batch_api(batch, fake_server, loop, tmp_path):
+    write_prompts(tmp_path / "prompts.jsonl", 3)
+    summary = loop.run_until_complete(batch.run(arguments(tmp_path, mode="auto", base_url="http://127.0.0.1:9/v1")))
+
+    assert summary["mode"] == "stream" and summary["ok"] == 3
+    assert len(fake_server.received) == 3
@@ -0,0 +1,100 @@
+import gzip
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import time
+
+from chat_log import ChatLog
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def stored(path):
+    db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return db.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+    finally:
+        db.close()
+
+
+def test_messages_are_written_in_batches(tmp_path):
+    path = str(tmp_path / "log.sqlite3")
+    log = ChatLog(path, flush_interval=60, batch_size=5)
+    for i in range(12):
+        log.append("s", "user", f"message {i}")
+    deadline = time.monotonic() + 5
+    while log.written < 10 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    # Two full batches are committed; the rest waits for the interval or a flush
+    assert log.written == 10 and stored(path) == 10
+    log.flush()
+    assert log.written == 12 and stored(path) == 12
+    log.close()
+
+
+def test_partial_batches_are_committed_after_the_flush_interval(tmp_path):
+    path = str(tmp_path / "log.sqlite3")
+    log = ChatLog(path, flush_interval=0.05, batch_size=100)
+    log.append("s", "user", "hello")
+    deadline = time.monotonic() + 5
+    while stored(path) == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert stored(path) == 1
+    log.close()
+
+
+def test_flushed_messages_survive_a_crash(tmp_path):
+    path = str(tmp_path / "log.sqlite3")
+    script = (
+        "import os, sys\n"
+        f"sys.path.insert(0, {ROOT!r})\n"
+        "from chat_log import ChatLog\n"
+        f"log = ChatLog({path!r}, flush_interval=60)\n"
+        "for i in range(50):\n"
+        "    log.append('s', 'user', f'message {i}')\n"
+        "log.flush()\n"
+        "os._exit(1)\n"
+    )
+    subprocess.run([sys.executable, "-c", script], check=False, timeout=60)
+
+    log = ChatLog(path)
+    assert [m["content"] for m in log.iter_messages("s")] == [f"message {i}" for i in range(50)]
+    log.close()
+
+
+def test_messages_round_trip_compressed_and_filtered(tmp_path):
+    path = str(tmp_path / "log.sqlite3")
+    log = ChatLog(path)
+    long_answer = "Restart the router and wait a minute. " * 50
+    log.append("a", "user", "How do I reset my router?", "Tech Support", "gpt-4o-mini")
+    log.append("a", "assistant", long_answer, "Tech Support", "gpt-4o-mini")
+    log.append("b", "user", "How do I reset my router?", "Tech Support", "gpt-4o-mini")
+    log.append("c", "user", "Explain entropy", "Academic Tutor", "gpt-4o")
+    log.flush()
+
+    db = sqlite3.connect(path)
+    compressed = db.execute("SELECT compressed, LENGTH(content) FROM messages WHERE role = 'assistant'").fetchone()
+    db.close()
+    assert compressed[0] == 1 and compressed[1] < len(long_answer)
+    assert [m["content"] for m in log.iter_messages("a")] == ["How do I reset my router?", long_answer]
+    assert log.first_turns() == [("Tech Support", "gpt-4o-mini", "How do I reset my router?", 2),
+                                 ("Academic Tutor", "gpt-4o", "Explain entropy", 1)]
+
+    export_path = str(tmp_path / "a.jsonl.gz")
+    assert log.export(export_path, "a", header={"session": "a"}) == 2
+    with gzip.open(export_path, "rt", encoding="utf-8") as f:
+        lines = [json.loads(line) for line in f]
+    assert lines[0] == {"session": "a"} and lines[2]["content"] == long_answer
+    log.close()
+
+
+def test_flush_and_close_after_close_return_at_once(tmp_path):
+    log = ChatLog(str(tmp_path / "log.sqlite3"))
+    log.append("s", "user", "hello")
+    log.close()
+    started = time.monotonic()
+    log.flush()
+    log.close()
+    assert time.monotonic() - started < 1 and log.written == 1
@@ -0,0 +1,64 @@
+import asyncio
+
+from chat_log import ChatLog
+
+ANSWER = "The quick brown fox jumps over the lazy dog."
+
+
+def test_a_stopped_run_writes_only_into_its_own_reply(app, fake_server, loop):
+    """A new message stops the reply still streaming; the old run must not touch the new reply"""
+    fake_server.token_delay = 0.05
+    history = []
+
+    async def turn(message, shown):
+        async for current, _ in app.chat_response_stream(message, history, "sk-test", "gpt-4o-mini", 0.7, 100,
+                                                         app.DEFAULT_ASSISTANT, "", session_id="overlapping-runs"):
+            shown.append(current[-1]["content"])
+
+    async def run():
+        first_shown, second_shown = [], []
+        first = asyncio.create_task(turn("First question", first_shown))
+        while not any(text.startswith("The") for text in first_shown):
+            await asyncio.sleep(0.01)
+        await asyncio.gather(first, turn("Second question", second_shown))
+
+    loop.run_until_complete(run())
+    assert [m["role"] for m in history] == ["user", "assistant", "user", "assistant"]
+    assert history[2]["content"] == "Second question"
+    assert history[3]["content"] == ANSWER
+    assert history[1]["content"] != ANSWER and "Stopped" in history[1]["content"]
+
+
+def test_the_log_keeps_stopped_replies_marked_and_skips_empty_ones(app, fake_server, loop, tmp_path, monkeypatch):
+    """A reply stopped mid-stream is logged with its marker; one stopped before any text is left out"""
+    log = ChatLog(str(tmp_path / "log.sqlite3"))
+    monkeypatch.setattr(app, "chat_log", log)
+    history = []
+
+    async def turn(message, shown, session_id):
+        async for current, _ in app.chat_response_stream(message, history, "sk-test", "gpt-4o-mini", 0.7, 100,
+                                                         app.DEFAULT_ASSISTANT, "", session_id=session_id):
+            shown.append(current[-1]["content"])
+
+    async def supersede(first_message, ready, session_id):
+        first_shown = []
+        first = asyncio.create_task(turn(first_message, first_shown, session_id))
+        while not ready(first_shown):
+            await asyncio.sleep(0.01)
+        await asyncio.gather(first, turn("Second question", [], session_id))
+
+    fake_server.token_delay = 0.05
+    loop.run_until_complete(supersede("Stopped mid-stream", lambda shown: any(text.startswith("The") for text in shown), "log-partial"))
+    history.clear()
+    fake_server.token_delay = 0
+    fake_server.first_token_delay = 0.5
+    fake_server.received.clear()
+    loop.run_until_complete(supersede("Stopped early", lambda shown: fake_server.received, "log-empty"))
+    log.close()
+
+    partial = [(m["role"], m["content"]) for m in log.iter_messages("log-partial")]
+    assert [content for _, content in partial[::2]] == ["Stopped mid-stream", "Second question"]
+    assert partial[1][1].startswith("The") and partial[1][1].endswith("⏹️ *Stopped*")
+    assert partial[3][1] == ANSWER
+    empty = [m["content"] for m in log.iter_messages("log-empty")]
+    assert empty == ["Second question", ANSWER]
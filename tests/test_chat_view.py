@@ -0,0 +1,60 @@
+from chat_view import ChatView
+
+
+def conversation(view, turns):
+    for i in range(turns):
+        view.messages.append({"role": "user", "content": f"Question {i}"})
+        view.messages.append({"role": "assistant", "content": f"Answer {i}"})
+
+
+def contents(value):
+    return [m["content"] for m in value]
+
+
+def test_only_the_newest_messages_are_rendered():
+    view = ChatView(window=4, page=4)
+    conversation(view, 5)
+    assert contents(view.render()) == ["Question 3", "Answer 3", "Question 4", "Answer 4"]
+    assert view.hidden() == 6
+
+
+def test_earlier_messages_are_paged_in_until_a_new_message_resets_the_window():
+    view = ChatView(window=4, page=4)
+    conversation(view, 5)
+    view.show_earlier()
+    assert len(view.render()) == 8 and view.hidden() == 2
+    view.show_earlier()
+    assert contents(view.render())[0] == "Question 0" and view.hidden() == 0
+    view.reset_window()
+    assert len(view.render()) == 4 and view.hidden() == 6
+
+
+def test_a_zero_window_renders_everything():
+    view = ChatView(window=0)
+    conversation(view, 30)
+    assert len(view.render()) == 60 and view.hidden() == 0
+
+
+def test_the_streaming_reply_is_rendered_as_it_is_written():
+    view = ChatView(window=4)
+    conversation(view, 5)
+    reply = {"role": "assistant", "content": ""}
+    view.messages.append({"role": "user", "content": "Question 5"})
+    view.messages.append(reply)
+    view.begin_reply()
+    for text in ("The", "The quick", "The quick brown"):
+        reply["content"] = text
+        assert view.render()[-1]["content"] == text
+    view.end_reply()
+    assert contents(view.render())[-2:] == ["Question 5", "The quick brown"]
+
+
+def test_the_transcript_is_compacted_only_once_no_reply_is_streaming():
+    view = ChatView(window=4)
+    conversation(view, 20)
+    view.begin_reply()
+    view.release()
+    assert not view.messages.items
+    view.end_reply()
+    assert view.messages.items
+    assert contents(view.messages) == [text for i in range(20) for text in (f"Question {i}", f"Answer {i}")]
@@ -0,0 +1,162 @@
+import asyncio
+
+import pytest
+
+from coalescing import SingleFlight, flight_key
+
+PARTS = ["The", " quick", " brown", " fox", " jumps"]
+TEXT = "".join(PARTS)
+
+
+class Upstream:
+    """A producer that yields PARTS with a delay and records how often it was opened and closed"""
+
+    def __init__(self, delay=0.01, fail_after=None):
+        self.delay = delay
+        self.fail_after = fail_after
+        self.opened = 0
+        self.closed = 0
+
+    async def __call__(self):
+        self.opened += 1
+        try:
+            for i, part in enumerate(PARTS):
+                if i == self.fail_after:
+                    raise RuntimeError("upstream failed")
+                await asyncio.sleep(self.delay)
+                yield part
+        finally:
+            self.closed += 1
+
+
+async def read(flights, upstream, delay=0.0, read_delay=0.0, stop_after=None, key="k"):
+    """Deltas one subscriber receives, arriving after delay seconds"""
+    await asyncio.sleep(delay)
+    received = []
+    stream = flights.stream(key, upstream)
+    try:
+        async for delta in stream:
+            received.append(delta)
+            if stop_after is not None and len(received) >= stop_after:
+                break
+            if read_delay:
+                await asyncio.sleep(read_delay)
+    finally:
+        await stream.aclose()
+    return received
+
+
+def test_identical_requests_share_one_upstream_stream():
+    async def run():
+        flights, upstream = SingleFlight(), Upstream()
+        received = await asyncio.gather(*(read(flights, upstream) for _ in range(10)))
+        return received, flights, upstream
+
+    received, flights, upstream = asyncio.run(run())
+    assert all("".join(r) == TEXT for r in received)
+    assert upstream.opened == 1 and upstream.closed == 1
+    stats = flights.stats()
+    assert stats["upstream_streams"] == 1 and stats["coalesced"] == 9 and stats["in_flight"] == 0
+
+
+def test_late_subscriber_starts_with_the_text_so_far():
+    async def run():
+        flights, upstream = SingleFlight(), Upstream(delay=0.05)
+        return await asyncio.gather(read(flights, upstream), read(flights, upstream, delay=0.12))
+
+    first, late = asyncio.run(run())
+    assert first == PARTS
+    # Everything produced before it joined arrives as one delta
+    assert late[0] == "".join(PARTS[:len(PARTS) - len(late) + 1])
+    assert 1 < len(late) < len(PARTS) and "".join(late) == TEXT
+
+
+def test_upstream_is_cancelled_when_every_subscriber_leaves():
+    async def run():
+        flights, upstream = SingleFlight(), Upstream(delay=0.05)
+        received = await asyncio.gather(read(flights, upstream, stop_after=1), read(flights, upstream, stop_after=2))
+        await asyncio.sleep(0.01)
+        return received, flights, upstream
+
+    received, flights, upstream = asyncio.run(run())
+    assert received == [PARTS[:1], PARTS[:2]]
+    assert upstream.closed == 1
+    assert flights.stats()["cancelled"] == 1 and flights.stats()["in_flight"] == 0
+
+
+def test_first_subscriber_leaving_does_not_cut_off_the_others():
+    async def run():
+        flights, upstream = SingleFlight(), Upstream()
+        received = await asyncio.gather(read(flights, upstream, stop_after=1), read(flights, upstream, delay=0.005))
+        return received, flights
+
+    (first, second), flights = asyncio.run(run())
+    assert first == PARTS[:1] and "".join(second) == TEXT
+    assert flights.stats()["cancelled"] == 0
+
+
+def test_slow_subscriber_is_detached_without_holding_back_the_others():
+    async def run():
+        flights, upstream = SingleFlight(queue_size=1, stall_seconds=0.02), Upstream(delay=0.001)
+        started = asyncio.get_running_loop().time()
+        fast = asyncio.create_task(read(flights, upstream))
+        slow = asyncio.create_task(read(flights, upstream, read_delay=0.1))
+        fast_text = await fast
+        fast_seconds = asyncio.get_running_loop().time() - started
+        return fast_text, fast_seconds, await slow, flights
+
+    fast, fast_seconds, slow, flights = asyncio.run(run())
+    assert "".join(fast) == TEXT and "".join(slow) == TEXT
+    assert fast_seconds < 0.3
+    assert flights.stats()["detached"] == 1
+
+
+def test_upstream_errors_reach_every_subscriber():
+    async def run():
+        flights, upstream = SingleFlight(), Upstream(fail_after=2)
+        return await asyncio.gather(read(flights, upstream), read(flights, upstream), return_exceptions=True)
+
+    for result in asyncio.run(run()):
+        assert isinstance(result, RuntimeError)
+
+
+def test_flight_key_covers_every_setting_of_the_answer():
+    messages = [{"role": "user", "content": "Hello!"}]
+    key = flight_key("gpt-4o-mini", messages, 0, 2000)
+    assert key == flight_key("gpt-4o-mini", [dict(m) for m in messages], 0.0, 2000)
+    assert len({key, flight_key("gpt-4o", messages, 0, 2000), flight_key("gpt-4o-mini", messages, 0, 1000),
+                flight_key("gpt-4o-mini", messages, 0, 2000, seed=1),
+                flight_key("gpt-4o-mini", messages, 0, 2000, api_key_fingerprint="other")}) == 5
+    assert SingleFlight.eligible(0) and SingleFlight.eligible(0.7, seed=1) and not SingleFlight.eligible(0.7)
+
+
+@pytest.mark.parametrize("temperature, upstream_calls", [(0, 1), (0.7, 5)])
+def test_concurrent_app_requests_coalesce_only_when_deterministic(app, fake_server, loop, temperature, upstream_calls):
+    fake_server.token_delay = 0.01
+
+    async def run():
+        return await asyncio.gather(*(app.complete(f"Coalesce at {temperature}", temperature=temperature,
+                                                   api_key="sk-test", max_tokens=100) for _ in range(5)))
+
+    results = loop.run_until_complete(run())
+    assert len({r["output"] for r in results}) == 1
+    assert len(fake_server.received) == upstream_calls
+
+
+def test_every_coalesced_caller_records_its_own_request(app, fake_server, loop):
+    """Callers sharing one upstream stream each get a TTFT, and the shared answer's usage is charged once"""
+    fake_server.token_delay = 0.01
+    model = "gpt-3.5-turbo"
+    before = (app.model_stats.summary(model) or {"requests": 0})["requests"]
+
+    async def run():
+        return await asyncio.gather(*(app.complete("Coalesced span question", model=model, temperature=0,
+                                                   max_tokens=50, api_key="sk-test") for _ in range(4)))
+
+    results = loop.run_until_complete(run())
+    assert len(fake_server.received) == 1
+    assert all(r["output"] == results[0]["output"] for r in results)
+    stats = app.model_stats.summary(model)
+    assert stats["requests"] == before + 4 and stats["ttft_p50"] is not None
+    charged = [r["usage"] for r in results if r["usage"]["prompt_tokens"] is not None]
+    assert len(charged) == 1 and charged[0]["completion_tokens"] == 10
@@ -0,0 +1,107 @@
+import context_window
+from context_window import MESSAGE_OVERHEAD_TOKENS, ContextWindow, count_tokens, prompt_budget
+
+
+def filled(n, chars=400, model="gpt-4o-mini"):
+    window = ContextWindow(model)
+    for i in range(n):
+        window.append("user" if i % 2 == 0 else "assistant", f"message {i} " + "x" * chars)
+    return window
+
+
+def test_prompt_budget_is_context_minus_reply_allowance():
+    assert prompt_budget("gpt-4", 1000) == 8192 - 1000 - context_window.REPLY_OVERHEAD_TOKENS
+    assert prompt_budget("gpt-4o-mini", 2000) == 128000 - 2000 - context_window.REPLY_OVERHEAD_TOKENS
+    assert prompt_budget("unknown-model", 100000) == 0
+
+
+def test_trim_keeps_the_newest_messages_that_fit():
+    window = filled(40)
+    total = window.tokens
+    budget = total // 3
+    dropped = window.trim(budget)
+
+    assert window.tokens <= budget
+    assert window.tokens + sum(m.tokens for m in dropped) == total
+    kept = [m["content"] for m in window.as_messages()]
+    assert kept[-1].startswith("message 39 ")
+    assert [m.content for m in dropped] == [f"message {i} " + "x" * 400 for i in range(len(dropped))]
+    assert kept[0].startswith(f"message {len(dropped)} ")
+
+
+def test_trim_never_starts_with_an_orphaned_reply():
+    window = filled(40)
+    window.trim(window.tokens // 2)
+    assert window.as_messages()[0]["role"] == "user"
+
+
+def test_trim_drops_a_chunk_so_later_turns_keep_the_prefix():
+    window = filled(40)
+    budget = window.tokens - 1
+    slack = budget // 4
+    dropped = window.trim(budget, slack)
+    assert window.tokens <= budget - slack
+    first = window.as_messages()[0]["content"]
+
+    # Turns that still fit leave the start of the prompt as it was
+    window.append("user", "short question")
+    window.append("assistant", "short answer")
+    assert window.trim(budget, slack) == []
+    assert window.as_messages()[0]["content"] == first
+    assert len(dropped) > 1
+
+
+def test_messages_are_tokenized_once(monkeypatch):
+    calls = []
+
+    def counting(text, model="gpt-4o-mini"):
+        calls.append(text)
+        return count_tokens(text, model)
+
+    monkeypatch.setattr(context_window, "count_tokens", counting)
+    window = ContextWindow()
+    for turn in range(200):
+        window.append("user", f"question {turn}")
+        window.append("assistant", f"answer {turn}")
+        window.trim(300, 100)
+        list(window.as_messages())
+    assert len(calls) == 400
+
+
+def test_restore_keeps_token_counts_without_retokenizing(monkeypatch):
+    window = filled(6)
+    records = window.records()
+    monkeypatch.setattr(context_window, "count_tokens", lambda *args: 1 / 0)
+    restored = ContextWindow()
+    restored.restore(records)
+    assert restored.tokens == window.tokens
+    assert list(restored.as_messages()) == list(window.as_messages())
+
+
+def test_prompts_sent_upstream_fit_the_model_budget(app, fake_server, loop):
+    """A long conversation on an 8k model: every request fits, keeps the system prompt and ends with the question"""
+    max_tokens = 2000
+    budget = prompt_budget("gpt-4", max_tokens)
+
+    async def conversation():
+        for turn in range(30):
+            history = []
+            async for history, _ in app.chat_response_stream(
+                f"Question {turn}: " + "lorem ipsum " * 200, history, "sk-test", "gpt-4", 0.7, max_tokens,
+                app.DEFAULT_ASSISTANT, "", session_id="context-budget",
+            ):
+                pass
+            assert not history[-1]["content"].startswith("❌"), history[-1]["content"]
+
+    loop.run_until_complete(conversation())
+
+    payloads = list(fake_server.received)
+    assert len(payloads) == 30
+    for turn, payload in enumerate(payloads):
+        messages = payload["messages"]
+        tokens = sum(count_tokens(m["content"], "gpt-4") + MESSAGE_OVERHEAD_TOKENS for m in messages)
+        assert tokens <= budget
+        assert messages[0] == {"role": "system", "content": app.SYSTEM_PROMPTS[app.DEFAULT_ASSISTANT]}
+        assert messages[-1]["content"].startswith(f"Question {turn}: ")
+    # Early turns were dropped once the conversation outgrew the window
+    assert not any(m["content"].startswith("Question 0: ") for m in payloads[-1]["messages"])
@@ -0,0 +1,53 @@
+import asyncio
+
+from chat_log import ChatLog
+from prefetch import FirstTurnPrefetcher
+from response_cache import ResponseCache
+
+SYSTEM_PROMPTS = {"Tech Support": "You are a technical support specialist."}
+QUESTION = "How do I reset my router?"
+
+
+async def produce(messages, model, temperature, max_tokens):
+    yield "Hold the reset button."
+
+
+def make_prefetcher(tmp_path, **settings):
+    log = ChatLog(str(tmp_path / "log.sqlite3"))
+    for session in ("a", "b", "c"):
+        log.append(session, "user", QUESTION, "Tech Support", "gpt-4o-mini")
+    log.flush()
+    return FirstTurnPrefetcher(ResponseCache(path=""), log, produce, SYSTEM_PROMPTS, max_tokens=2000, **settings), log
+
+
+def test_prefetched_answers_serve_only_requests_with_the_same_settings(tmp_path):
+    prefetcher, log = make_prefetcher(tmp_path)
+    messages = prefetcher.messages("Tech Support", QUESTION)
+    upstream = []
+
+    def producer():
+        upstream.append(1)
+        return produce(messages, "gpt-4o-mini", 0, 0)
+
+    async def ask(max_tokens):
+        return "".join([d async for d in prefetcher.cache.stream(messages, "gpt-4o-mini", 0, max_tokens, producer)])
+
+    async def run():
+        await prefetcher.refresh()
+        return await ask(2000), await ask(100)
+
+    assert asyncio.run(run()) == ("Hold the reset button.", "Hold the reset button.")
+    # Only the request with another max_tokens went upstream
+    assert prefetcher.generated == 1 and upstream == [1]
+
+    prefetcher.record_first_turn("gpt-4o-mini", messages, 0, 100)
+    prefetcher.record_first_turn("gpt-4o-mini", messages, 0, 2000)
+    assert prefetcher.stats()["first_turns"] == 2 and prefetcher.stats()["hits"] == 1
+    log.close()
+
+
+def test_nothing_is_prefetched_with_settings_the_cache_would_not_serve(tmp_path):
+    prefetcher, log = make_prefetcher(tmp_path, temperature=0.7)
+    asyncio.run(prefetcher.refresh())
+    assert prefetcher.generated == 0 and not prefetcher.entries
+    log.close()
@@ -0,0 +1,159 @@
+import asyncio
+import time
+from contextlib import aclosing
+
+import httpx
+import openai
+import pytest
+
+from client_pool import ClientPool
+from fake_openai import FakeOpenAIServer
+from resilience import ResilientStreamer
+
+MESSAGES = [{"role": "user", "content": "Hello!"}]
+
+
+class SlowFirstServer(FakeOpenAIServer):
+    """Fake server whose first request has a slow first token"""
+
+    async def _complete(self, payload, writer):
+        if self.requests == 1:
+            await asyncio.sleep(2)
+        await super()._complete(payload, writer)
+
+
+async def deltas(client):
+    stream = await client.chat.completions.create(model="gpt-4o-mini", messages=MESSAGES, stream=True)
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+async def answers(server, streamer, n=1):
+    """The text of n answers streamed through streamer from server"""
+    pool = ClientPool(base_url=server.base_url)
+    client = pool.get("sk-test")
+
+    async def one():
+        return "".join([delta async for delta in streamer.stream(lambda: deltas(client))])
+
+    try:
+        return await asyncio.gather(*(one() for _ in range(n)))
+    finally:
+        await pool.aclose()
+
+
+@pytest.mark.parametrize("status", [429, 503])
+def test_failures_before_the_first_token_are_retried(status):
+    async def run():
+        async with FakeOpenAIServer(tokens=5, error_rate=0.5, error_status=status, seed=3) as server:
+            streamer = ResilientStreamer(max_attempts=10, base_delay=0.001, max_delay=0.01)
+            return await answers(server, streamer, 20), server, streamer
+
+    texts, server, streamer = asyncio.run(run())
+    assert texts == ["The quick brown fox jumps"] * 20
+    assert server.errors > 0 and streamer.retries == server.errors
+
+
+def test_gives_up_after_max_attempts():
+    async def run():
+        async with FakeOpenAIServer(error_rate=1.0, error_status=429) as server:
+            with pytest.raises(openai.RateLimitError):
+                await answers(server, ResilientStreamer(max_attempts=3, base_delay=0.001))
+            return server.requests
+
+    assert asyncio.run(run()) == 3
+
+
+def test_client_errors_are_not_retried():
+    async def run():
+        async with FakeOpenAIServer(error_rate=1.0, error_status=400) as server:
+            with pytest.raises(openai.BadRequestError):
+                await answers(server, ResilientStreamer(max_attempts=3, base_delay=0.001))
+            return server.requests
+
+    assert asyncio.run(run()) == 1
+
+
+def test_backoff_honors_retry_after():
+    class Response:
+        headers = {"retry-after": "1.5"}
+
+    class Error:
+        response = Response()
+
+    streamer = ResilientStreamer(base_delay=0.001, max_delay=20)
+    assert streamer.backoff(0, Error()) == 1.5
+    assert 0 <= streamer.backoff(3) <= 0.008
+
+
+def test_no_retry_once_text_was_shown():
+    opened = []
+
+    async def failing():
+        opened.append(1)
+        yield "partial"
+        raise openai.APIConnectionError(request=httpx.Request("POST", "http://127.0.0.1/v1/chat/completions"))
+
+    async def run():
+        shown = []
+        with pytest.raises(openai.APIConnectionError):
+            async for delta in ResilientStreamer(base_delay=0.001).stream(failing):
+                shown.append(delta)
+        return shown
+
+    assert asyncio.run(run()) == ["partial"]
+    assert opened == [1]
+
+
+def test_hedge_beats_a_slow_first_token():
+    async def run():
+        async with SlowFirstServer(tokens=5) as server:
+            streamer = ResilientStreamer(hedge=True, hedge_default_delay=0.05)
+            started = time.perf_counter()
+            texts = await answers(server, streamer)
+            return texts, time.perf_counter() - started, server, streamer
+
+    texts, seconds, server, streamer = asyncio.run(run())
+    assert texts == ["The quick brown fox jumps"]
+    assert seconds < 1
+    assert server.requests == 2 and streamer.hedges == 1 and streamer.hedge_wins == 1
+
+
+def test_a_hedge_that_loses_is_closed_even_if_it_got_a_token():
+    """A losing request that still produces its first token, here despite being cancelled, must be closed"""
+    opened, closed = [], []
+
+    class Stream:
+        """Not an async generator, so nothing but an explicit aclose() closes it"""
+
+        def __init__(self):
+            self.index = len(opened)
+            opened.append(self.index)
+
+        def __aiter__(self):
+            return self
+
+        async def __anext__(self):
+            if self.index == 0:
+                try:
+                    await asyncio.sleep(1)
+                except asyncio.CancelledError:
+                    pass
+            if self.index in closed:
+                raise StopAsyncIteration
+            return f"from {self.index}"
+
+        async def aclose(self):
+            closed.append(self.index)
+
+    async def run():
+        streamer = ResilientStreamer(hedge=True, hedge_default_delay=0.01)
+        async with aclosing(streamer.stream(Stream)) as deltas:
+            shown = [await deltas.__anext__()]
+        await asyncio.sleep(0.05)
+        return shown, streamer
+
+    shown, streamer = asyncio.run(run())
+    assert shown == ["from 1"] and streamer.hedge_wins == 1
+    assert sorted(closed) == opened == [0, 1]
@@ -0,0 +1,90 @@
+import asyncio
+import sqlite3
+
+from response_cache import ResponseCache, cache_keys
+
+MESSAGES = [{"role": "system", "content": "You are helpful."}, {"role": "user", "content": "Hello!"}]
+
+
+class Producer:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self._deltas()
+
+    async def _deltas(self):
+        for part in ("Hello", " there", "!"):
+            yield part
+
+
+def answer(cache, producer, temperature=0, max_tokens=100, seed=None):
+    async def run():
+        return "".join([d async for d in cache.stream(MESSAGES, "gpt-4o-mini", temperature, max_tokens, producer, seed)])
+    return asyncio.run(run())
+
+
+def test_keys_cover_every_setting_of_the_answer():
+    key = cache_keys("gpt-4o-mini", MESSAGES, 0, 100)[0]
+    assert key == cache_keys("gpt-4o-mini", MESSAGES, 0.04, 100)[0]
+    assert len({key, cache_keys("gpt-4o", MESSAGES, 0, 100)[0], cache_keys("gpt-4o-mini", MESSAGES, 0.5, 100)[0],
+                cache_keys("gpt-4o-mini", MESSAGES, 0, 2000)[0], cache_keys("gpt-4o-mini", MESSAGES, 0, 100, seed=7)[0],
+                cache_keys("gpt-4o-mini", MESSAGES[:1] + [{"role": "user", "content": "Bye"}], 0, 100)[0]}) == 6
+    # The semantic namespace leaves out only the last message
+    assert cache_keys("gpt-4o-mini", MESSAGES, 0, 100)[1] == cache_keys("gpt-4o-mini", MESSAGES[:1] + [{"role": "user", "content": "Bye"}], 0, 100)[1]
+
+
+def test_only_deterministic_answers_are_cached_by_default():
+    cache = ResponseCache(path="")
+    assert cache.cacheable(0) and cache.cacheable(0.7, seed=1) and not cache.cacheable(0.7)
+    producer = Producer()
+    assert answer(cache, producer, temperature=0.7) == answer(cache, producer, temperature=0.7) == "Hello there!"
+    assert producer.calls == 2 and cache.stats()["entries"] == 0
+
+
+def test_answers_are_reused_only_for_the_same_max_tokens_and_seed():
+    cache = ResponseCache(path="")
+    producer = Producer()
+    for max_tokens, seed in ((100, None), (100, None), (2000, None), (100, 7), (100, 7)):
+        assert answer(cache, producer, max_tokens=max_tokens, seed=seed) == "Hello there!"
+    assert producer.calls == 3 and cache.exact_hits == 2
+
+
+def test_cached_answers_survive_a_restart(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = ResponseCache(path=path)
+    producer = Producer()
+    answer(cache, producer)
+    cache.close()
+
+    reopened = ResponseCache(path=path)
+    assert answer(reopened, producer) == "Hello there!"
+    assert producer.calls == 1 and reopened.exact_hits == 1
+    reopened.close()
+
+
+def rows(path):
+    db = sqlite3.connect(path)
+    try:
+        return db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+    finally:
+        db.close()
+
+
+def test_evicted_and_expired_entries_are_deleted_from_disk(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = ResponseCache(max_entries=5, path=path)
+    for i in range(12):
+        cache.put(f"key{i}", "ns", f"answer {i}")
+    assert rows(path) == 5
+    assert cache.get("key0") is None and cache.get("key11") == "answer 11"
+
+    cache.ttl = -1
+    assert cache.get("key11") is None
+    assert rows(path) == 4
+    cache.close()
+
+    # A smaller limit on restart trims the rows the LRU cannot hold
+    ResponseCache(max_entries=2, path=path).close()
+    assert rows(path) == 2
@@ -0,0 +1,90 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from retrieval import HashingEmbedder, Retriever, VectorIndex, chunk_text, ingest  # noqa: E402
+
+
+def clustered(n, dim, clusters, spread, seed):
+    """Unit vectors around random centers, and queries drawn the same way"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+
+    def draw(rows):
+        vectors = centers[rng.integers(0, clusters, rows)] + spread * rng.standard_normal((rows, dim)).astype(np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    return draw(n), draw(50)
+
+
+@pytest.fixture(scope="module")
+def index(tmp_path_factory):
+    vectors, queries = clustered(20000, 64, 40, 0.3, seed=1)
+    index = VectorIndex(str(tmp_path_factory.mktemp("index")), 64)
+    index.add(vectors[:10000])
+    index.add(vectors[10000:])
+    return index, vectors, queries
+
+
+def test_exact_search_matches_brute_force(index):
+    index, vectors, queries = index
+    for query in queries[:10]:
+        ids, scores = index.search(query, 10)
+        expected = np.argsort(-(vectors @ query))[:10]
+        assert ids.tolist() == expected.tolist()
+        assert np.allclose(scores, vectors[expected] @ query)
+
+
+def test_ivf_search_recall(index):
+    index, vectors, queries = index
+    index.build_ivf(seed=0)
+    recalls = []
+    for nprobe in (1, 8):
+        found = 0
+        for query in queries:
+            exact = set(index.search(query, 10)[0].tolist())
+            found += len(exact & set(index.search(query, 10, nprobe)[0].tolist()))
+        recalls.append(found / (10 * len(queries)))
+    assert recalls[1] >= 0.9
+    assert recalls[1] >= recalls[0]
+
+
+def test_ivf_is_ignored_once_vectors_are_added(tmp_path):
+    vectors, queries = clustered(2000, 16, 8, 0.3, seed=2)
+    index = VectorIndex(str(tmp_path), 16)
+    index.add(vectors[:1000])
+    index.build_ivf(seed=0)
+    assert index.load_ivf() is not None
+    index.add(vectors[1000:])
+    assert index.load_ivf() is None
+    ids, _ = index.search(queries[0], 5, nprobe=1)
+    assert ids.tolist() == np.argsort(-(vectors @ queries[0]))[:5].tolist()
+
+
+def test_chunks_overlap():
+    text = " ".join(f"w{i}" for i in range(500))
+    chunks = list(chunk_text(text, words=200, overlap=40))
+    assert [c.split()[0] for c in chunks] == ["w0", "w160", "w320"]
+    assert chunks[-1].split()[-1] == "w499"
+    assert list(chunk_text("short text")) == ["short text"]
+
+
+def test_retriever_grounds_only_its_personas(tmp_path):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "router.txt").write_text("To reset the router hold the reset button for ten seconds.", encoding="utf-8")
+    (docs / "entropy.md").write_text("Entropy measures the number of microscopic states of a system.", encoding="utf-8")
+    stats = ingest([str(docs)], str(tmp_path / "index"), HashingEmbedder(256))
+    assert stats["documents"] == 2 and stats["chunks"] == 2
+
+    retriever = Retriever(str(tmp_path / "index"), HashingEmbedder(256), personas=["Tech Support"], nprobe=0)
+    assert retriever.applies_to("Tech Support") and not retriever.applies_to("Creative Writer")
+    best = retriever.search("How do I reset my router?")[0]
+    assert best[1].endswith("router.txt")
+    message = retriever.retrieve("How do I reset my router?")
+    assert message["role"] == "system" and "hold the reset button" in message["content"]
+    assert retriever.retrieve("zzz qqq") is None
+    assert retriever.stats() == {"vectors": 2, "queries": 2, "hits": 1}
+
+    with pytest.raises(ValueError):
+        Retriever(str(tmp_path / "index"), HashingEmbedder(128))
@@ -0,0 +1,161 @@
+import asyncio
+
+import pytest
+
+from client_pool import ClientPool
+from fake_openai import FakeOpenAIServer
+from router import Backend, BackendUnavailable, ModelRouter, load_backends
+
+MODEL = "local-model"
+MESSAGES = [{"role": "user", "content": "Hello!"}]
+
+
+async def deltas(client):
+    stream = await client.chat.completions.create(model=MODEL, messages=MESSAGES, stream=True)
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+async def route(router, pool, requests, concurrency=4):
+    """Texts of requests streamed through router, None for each that failed"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            try:
+                return "".join([delta async for delta in router.stream(
+                    MODEL, lambda b: deltas(pool.get(b.api_key, base_url=b.base_url)))])
+            except Exception:
+                return None
+
+    return await asyncio.gather(*(one() for _ in range(requests)))
+
+
+def two_backends(fast, slow, **settings):
+    return ModelRouter([
+        Backend("fast", base_url=fast.base_url, api_key="sk-fast", models=[MODEL]),
+        Backend("slow", base_url=slow.base_url, api_key="sk-slow", models=[MODEL]),
+    ], **settings)
+
+
+def test_most_traffic_goes_to_the_faster_backend():
+    async def run():
+        async with FakeOpenAIServer(tokens=3, first_token_delay=0.01) as fast, \
+                FakeOpenAIServer(tokens=3, first_token_delay=0.15) as slow:
+            router = two_backends(fast, slow, explore=0.0)
+            pool = ClientPool()
+            try:
+                texts = await route(router, pool, 60)
+            finally:
+                await pool.aclose()
+            return texts, router
+
+    texts, router = asyncio.run(run())
+    assert texts == ["The quick brown"] * 60
+    fast, slow = router.backends
+    assert fast.requests > 3 * slow.requests
+    assert fast.ttft < slow.ttft
+    assert router.failovers == 0
+
+
+def test_requests_fail_over_when_a_backend_goes_down():
+    async def run():
+        async with FakeOpenAIServer(tokens=3) as slow:
+            fast = FakeOpenAIServer(tokens=3)
+            await fast.start()
+            router = two_backends(fast, slow, explore=0.0)
+            pool = ClientPool()
+            try:
+                await route(router, pool, 4)
+            finally:
+                await pool.aclose()
+            await fast.stop()
+            pool = ClientPool()
+            try:
+                texts = await route(router, pool, 20)
+            finally:
+                await pool.aclose()
+            return texts, router, slow
+
+    texts, router, slow = asyncio.run(run())
+    assert texts == ["The quick brown"] * 20
+    assert router.failovers == router.backends[0].errors > 0
+    assert slow.requests >= 20
+
+
+def test_errors_before_the_first_token_fail_over():
+    async def run():
+        async with FakeOpenAIServer(tokens=3, error_rate=1.0, error_status=503) as broken, \
+                FakeOpenAIServer(tokens=3, first_token_delay=0.05) as healthy:
+            router = two_backends(broken, healthy, explore=0.0)
+            pool = ClientPool()
+            try:
+                texts = await route(router, pool, 10, concurrency=1)
+            finally:
+                await pool.aclose()
+            return texts, router, broken
+
+    texts, router, broken = asyncio.run(run())
+    assert texts == ["The quick brown"] * 10
+    # Each failure fails over at once, and the error penalty keeps later requests away
+    assert 0 < broken.requests < 10
+    assert router.failovers == broken.requests == router.backends[0].errors
+
+
+def test_client_errors_are_not_failed_over():
+    async def run():
+        async with FakeOpenAIServer(error_rate=1.0, error_status=400) as bad, FakeOpenAIServer() as good:
+            router = two_backends(bad, good, explore=0.0)
+            pool = ClientPool()
+            try:
+                texts = await route(router, pool, 1)
+            finally:
+                await pool.aclose()
+            return texts, good
+
+    texts, good = asyncio.run(run())
+    assert texts == [None]
+    assert good.requests == 0
+
+
+def test_unknown_model_and_unavailable_backends():
+    async def failing(backend):
+        raise BackendUnavailable(f"{backend.name} needs a key")
+        yield
+
+    async def run(model):
+        router = ModelRouter([Backend("a", models=[MODEL]), Backend("b", models=[MODEL])])
+        with pytest.raises(BackendUnavailable) as error:
+            async for _ in router.stream(model, failing):
+                pass
+        return str(error.value), router
+
+    message, _ = asyncio.run(run("other-model"))
+    assert "other-model" in message
+    message, router = asyncio.run(run(MODEL))
+    assert message.endswith("needs a key")
+    # A backend that cannot take a request is not counted as failing
+    assert all(backend.errors == 0 for backend in router.backends)
+
+
+def test_load_backends():
+    assert [b.name for b in load_backends("")] == ["openai"]
+    backends = load_backends('[{"name": "local", "base_url": "http://127.0.0.1:1/v1", "models": ["m"]}]')
+    assert backends[0].base_url == "http://127.0.0.1:1/v1" and backends[0].models == ["m"]
+
+
+def test_circuit_opens_after_repeated_failures():
+    router = ModelRouter([Backend("a", models=[MODEL]), Backend("b", models=[MODEL])], failure_threshold=3, explore=0.0)
+    a, b = router.backends
+    router.record_success(b, 5.0)
+    for _ in range(3):
+        router.record_failure(a)
+    assert router.stats()["a"]["open"]
+    assert router.choose(MODEL) is b
+    # With every circuit open the backend closest to the end of its cooldown is probed
+    for _ in range(3):
+        router.record_failure(b)
+    assert router.choose(MODEL) is a
+    router.record_success(a, 0.1)
+    assert not router.stats()["a"]["open"]
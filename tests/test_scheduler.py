@@ -0,0 +1,169 @@
+import asyncio
+import time
+
+import openai
+
+from client_pool import ClientPool
+from fake_openai import FakeOpenAIServer
+from scheduler import AdmissionController, TokenBucket
+
+MESSAGES = [{"role": "user", "content": "Hello!"}]
+
+
+async def admit(ticket, cancel=None):
+    """Updates yielded while the ticket waits"""
+    return [update async for update in ticket.wait(cancel)]
+
+
+def test_token_bucket_orders_callers_by_delay():
+    bucket = TokenBucket(60)
+    assert bucket.reserve(60) == 0
+    first, second = bucket.reserve(1), bucket.reserve(1)
+    assert 0.9 < first < 1.1 and 1.9 < second < 2.1
+    # Refunded tokens move later callers forward
+    bucket.refund(2)
+    assert 0.9 < bucket.reserve(1) < 1.1
+
+
+def test_sessions_are_served_round_robin():
+    async def run():
+        controller = AdmissionController(max_concurrent=1, requests_per_min=1e9, tokens_per_min=1e9)
+        holder = controller.ticket("busy", "key", 1)
+        await admit(holder)
+        order = []
+
+        async def request(session_id, n):
+            ticket = controller.ticket(session_id, "key", 1)
+            updates = await admit(ticket)
+            order.append(f"{session_id}{n}")
+            ticket.release()
+            return updates
+
+        # A queues four requests before B queues two; B still gets every other slot
+        tasks = [asyncio.create_task(request("a", n)) for n in range(4)]
+        await asyncio.sleep(0)
+        tasks += [asyncio.create_task(request("b", n)) for n in range(2)]
+        await asyncio.sleep(0.01)
+        assert controller.queue_depth() == 6
+        holder.release()
+        updates = await asyncio.gather(*tasks)
+        return order, updates, controller.stats()
+
+    order, updates, stats = asyncio.run(run())
+    assert order == ["a0", "b0", "a1", "b1", "a2", "a3"]
+    # Queue positions count the other session's turns under round robin
+    assert updates[3][0] == ("queue", 4)
+    assert updates[4][0] == ("queue", 2)
+    assert updates[5][0] == ("queue", 4)
+    assert stats["active"] == 0 and stats["queue_depth"] == 0 and stats["max_queue_depth"] == 6
+
+
+def test_stop_while_queued_returns_at_once_and_frees_the_place():
+    async def run():
+        controller = AdmissionController(max_concurrent=1, requests_per_min=1e9, tokens_per_min=1e9)
+        holder = controller.ticket("busy", "key", 1)
+        await admit(holder)
+        cancel = asyncio.Event()
+        ticket = controller.ticket("s", "key", 1)
+        waiting = asyncio.create_task(admit(ticket, cancel))
+        await asyncio.sleep(0.05)
+        started = time.perf_counter()
+        cancel.set()
+        await waiting
+        stopped_after = time.perf_counter() - started
+        ticket.release()
+        depth = controller.queue_depth()
+        holder.release()
+        return ticket, stopped_after, depth, controller.active
+
+    ticket, stopped_after, depth, active = asyncio.run(run())
+    assert not ticket.admitted
+    assert stopped_after < 0.2
+    assert depth == 0 and active == 0
+
+
+def test_stop_while_rate_limited_returns_at_once():
+    async def run():
+        controller = AdmissionController(max_concurrent=10, requests_per_min=60, tokens_per_min=1e9)
+        for _ in range(60):
+            controller.reserve_rate("key", 1)
+        cancel = asyncio.Event()
+        ticket = controller.ticket("s", "key", 1)
+        waiting = asyncio.create_task(admit(ticket, cancel))
+        await asyncio.sleep(0.05)
+        started = time.perf_counter()
+        cancel.set()
+        updates = await waiting
+        return ticket, updates, time.perf_counter() - started, controller
+
+    ticket, updates, stopped_after, controller = asyncio.run(run())
+    assert updates[0][0] == "rate" and updates[0][1] > 0.5
+    assert not ticket.admitted and stopped_after < 0.2
+    assert controller.active == 0 and controller.stats()["rate_limited"] == 1
+
+
+def test_admission_keeps_a_limited_upstream_from_returning_429s():
+    async def complete(client):
+        try:
+            stream = await client.chat.completions.create(model="gpt-4o-mini", messages=MESSAGES, stream=True)
+            async for _ in stream:
+                pass
+            return True
+        except openai.RateLimitError:
+            return False
+
+    async def run(controller):
+        async with FakeOpenAIServer(tokens=10, token_delay=0.005, max_concurrent=4) as server:
+            pool = ClientPool(base_url=server.base_url)
+            client = pool.get("sk-test").with_options(max_retries=0)
+
+            async def request(i):
+                if controller is None:
+                    return await complete(client)
+                ticket = controller.ticket(f"s{i % 5}", "sk-test", 100)
+                try:
+                    await admit(ticket)
+                    return await complete(client)
+                finally:
+                    ticket.release()
+
+            try:
+                results = await asyncio.gather(*(request(i) for i in range(20)))
+            finally:
+                await pool.aclose()
+            return results
+
+    assert not all(asyncio.run(run(None)))
+    controller = AdmissionController(max_concurrent=4, requests_per_min=1e9, tokens_per_min=1e9)
+    assert all(asyncio.run(run(controller)))
+    assert controller.stats()["admitted"] == 20 and controller.stats()["max_queue_depth"] > 0
+
+
+def test_stop_ends_a_queued_chat_turn(app, fake_server, loop, monkeypatch):
+    controller = AdmissionController(max_concurrent=1, requests_per_min=1e9, tokens_per_min=1e9)
+    monkeypatch.setattr(app, "scheduler", controller)
+
+    async def run():
+        holder = controller.ticket("busy", "key", 1)
+        await admit(holder)
+        shown = []
+
+        async def turn():
+            async for history, _ in app.chat_response_stream("Hello", [], "sk-test", "gpt-4o-mini", 0.7, 100,
+                                                             app.DEFAULT_ASSISTANT, "", session_id="stop-queued"):
+                shown.append(history[-1]["content"])
+
+        task = asyncio.create_task(turn())
+        while not shown or not shown[-1].startswith("⏳"):
+            await asyncio.sleep(0.01)
+        started = time.perf_counter()
+        app.get_session("stop-queued").stop_run()
+        await task
+        holder.release()
+        return shown, time.perf_counter() - started
+
+    shown, stopped_after = loop.run_until_complete(run())
+    assert shown[-1] == "⏹️ *Stopped*"
+    assert stopped_after < 0.2
+    assert controller.active == 0 and controller.queue_depth() == 0
+    assert not fake_server.received
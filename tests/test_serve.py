@@ -0,0 +1,76 @@
+import asyncio
+
+from serve import COOKIE_NAME, StickyProxy, worker_for_peer, worker_from_cookie
+
+
+async def echo_worker(name):
+    """A worker that reads the whole request body before answering, as uvicorn does, and echoes it"""
+    async def handle(reader, writer):
+        head = await reader.readuntil(b"\r\n\r\n")
+        length = 0
+        for line in head.split(b"\r\n")[1:]:
+            key, _, value = line.partition(b":")
+            if key.strip().lower() == b"content-length":
+                length = int(value)
+        body = await reader.readexactly(length)
+        reply = name.encode() + b":" + body
+        writer.write(b"HTTP/1.1 200 OK\r\ncontent-length: %d\r\nconnection: close\r\n\r\n" % len(reply) + reply)
+        await writer.drain()
+        writer.close()
+
+    return await asyncio.start_server(handle, "127.0.0.1", 0)
+
+
+async def request(port, body=b"hello", cookie=None):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    headers = f"POST /queue/join HTTP/1.1\r\nhost: test\r\ncontent-length: {len(body)}\r\n"
+    if cookie is not None:
+        headers += f"Cookie: {COOKIE_NAME}={cookie}\r\n"
+    writer.write(headers.encode() + b"\r\n" + body)
+    response = await asyncio.wait_for(reader.read(), 5)
+    writer.close()
+    return response
+
+
+async def proxied(workers, requests):
+    servers = [await echo_worker(f"w{i}") for i in range(workers)]
+    ports = [server.sockets[0].getsockname()[1] for server in servers]
+    proxy = await asyncio.start_server(StickyProxy("127.0.0.1", ports).handle, "127.0.0.1", 0)
+    try:
+        port = proxy.sockets[0].getsockname()[1]
+        return [await request(port, **kwargs) for kwargs in requests]
+    finally:
+        proxy.close()
+        for server in servers:
+            server.close()
+
+
+def test_post_without_cookie_gets_its_answer_and_a_cookie():
+    (response,) = asyncio.run(proxied(2, [{}]))
+    head, _, body = response.partition(b"\r\n\r\n")
+    assert head.startswith(b"HTTP/1.1 200")
+    assert f"Set-Cookie: {COOKIE_NAME}=".encode() in head
+    assert body.endswith(b":hello")
+
+
+def test_cookie_pins_the_worker():
+    responses = asyncio.run(proxied(3, [{"cookie": 2}, {"cookie": 1, "body": b"x" * 100000}]))
+    assert responses[0].endswith(b"w2:hello") and b"Set-Cookie" not in responses[0]
+    assert responses[1].endswith(b"w1:" + b"x" * 100000)
+
+
+def test_worker_from_cookie():
+    head = b"GET / HTTP/1.1\r\nHost: x\r\nCookie: theme=dark; chat_worker=1\r\n\r\n"
+    assert worker_from_cookie(head, 2) == 1
+    assert worker_from_cookie(head, 1) is None
+    assert worker_from_cookie(b"GET / HTTP/1.1\r\n\r\n", 2) is None
+
+
+def test_new_clients_are_pinned_by_address():
+    assert worker_for_peer(("10.0.0.7", 50000), 4) == worker_for_peer(("10.0.0.7", 50001), 4)
+    assert len({worker_for_peer((f"10.0.0.{i}", 1), 4) for i in range(50)}) == 4
+
+
+def test_connections_from_one_new_client_reach_the_same_worker():
+    responses = asyncio.run(proxied(4, [{}] * 6))
+    assert len({response.rpartition(b":hello")[0].rpartition(b"\r\n")[2] for response in responses}) == 1
@@ -0,0 +1,76 @@
+import time
+
+from sessions import SessionState, SessionStore
+
+
+class CountingSession(SessionState):
+    """SessionState counting how often its size is read"""
+
+    __slots__ = ("size_reads",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.size_reads = 0
+
+    @property
+    def nbytes(self):
+        self.size_reads += 1
+        return self.history.nbytes
+
+
+def chat(store, session_id, chars):
+    session = store.get(session_id)
+    session.add_message("user", "x" * chars)
+    store.save(session)
+    return session
+
+
+def test_least_recently_used_sessions_are_evicted_over_the_count():
+    store = SessionStore(max_sessions=3)
+    for i in range(5):
+        chat(store, f"s{i}", 10)
+    store.get("s2")
+    store.get("s5")
+    # s2 was used again, so s3 goes next
+    assert list(store._sessions) == ["s4", "s2", "s5"]
+    assert store.evictions == 3
+
+
+def test_sessions_are_evicted_over_the_byte_budget():
+    store = SessionStore(max_bytes=2500)
+    for i in range(5):
+        chat(store, f"s{i}", 1000)
+    store.get("s4")
+    # Evicting happens on the next get; only the two newest sessions fit
+    assert [session_id for session_id in ("s0", "s1", "s2", "s3", "s4") if store.peek(session_id)] == ["s3", "s4"]
+    assert store.nbytes == sum(session.nbytes for session in store._sessions.values())
+
+
+def test_idle_sessions_expire():
+    store = SessionStore(ttl=0.05)
+    chat(store, "idle", 10)
+    time.sleep(0.1)
+    chat(store, "active", 10)
+    assert store.peek("idle") is None and store.nbytes == 10
+
+
+def test_a_turn_does_not_read_the_size_of_every_session():
+    store = SessionStore(factory=CountingSession)
+    sessions = [chat(store, f"s{i}", 100) for i in range(200)]
+    reads = sum(session.size_reads for session in sessions)
+    for _ in range(50):
+        chat(store, "s0", 10)
+    assert sum(session.size_reads for session in sessions) - reads == 50
+    assert store.nbytes == 200 * 100 + 50 * 10
+
+
+def test_discard_and_clear_keep_the_total_right():
+    store = SessionStore()
+    chat(store, "a", 100)
+    chat(store, "b", 50)
+    store.discard("a")
+    assert store.nbytes == 50
+    session = store.get("b")
+    session.clear()
+    store.save(session)
+    assert store.nbytes == 0
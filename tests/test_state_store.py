@@ -0,0 +1,65 @@
+import asyncio
+import threading
+
+from sessions import SessionStore
+from state_store import SQLiteBackend
+
+
+class ThreadRecordingBackend(SQLiteBackend):
+    """SQLiteBackend that records which threads it ran on"""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.threads = []
+
+    def load(self, session_id, newer_than=0):
+        self.threads.append(threading.get_ident())
+        return super().load(session_id, newer_than)
+
+    def save(self, session_id, version, data):
+        self.threads.append(threading.get_ident())
+        return super().save(session_id, version, data)
+
+
+def test_workers_share_sessions_through_sqlite(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+    first, second = SessionStore(backend=SQLiteBackend(path)), SessionStore(backend=SQLiteBackend(path))
+
+    session = first.get("s", model="gpt-4o-mini")
+    session.add_message("user", "Hello")
+    session.add_message("assistant", "Hi there")
+    first.save(session)
+
+    other = second.get("s", model="gpt-4o-mini")
+    assert [m["content"] for m in other.history.as_messages()] == ["Hello", "Hi there"]
+    other.add_message("user", "Again")
+    second.save(other)
+
+    # The first worker reloads only because the row changed, and sees the other worker's turn
+    assert first.get("s").history.as_messages()[-1]["content"] == "Again"
+    loads = first.backend.loads
+    first.get("s")
+    assert first.backend.loads == loads
+
+
+def test_async_access_runs_the_backend_off_the_event_loop(tmp_path):
+    backend = ThreadRecordingBackend(str(tmp_path / "state.sqlite3"))
+    store = SessionStore(backend=backend)
+
+    async def run():
+        session = await store.aget("s", model="gpt-4o-mini")
+        session.add_message("user", "Hello")
+        await store.asave(session)
+        return threading.get_ident(), session
+
+    loop_thread, session = asyncio.run(run())
+    assert len(backend.threads) == 2 and loop_thread not in backend.threads
+    assert backend.load("s")[1]["history"][0][1] == "Hello"
+    assert session.version == backend.load("s")[0]
+
+
+def test_discard_removes_the_shared_row(tmp_path):
+    store = SessionStore(backend=SQLiteBackend(str(tmp_path / "state.sqlite3")))
+    store.save(store.get("s"))
+    store.discard("s")
+    assert store.backend.load("s") is None and len(store) == 0
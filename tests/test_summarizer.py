@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+from client_pool import ClientPool
+from context_window import MESSAGE_OVERHEAD_TOKENS, Message, count_tokens, prompt_budget
+from metrics import SUMMARY_FAILURES
+from sessions import SessionState
+from summarizer import SUMMARY_PREFIX, OpenAISummarizer, RollingSummary, Summarizer, TruncatingSummarizer
+from fake_openai import FakeOpenAIServer
+
+MAX_TOKENS = 2000
+
+
+class FailingSummarizer(Summarizer):
+    async def summarize(self, previous_summary, messages):
+        raise RuntimeError("upstream down")
+
+
+async def converse(app, session, turns, client=None):
+    """Messages of the last of several long turns, letting the background summary finish after each"""
+    for turn in range(turns):
+        messages = app.build_messages(session, f"Question {turn}. " + "detail " * 300, MAX_TOKENS, client)
+        session.add_message("assistant", f"Answer {turn}. " + "words " * 300)
+        await session.summary.wait()
+    return messages
+
+
+def test_summary_replaces_evicted_turns(app, monkeypatch):
+    monkeypatch.setattr(app, "summarizer_factory", lambda client: TruncatingSummarizer())
+    session = SessionState("summary", model="gpt-4", system_prompt="You are terse.", rolling_summary=True)
+    messages = asyncio.run(converse(app, session, 20))
+
+    assert messages[0] == {"role": "system", "content": "You are terse."}
+    summary = messages[1]
+    assert summary["role"] == "system" and summary["content"].startswith(SUMMARY_PREFIX)
+    # The oldest turns are gone from the prompt and stand in the summary instead
+    assert "user: Question 0" in summary["content"]
+    assert not any(m["content"].startswith("Question 0.") for m in messages[2:])
+    assert messages[-1]["content"].startswith("Question 19.")
+    tokens = sum(count_tokens(m["content"], "gpt-4") + MESSAGE_OVERHEAD_TOKENS for m in messages)
+    assert tokens <= prompt_budget("gpt-4", MAX_TOKENS) - count_tokens("You are terse.", "gpt-4")
+    assert session.summary.saved_tokens > 0
+
+
+def test_summary_is_updated_incrementally():
+    seen = []
+
+    class Recording(Summarizer):
+        async def summarize(self, previous_summary, messages):
+            seen.append((previous_summary, [m.content for m in messages]))
+            return (previous_summary + " " if previous_summary else "") + "+".join(m.content for m in messages)
+
+    async def run():
+        summary = RollingSummary()
+        summary.schedule([Message("user", "a", 5)], Recording())
+        await summary.wait()
+        summary.schedule([Message("assistant", "b", 5)], Recording())
+        await summary.wait()
+        return summary
+
+    summary = asyncio.run(run())
+    # Each update gets the previous summary and only the newly evicted messages
+    assert seen == [("", ["a"]), ("a", ["b"])]
+    assert summary.text == ""
+    assert summary.publish() and summary.text == "a b"
+    assert summary.evicted_tokens == 10
+
+
+def test_openai_summarizer_against_fake_server():
+    async def run():
+        async with FakeOpenAIServer(tokens=6) as server:
+            pool = ClientPool(base_url=server.base_url)
+            try:
+                text = await OpenAISummarizer(pool.get("sk-test")).summarize("", [Message("user", "hello", 5)])
+            finally:
+                await pool.aclose()
+            return text, server.received[-1]
+
+    text, payload = asyncio.run(run())
+    assert text == "The quick brown fox jumps over"
+    assert not payload.get("stream")
+    assert "user: hello" in payload["messages"][-1]["content"]
+
+
+def test_openai_summarizer_needs_a_client():
+    with pytest.raises(ValueError):
+        OpenAISummarizer(None)
+
+
+def test_failed_updates_keep_the_summary_and_are_counted():
+    async def run():
+        summary = RollingSummary()
+        summary.schedule([Message("user", "a", 5), Message("assistant", "b", 5)], FailingSummarizer())
+        await summary.wait()
+        return summary
+
+    before = SUMMARY_FAILURES.value
+    summary = asyncio.run(run())
+    assert SUMMARY_FAILURES.value == before + 2
+    assert summary.draft == "" and summary.draft_evicted_tokens == 0
+
+
+def test_turns_evicted_without_a_client_are_counted(app):
+    session = SessionState("no-client", model="gpt-4", system_prompt="You are terse.", rolling_summary=True)
+    before = SUMMARY_FAILURES.value
+    messages = asyncio.run(converse(app, session, 12))
+    assert SUMMARY_FAILURES.value > before
+    assert messages[1]["role"] == "user"
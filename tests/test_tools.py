@@ -0,0 +1,151 @@
+import asyncio
+import json
+import sqlite3
+import time
+
+import pytest
+
+from client_pool import ClientPool
+from fake_openai import FakeOpenAIServer
+from tools import Tool, ToolCall, ToolEngine, ToolRegistry, builtin_tools, load_tools
+
+MESSAGES = [{"role": "user", "content": "Check the routers."}]
+
+
+def call(name, arguments):
+    tool_call = ToolCall(0)
+    tool_call.name = name
+    tool_call.arguments = [arguments if isinstance(arguments, str) else json.dumps(arguments)]
+    return tool_call
+
+
+def execute(engine, name, arguments):
+    return json.loads(asyncio.run(engine.execute(call(name, arguments))))
+
+
+@pytest.fixture
+def files_root(tmp_path):
+    root = tmp_path / "kb"
+    root.mkdir()
+    (root / "routers.txt").write_text("Router A is up\nRouter B is down\n", encoding="utf-8")
+    (tmp_path / "secret.txt").write_text("router password hunter2\n", encoding="utf-8")
+    return str(root)
+
+
+@pytest.fixture
+def sqlite_path(tmp_path):
+    path = str(tmp_path / "sales.db")
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE sales (region TEXT, amount INTEGER)")
+    db.executemany("INSERT INTO sales VALUES (?, ?)", [("north", 10), ("south", 20), ("north", 5)])
+    db.commit()
+    db.close()
+    return path
+
+
+@pytest.fixture
+def engine(files_root, sqlite_path):
+    return ToolEngine(ToolRegistry(builtin_tools(files_root, sqlite_path).values()), personas=["test"])
+
+
+def test_calculator(engine):
+    assert execute(engine, "calculator", {"expression": "(1 + 2) * 2 ** 3"})["result"] == 24
+    assert "failed" in execute(engine, "calculator", {"expression": "__import__('os')"})["error"]
+    assert "too large" in execute(engine, "calculator", {"expression": "9 ** 9 ** 9"})["error"]
+
+
+def test_results_that_cannot_be_serialized_are_reported_as_errors(engine):
+    # Integers over 4300 digits cannot be turned into text
+    result = execute(engine, "calculator", {"expression": "(10 ** 999) ** 5"})
+    assert result["error"].startswith("calculator failed") and "digits" in result["error"]
+
+
+def test_arguments_outside_the_schema_are_rejected(engine, files_root, tmp_path):
+    result = execute(engine, "search_files", {"query": "password", "root": str(tmp_path)})
+    assert result == {"error": "Unexpected arguments: root"}
+    result = execute(engine, "sql_query", {"query": "SELECT 1", "path": str(tmp_path / "other.db")})
+    assert result == {"error": "Unexpected arguments: path"}
+    assert execute(engine, "search_files", {"max_results": 3}) == {"error": "Missing arguments: query"}
+    assert "valid JSON" in execute(engine, "calculator", "{not json")["error"]
+    assert engine.stats()["search_files"]["errors"] == 2
+
+
+def test_search_files_stays_under_its_root(engine):
+    result = execute(engine, "search_files", {"query": "router"})
+    assert [(m["path"], m["line"]) for m in result["matches"]] == [("routers.txt", 1), ("routers.txt", 2)]
+    assert execute(engine, "search_files", {"query": "password"})["matches"] == []
+
+
+def test_sql_query_is_read_only(engine, sqlite_path):
+    result = execute(engine, "sql_query", {"query": "SELECT region, SUM(amount) FROM sales GROUP BY region ORDER BY region"})
+    assert result["columns"] == ["region", "SUM(amount)"] and result["rows"] == [["north", 15], ["south", 20]]
+    assert "failed" in execute(engine, "sql_query", {"query": "DELETE FROM sales"})["error"]
+    assert sqlite3.connect(sqlite_path).execute("SELECT COUNT(*) FROM sales").fetchone() == (3,)
+
+
+def test_slow_tools_time_out_and_results_are_cached():
+    calls = []
+
+    def lookup(n):
+        calls.append(n)
+        time.sleep(0.3 if n == 0 else 0)
+        return {"router": n}
+
+    registry = ToolRegistry([Tool("lookup", "Router status", {"type": "object", "properties": {"n": {"type": "integer"}}}, lookup)])
+    engine = ToolEngine(registry, personas=["test"], timeout=0.05)
+    assert "timed out" in execute(engine, "lookup", {"n": 0})["error"]
+    assert execute(engine, "lookup", {"n": 1}) == {"router": 1}
+    assert execute(engine, "lookup", {"n": 1}) == {"router": 1}
+    assert calls == [0, 1]
+    stats = engine.stats()["lookup"]
+    assert stats["timeouts"] == 1 and stats["cache_hits"] == 1
+
+
+def test_load_tools_leaves_out_unconfigured_tools():
+    assert list(load_tools("calculator,search_files,sql_query", "", "").tools) == ["calculator"]
+    assert load_tools("", "", "") is None
+    with pytest.raises(ValueError):
+        load_tools("shell", "", "")
+
+
+def test_tool_calls_run_concurrently_against_the_fake_server():
+    delay = 0.2
+
+    def lookup(n):
+        time.sleep(delay)
+        return {"router": n, "status": "ok"}
+
+    registry = ToolRegistry([builtin_tools()["calculator"]])
+    for i in range(3):
+        registry.register(Tool(f"lookup_{i}", "Router status", {"type": "object", "properties": {"n": {"type": "integer"}}}, lookup))
+    engine = ToolEngine(registry, personas=["test"], threads=4)
+    arguments = {"calculator": {"expression": "6 * 7"}, **{f"lookup_{i}": {"n": i} for i in range(3)}}
+
+    async def run():
+        async with FakeOpenAIServer(tokens=20, tool_calls=4, tool_arguments=arguments) as server:
+            pool = ClientPool(base_url=server.base_url)
+            client = pool.get("sk-test")
+
+            async def open_round(messages, tools):
+                stream = await client.chat.completions.create(model="gpt-4o-mini", messages=messages, stream=True,
+                                                              **({"tools": tools} if tools else {}))
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+                    elif chunk.choices and chunk.choices[0].delta.tool_calls:
+                        for tool_call in chunk.choices[0].delta.tool_calls:
+                            yield tool_call
+
+            try:
+                started = time.perf_counter()
+                text = "".join([delta async for delta in engine.run(MESSAGES, open_round)])
+                return text, time.perf_counter() - started, list(server.received)
+            finally:
+                await pool.aclose()
+
+    text, seconds, payloads = asyncio.run(run())
+    # Three blocking lookups of 0.2 s each ran side by side
+    assert seconds < 3 * delay
+    assert '"result": 42' in text and text.count('"status": "ok"') == 3
+    assert len(payloads) == 2 and engine.rounds == 1
+    assert [m["role"] for m in payloads[1]["messages"]] == ["user", "assistant", "tool", "tool", "tool", "tool"]
@@ -0,0 +1,445 @@
+"""Local tools the model can call through the chat completions tool-calling protocol
+
+A ToolRegistry holds the tools and their JSON schemas; a ToolEngine runs the
+conversation rounds: it streams a completion, starts each tool call as soon
+as its arguments have finished streaming, runs independent calls
+concurrently (blocking ones in a thread pool), then sends the results back
+and streams the next round until the model answers in text.
+
+Built-in tools, enabled with TOOLS:
+
+* calculator: arithmetic and math functions, evaluated without eval();
+* search_files: case-insensitive text search under TOOL_FILES_ROOT;
+* sql_query: read-only SELECT queries against the SQLite database at TOOL_SQLITE_PATH.
+
+Tools only receive the arguments their schema declares. Where a tool reads
+from (its root directory or database) is bound when the tool is built, so
+the model cannot point it anywhere else.
+"""
+import ast
+import asyncio
+import functools
+import inspect
+import json
+import math
+import operator
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing
+
+# Tools offered to the model (search_files and sql_query also need their path below); empty = none
+TOOLS = os.getenv("TOOLS", "calculator,search_files,sql_query")
+# Personas that get the tools
+TOOL_PERSONAS = os.getenv("TOOL_PERSONAS", "Tech Support,Business Analyst")
+TOOL_FILES_ROOT = os.getenv("TOOL_FILES_ROOT", "")
+TOOL_SQLITE_PATH = os.getenv("TOOL_SQLITE_PATH", "")
+# Seconds a single tool call may take before the model is told it timed out
+TOOL_TIMEOUT_SECONDS = float(os.getenv("TOOL_TIMEOUT_SECONDS", "5"))
+# Completion rounds with tool calls per answer; the round after the last one gets no tools and must answer
+TOOL_MAX_ROUNDS = int(os.getenv("TOOL_MAX_ROUNDS", "4"))
+# Threads for blocking tools
+TOOL_THREADS = int(os.getenv("TOOL_THREADS", "4"))
+# Results of identical calls reused for this long
+TOOL_CACHE_SIZE = int(os.getenv("TOOL_CACHE_SIZE", "256"))
+TOOL_CACHE_TTL_SECONDS = float(os.getenv("TOOL_CACHE_TTL_SECONDS", "300"))
+# Longest tool result sent back to the model, in characters
+TOOL_RESULT_MAX_CHARS = int(os.getenv("TOOL_RESULT_MAX_CHARS", "4000"))
+
+
+class Tool:
+    """A function the model may call, with the JSON schema of its arguments
+
+    Coroutine functions run on the event loop; plain functions run in the
+    engine's thread pool unless blocking=False. cacheable=False tools are
+    run for every call.
+    """
+
+    __slots__ = ("name", "description", "parameters", "func", "blocking", "timeout", "cacheable")
+
+    def __init__(self, name, description, parameters, func, blocking=True, timeout=None, cacheable=True):
+        self.name = name
+        self.description = description
+        self.parameters = parameters
+        self.func = func
+        self.blocking = blocking and not inspect.iscoroutinefunction(func)
+        self.timeout = timeout
+        self.cacheable = cacheable
+
+    def schema(self):
+        return {"type": "function", "function": {"name": self.name, "description": self.description, "parameters": self.parameters}}
+
+
+class ToolRegistry:
+    """Tools by name"""
+
+    def __init__(self, tools=()):
+        self.tools = {}
+        for tool in tools:
+            self.register(tool)
+
+    def register(self, tool):
+        self.tools[tool.name] = tool
+        return tool
+
+    def tool(self, name, description, parameters, **kwargs):
+        """Decorator registering a function as a tool"""
+        def decorator(func):
+            self.register(Tool(name, description, parameters, func, **kwargs))
+            return func
+        return decorator
+
+    def get(self, name):
+        return self.tools.get(name)
+
+    def schemas(self):
+        return [tool.schema() for tool in self.tools.values()]
+
+    def __len__(self):
+        return len(self.tools)
+
+
+class ToolCall:
+    """One tool call assembled from streamed fragments"""
+
+    __slots__ = ("index", "id", "name", "arguments")
+
+    def __init__(self, index):
+        self.index = index
+        self.id = None
+        self.name = ""
+        self.arguments = []
+
+    def arguments_text(self):
+        return "".join(self.arguments)
+
+    def as_dict(self):
+        return {"id": self.id, "type": "function", "function": {"name": self.name, "arguments": self.arguments_text()}}
+
+
+class ToolCallAccumulator:
+    """Assembles streamed tool call deltas, handing each call to on_ready once its arguments are complete
+
+    Calls stream one after another, so a call is complete when the next one
+    starts; it is handed over right then, while later calls still stream,
+    as long as its arguments parse. The rest are handed over by finish().
+    """
+
+    def __init__(self, on_ready):
+        self.on_ready = on_ready
+        self.calls = {}
+        self._current = None
+        self._ready = set()
+
+    def feed(self, delta):
+        call = self.calls.get(delta.index)
+        if call is None:
+            if self._current is not None:
+                self._hand_over(self.calls[self._current], final=False)
+            call = self.calls[delta.index] = ToolCall(delta.index)
+            self._current = delta.index
+        if delta.id:
+            call.id = delta.id
+        function = delta.function
+        if function is not None:
+            if function.name:
+                call.name += function.name
+            if function.arguments:
+                call.arguments.append(function.arguments)
+
+    def finish(self):
+        for call in self.calls.values():
+            self._hand_over(call, final=True)
+        return sorted(self.calls.values(), key=lambda call: call.index)
+
+    def _hand_over(self, call, final):
+        if call.index in self._ready:
+            return
+        if not final:
+            try:
+                json.loads(call.arguments_text() or "{}")
+            except ValueError:
+                return
+        self._ready.add(call.index)
+        self.on_ready(call)
+
+
+class ToolStats:
+    __slots__ = ("calls", "errors", "timeouts", "cache_hits", "seconds")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.cache_hits = 0
+        self.seconds = 0.0
+
+
+class ToolEngine:
+    """Runs the tool-calling rounds of an answer for the personas that have tools"""
+
+    def __init__(self, registry, personas=TOOL_PERSONAS, timeout=TOOL_TIMEOUT_SECONDS, max_rounds=TOOL_MAX_ROUNDS,
+                 threads=TOOL_THREADS, cache_size=TOOL_CACHE_SIZE, cache_ttl=TOOL_CACHE_TTL_SECONDS):
+        self.registry = registry
+        self.personas = {name.strip() for name in personas.split(",") if name.strip()} if isinstance(personas, str) else set(personas)
+        self.timeout = timeout
+        self.max_rounds = max_rounds
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.rounds = 0
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="tool")
+        # (tool name, canonical arguments) -> (time, result)
+        self._cache = OrderedDict()
+        self._stats = {}
+
+    def applies_to(self, persona):
+        return persona in self.personas and len(self.registry) > 0
+
+    async def run(self, messages, open_round):
+        """Answer deltas for messages, running the model's tool calls between completion rounds
+
+        open_round(messages, tools) streams one completion as text deltas and
+        tool call deltas; tools is None for the last round. Tool calls start
+        while the rest of the round still streams.
+        """
+        messages = list(messages)
+        for round_index in range(self.max_rounds + 1):
+            tools = self.registry.schemas() if round_index < self.max_rounds else None
+            tasks = {}
+            text = []
+
+            def start(call):
+                tasks[call.index] = asyncio.ensure_future(self.execute(call))
+
+            accumulator = ToolCallAccumulator(start)
+            try:
+                stream = open_round(messages, tools)
+                async with aclosing(stream):
+                    async for item in stream:
+                        if isinstance(item, str):
+                            text.append(item)
+                            yield item
+                        else:
+                            accumulator.feed(item)
+                calls = accumulator.finish()
+                if not calls:
+                    return
+                self.rounds += 1
+                results = await asyncio.gather(*(tasks[call.index] for call in calls))
+            finally:
+                for task in tasks.values():
+                    task.cancel()
+            messages.append({"role": "assistant", "content": "".join(text) or None, "tool_calls": [call.as_dict() for call in calls]})
+            messages.extend({"role": "tool", "tool_call_id": call.id, "content": result} for call, result in zip(calls, results))
+
+    async def execute(self, call):
+        """The result of one call as text for the model; failures are reported to the model, not raised"""
+        tool = self.registry.get(call.name)
+        if tool is None:
+            return _error(f"Unknown tool {call.name!r}")
+        stats = self._stats.setdefault(tool.name, ToolStats())
+        stats.calls += 1
+        try:
+            arguments = json.loads(call.arguments_text() or "{}")
+        except ValueError as e:
+            stats.errors += 1
+            return _error(f"Arguments are not valid JSON: {e}")
+        if not isinstance(arguments, dict):
+            stats.errors += 1
+            return _error("Arguments must be a JSON object")
+        problem = _check_arguments(tool.parameters, arguments)
+        if problem:
+            stats.errors += 1
+            return _error(problem)
+        key = (tool.name, json.dumps(arguments, sort_keys=True))
+        if tool.cacheable:
+            cached = self._cache.get(key)
+            if cached is not None and time.monotonic() - cached[0] < self.cache_ttl:
+                self._cache.move_to_end(key)
+                stats.cache_hits += 1
+                return cached[1]
+        timeout = tool.timeout or self.timeout
+        started = time.perf_counter()
+        try:
+            if tool.blocking:
+                result = await asyncio.wait_for(
+                    asyncio.get_running_loop().run_in_executor(self._executor, lambda: tool.func(**arguments)), timeout)
+            elif inspect.iscoroutinefunction(tool.func):
+                result = await asyncio.wait_for(tool.func(**arguments), timeout)
+            else:
+                result = tool.func(**arguments)
+            content = json.dumps(result, ensure_ascii=False, default=str)[:TOOL_RESULT_MAX_CHARS]
+        except asyncio.TimeoutError:
+            # A blocking tool keeps its thread until it returns; the model gets an answer now
+            stats.timeouts += 1
+            return _error(f"{tool.name} timed out after {timeout:g}s")
+        except Exception as e:
+            stats.errors += 1
+            return _error(f"{tool.name} failed: {e}")
+        finally:
+            stats.seconds += time.perf_counter() - started
+        if tool.cacheable:
+            self._cache[key] = (time.monotonic(), content)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return content
+
+    def stats(self):
+        return {
+            name: {"calls": s.calls, "errors": s.errors, "timeouts": s.timeouts, "cache_hits": s.cache_hits, "seconds": s.seconds}
+            for name, s in self._stats.items()
+        }
+
+    def export(self):
+        """Prometheus text lines for tool calls, failures, cache hits and time"""
+        lines = ["# HELP chat_tool_rounds_total Completion rounds that ended in tool calls",
+                 "# TYPE chat_tool_rounds_total counter", f"chat_tool_rounds_total {self.rounds}"]
+        for name, help_text, kind, field in (
+            ("chat_tool_calls_total", "Tool calls made by the model", "counter", "calls"),
+            ("chat_tool_errors_total", "Tool calls that failed or had invalid arguments", "counter", "errors"),
+            ("chat_tool_timeouts_total", "Tool calls over their timeout", "counter", "timeouts"),
+            ("chat_tool_cache_hits_total", "Tool calls answered from the result cache", "counter", "cache_hits"),
+            ("chat_tool_seconds_total", "Time spent running tools", "counter", "seconds"),
+        ):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            for tool, values in self.stats().items():
+                lines.append(f'{name}{{tool="{tool}"}} {values[field]:.6g}')
+        return lines
+
+
+def _error(message):
+    return json.dumps({"error": message})
+
+
+def _check_arguments(parameters, arguments):
+    """Why arguments do not fit the tool's schema, or None; only declared properties are passed to the tool"""
+    declared = parameters.get("properties", {})
+    unexpected = sorted(name for name in arguments if name not in declared)
+    if unexpected:
+        return f"Unexpected arguments: {', '.join(unexpected)}"
+    missing = [name for name in parameters.get("required", ()) if name not in arguments]
+    if missing:
+        return f"Missing arguments: {', '.join(missing)}"
+    return None
+
+
+_OPERATORS = {
+    ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv, ast.Mod: operator.mod, ast.Pow: operator.pow,
+    ast.USub: operator.neg, ast.UAdd: operator.pos,
+}
+_FUNCTIONS = {name: getattr(math, name) for name in (
+    "sqrt", "log", "log10", "log2", "exp", "sin", "cos", "tan", "asin", "acos", "atan", "floor", "ceil", "factorial")}
+_FUNCTIONS.update(abs=abs, round=round, min=min, max=max)
+_CONSTANTS = {"pi": math.pi, "e": math.e, "tau": math.tau}
+
+
+def _evaluate(node):
+    if isinstance(node, ast.Expression):
+        return _evaluate(node.body)
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+        return node.value
+    if isinstance(node, ast.Name) and node.id in _CONSTANTS:
+        return _CONSTANTS[node.id]
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _OPERATORS:
+        return _OPERATORS[type(node.op)](_evaluate(node.operand))
+    if isinstance(node, ast.BinOp) and type(node.op) in _OPERATORS:
+        left, right = _evaluate(node.left), _evaluate(node.right)
+        if isinstance(node.op, ast.Pow) and (abs(right) > 1000 or isinstance(left, int) and left.bit_length() * abs(right) > 100000):
+            raise ValueError("Result too large")
+        return _OPERATORS[type(node.op)](left, right)
+    if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in _FUNCTIONS
+            and not node.keywords):
+        args = [_evaluate(arg) for arg in node.args]
+        if node.func.id == "factorial" and args and args[0] > 1000:
+            raise ValueError("Argument too large")
+        return _FUNCTIONS[node.func.id](*args)
+    raise ValueError(f"Unsupported expression: {ast.dump(node)[:80]}")
+
+
+def calculator(expression):
+    """Value of an arithmetic expression"""
+    if len(expression) > 500:
+        raise ValueError("Expression too long")
+    return {"expression": expression, "result": _evaluate(ast.parse(expression, mode="eval"))}
+
+
+def search_files(root, query, max_results=10):
+    """Lines containing query in the text files under root"""
+    root = os.path.realpath(root)
+    needle = query.lower()
+    max_results = max(1, min(int(max_results), 50))
+    matches = []
+    for directory, subdirectories, files in os.walk(root):
+        subdirectories[:] = sorted(d for d in subdirectories if not d.startswith("."))
+        for name in sorted(files):
+            path = os.path.join(directory, name)
+            if not os.path.realpath(path).startswith(root + os.sep):
+                continue
+            try:
+                if os.path.getsize(path) > 1024 * 1024:
+                    continue
+                with open(path, encoding="utf-8") as f:
+                    for number, line in enumerate(f, 1):
+                        if needle in line.lower():
+                            matches.append({"path": os.path.relpath(path, root), "line": number, "text": line.strip()[:200]})
+                            if len(matches) >= max_results:
+                                return {"matches": matches, "truncated": True}
+            except (OSError, UnicodeDecodeError):
+                continue
+    return {"matches": matches, "truncated": False}
+
+
+def sql_query(path, timeout, query, max_rows=50):
+    """Rows of a read-only query"""
+    deadline = time.monotonic() + timeout
+    db = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+    try:
+        db.execute("PRAGMA query_only = ON")
+        # The thread cannot be killed, so a query running past the timeout interrupts itself
+        db.set_progress_handler(lambda: time.monotonic() > deadline, 10000)
+        cursor = db.execute(query)
+        max_rows = max(1, min(int(max_rows), 500))
+        rows = cursor.fetchmany(max_rows + 1)
+        columns = [column[0] for column in cursor.description or ()]
+        return {"columns": columns, "rows": [list(row) for row in rows[:max_rows]], "truncated": len(rows) > max_rows}
+    finally:
+        db.close()
+
+
+def builtin_tools(files_root=TOOL_FILES_ROOT, sqlite_path=TOOL_SQLITE_PATH, timeout=TOOL_TIMEOUT_SECONDS):
+    """The built-in tools by name; search_files and sql_query are bound to their root and database, and left out without one"""
+    tools = {
+        "calculator": Tool("calculator", "Evaluate an arithmetic expression exactly, e.g. (1.07 ** 5 - 1) * 100 or sqrt(2) * pi.",
+                           {"type": "object", "properties": {"expression": {"type": "string", "description": "Arithmetic expression"}},
+                            "required": ["expression"]}, calculator, blocking=False),
+    }
+    if files_root:
+        tools["search_files"] = Tool(
+            "search_files", "Search the local knowledge base files for lines containing a phrase.",
+            {"type": "object", "properties": {"query": {"type": "string", "description": "Phrase to look for"},
+                                              "max_results": {"type": "integer", "description": "At most this many lines"}},
+             "required": ["query"]}, functools.partial(search_files, files_root))
+    if sqlite_path:
+        tools["sql_query"] = Tool(
+            "sql_query", "Run a read-only SQL query (SQLite dialect) against the local business database.",
+            {"type": "object", "properties": {"query": {"type": "string", "description": "A single SELECT statement"},
+                                              "max_rows": {"type": "integer", "description": "At most this many rows"}},
+             "required": ["query"]}, functools.partial(sql_query, sqlite_path, timeout))
+    return tools
+
+
+BUILTIN_NAMES = ("calculator", "search_files", "sql_query")
+
+
+def load_tools(spec=TOOLS, files_root=TOOL_FILES_ROOT, sqlite_path=TOOL_SQLITE_PATH):
+    """Registry of the built-in tools named in spec that are configured, or None when there are none"""
+    names = [name.strip() for name in spec.split(",") if name.strip()]
+    unknown = [name for name in names if name not in BUILTIN_NAMES]
+    if unknown:
+        raise ValueError(f"Unknown tools: {', '.join(unknown)}")
+    tools = builtin_tools(files_root, sqlite_path)
+    registry = ToolRegistry(tools[name] for name in names if name in tools)
+    return registry if len(registry) else None
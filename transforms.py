@@ -0,0 +1,381 @@
+"""Streaming post-processing of answers between the completions stream and the UI
+
+Stages see each delta once and hold back only the tail that could still
+become part of a match, so total work stays linear in the length of the
+answer however it is chunked:
+
+* blocklist: redacts listed words or phrases (one per line in
+  TRANSFORM_BLOCKLIST_PATH) with an Aho-Corasick automaton that keeps its
+  state between deltas;
+* pii: redacts e-mail addresses, phone and card numbers with regular
+  expressions run over a sliding window of at most TRANSFORM_PII_WINDOW
+  characters;
+* fences: closes a markdown code fence left open at the end of the answer.
+
+Enable them in order with TRANSFORMS, e.g. TRANSFORMS=pii,blocklist,fences.
+"""
+import os
+import re
+import time
+from contextlib import aclosing
+
+# Stages applied to streamed answers, in order (empty = none)
+TRANSFORMS = os.getenv("TRANSFORMS", "")
+TRANSFORM_BLOCKLIST_PATH = os.getenv("TRANSFORM_BLOCKLIST_PATH", "")
+TRANSFORM_REPLACEMENT = os.getenv("TRANSFORM_REPLACEMENT", "[redacted]")
+# Longest text a PII pattern can match; the window held back while streaming
+TRANSFORM_PII_WINDOW = int(os.getenv("TRANSFORM_PII_WINDOW", "64"))
+# Time a stage may spend on one delta; optional stages over it are skipped for the rest of the answer
+TRANSFORM_STAGE_BUDGET_MS = float(os.getenv("TRANSFORM_STAGE_BUDGET_MS", "2"))
+
+PII_PATTERNS = (
+    r"[A-Za-z0-9._%+-]+@[A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)*\.[A-Za-z]{2,}",
+    r"(?<![\w+])\+?\d(?:[ .-]?\d){8,14}(?![\w])",
+    r"(?<!\w)\d{4}(?:[ -]?\d{4}){2}[ -]?\d{1,7}(?!\w)",
+)
+
+
+class AhoCorasick:
+    """Automaton matching many words at once, case-insensitively
+
+    Built once; each stream keeps only its current state, so a word split
+    across deltas is still found and every character is looked at once.
+    """
+
+    def __init__(self, words):
+        self.goto = [{}]
+        self.fail = [0]
+        # Lengths of the words ending at each state, including those reached through failure links
+        self.output = [()]
+        self.depth = [0]
+        for word in words:
+            state = 0
+            for char in word.lower():
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(())
+                    self.depth.append(self.depth[state] + 1)
+                state = next_state
+            if state:
+                self.output[state] = (self.depth[state],)
+        # Breadth-first, so failure links always point at shallower, already finished states
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for char, child in self.goto[state].items():
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+                queue.append(child)
+        self.max_length = max(self.depth)
+
+    def step(self, state, char):
+        char = char.lower()
+        while state and char not in self.goto[state]:
+            state = self.fail[state]
+        return self.goto[state].get(char, 0)
+
+
+def _is_word(char):
+    return char.isalnum() or char == "_"
+
+
+class StageStats:
+    """Time spent by one stage across all answers"""
+
+    __slots__ = ("calls", "seconds", "max_seconds", "over_budget", "skipped")
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.over_budget = 0
+        self.skipped = 0
+
+
+class Stage:
+    """A streaming transform; start() returns the per-answer state with feed(text) and flush()
+
+    Optional stages may be skipped when they run over budget; required ones
+    (redaction) always run.
+    """
+
+    name = "stage"
+    required = True
+
+    def __init__(self):
+        self.stats = StageStats()
+
+    def start(self):
+        raise NotImplementedError
+
+
+class _KeywordStream:
+    __slots__ = ("stage", "state", "buffer", "offset", "pos", "pending", "previous")
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.state = 0
+        # Characters not emitted yet, from absolute position offset; a redacted span becomes the
+        # replacement at its first index and empty strings after it
+        self.buffer = []
+        self.offset = 0
+        self.pos = 0
+        # Matches waiting for the next character to confirm a word boundary after them
+        self.pending = []
+        self.previous = ""
+
+    def _char_before(self, start):
+        return self.buffer[start - 1 - self.offset] if start > self.offset else self.previous
+
+    def _redact(self, start, end):
+        first = start - self.offset
+        # A match inside one already redacted (e.g. "bar" in "foo bar") adds no second replacement
+        if self.buffer[first]:
+            self.buffer[first] = self.stage.replacement
+        for index in range(first + 1, end - self.offset):
+            self.buffer[index] = ""
+
+    def _confirm(self, next_char):
+        for start, end in self.pending:
+            if not _is_word(next_char):
+                self._redact(start, end)
+        self.pending.clear()
+
+    def feed(self, text):
+        automaton = self.stage.automaton
+        boundaries = self.stage.word_boundaries
+        for char in text:
+            if self.pending:
+                self._confirm(char)
+            self.buffer.append(char)
+            self.pos += 1
+            self.state = automaton.step(self.state, char)
+            for length in automaton.output[self.state]:
+                start = self.pos - length
+                if not boundaries:
+                    self._redact(start, self.pos)
+                elif not _is_word(self._char_before(start)):
+                    self.pending.append((start, self.pos))
+        # Hold back what could still be part of a match, or is waiting for its boundary check
+        keep = automaton.depth[self.state]
+        for start, _ in self.pending:
+            keep = max(keep, self.pos - start)
+        cut = len(self.buffer) - keep
+        if cut <= 0:
+            return ""
+        emitted = "".join(self.buffer[:cut])
+        self.previous = self.buffer[cut - 1] or self.previous
+        del self.buffer[:cut]
+        self.offset += cut
+        return emitted
+
+    def flush(self):
+        self._confirm("")
+        emitted = "".join(self.buffer)
+        self.buffer.clear()
+        return emitted
+
+
+class KeywordRedactor(Stage):
+    """Replaces listed words and phrases, as whole words by default"""
+
+    name = "blocklist"
+
+    def __init__(self, words, replacement=TRANSFORM_REPLACEMENT, word_boundaries=True):
+        super().__init__()
+        self.automaton = AhoCorasick(word for word in words if word)
+        self.replacement = replacement
+        self.word_boundaries = word_boundaries
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        with open(path, encoding="utf-8") as f:
+            return cls([line.strip() for line in f if line.strip() and not line.startswith("#")], **kwargs)
+
+    def start(self):
+        return _KeywordStream(self)
+
+
+class _RegexStream:
+    __slots__ = ("stage", "text", "start")
+
+    def __init__(self, stage):
+        self.stage = stage
+        # A little already-emitted text is kept in front of start so lookbehinds and \b see it
+        self.text = ""
+        self.start = 0
+
+    def _sub(self, final=False):
+        """Redact matches in text[start:] and return the text up to where a match could still grow"""
+        text = self.text
+        cut = len(text) if final else max(self.start, len(text) - self.stage.window)
+        parts = []
+        last = self.start
+        for match in self.stage.pattern.finditer(text, self.start):
+            if not final and match.end() > cut:
+                cut = min(cut, match.start())
+                break
+            parts.append(text[last:match.start()])
+            parts.append(self.stage.replacement)
+            last = match.end()
+        parts.append(text[last:cut])
+        context = max(0, cut - 16)
+        self.text = text[context:]
+        self.start = cut - context
+        return "".join(parts)
+
+    def feed(self, text):
+        self.text += text
+        return self._sub()
+
+    def flush(self):
+        return self._sub(final=True)
+
+
+class RegexRedactor(Stage):
+    """Replaces matches of regular expressions no longer than window characters"""
+
+    name = "pii"
+
+    def __init__(self, patterns=PII_PATTERNS, replacement=TRANSFORM_REPLACEMENT, window=TRANSFORM_PII_WINDOW):
+        super().__init__()
+        self.pattern = re.compile("|".join(f"(?:{p})" for p in patterns))
+        self.replacement = replacement
+        self.window = window
+
+    def start(self):
+        return _RegexStream(self)
+
+
+class _FenceStream:
+    __slots__ = ("open", "line")
+
+    def __init__(self):
+        self.open = False
+        # Start of the current line while it could still be a fence marker, else None
+        self.line = ""
+
+    def feed(self, text):
+        for char in text:
+            if char == "\n":
+                self.line = ""
+            elif self.line is not None:
+                self.line += char
+                marker = self.line.lstrip()
+                if marker.startswith("```"):
+                    self.open = not self.open
+                    self.line = None
+                elif not "```".startswith(marker):
+                    self.line = None
+        return text
+
+    def flush(self):
+        if not self.open:
+            return ""
+        return "```" if self.line == "" else "\n```"
+
+
+class FenceRepair(Stage):
+    """Closes a code fence the answer left open, so the rest of the chat is not rendered as code"""
+
+    name = "fences"
+    required = False
+
+    def start(self):
+        return _FenceStream()
+
+
+class TransformPipeline:
+    """Runs stages over a delta stream, timing each against its budget"""
+
+    def __init__(self, stages, budget=TRANSFORM_STAGE_BUDGET_MS / 1000):
+        self.stages = stages
+        self.budget = budget
+
+    async def run(self, deltas):
+        """Transformed deltas; closing this closes the upstream iterator"""
+        streams = [stage.start() for stage in self.stages]
+        active = [True] * len(self.stages)
+
+        def apply(index, text, final=False):
+            for i in range(index, len(self.stages)):
+                if not active[i]:
+                    continue
+                stage = self.stages[i]
+                started = time.perf_counter()
+                text = streams[i].feed(text) if text else ""
+                if final:
+                    text += streams[i].flush()
+                elapsed = time.perf_counter() - started
+                stats = stage.stats
+                stats.calls += 1
+                stats.seconds += elapsed
+                stats.max_seconds = max(stats.max_seconds, elapsed)
+                if elapsed > self.budget:
+                    stats.over_budget += 1
+                    if not stage.required and not final:
+                        # Pass through from now on, after releasing what the stage held back
+                        stats.skipped += 1
+                        active[i] = False
+                        text += streams[i].flush()
+            return text
+
+        async with aclosing(deltas):
+            async for delta in deltas:
+                text = apply(0, delta)
+                if text:
+                    yield text
+        tail = apply(0, "", final=True)
+        if tail:
+            yield tail
+
+    def stats(self):
+        return {
+            stage.name: {
+                "calls": stage.stats.calls,
+                "seconds": stage.stats.seconds,
+                "max_seconds": stage.stats.max_seconds,
+                "over_budget": stage.stats.over_budget,
+                "skipped": stage.stats.skipped,
+            }
+            for stage in self.stages
+        }
+
+    def export(self):
+        """Prometheus text lines for per-stage time and budget overruns"""
+        lines = []
+        for name, help_text, kind, field in (
+            ("chat_transform_calls_total", "Deltas processed per transform stage", "counter", "calls"),
+            ("chat_transform_seconds_total", "Time spent per transform stage", "counter", "seconds"),
+            ("chat_transform_max_seconds", "Slowest delta per transform stage", "gauge", "max_seconds"),
+            ("chat_transform_over_budget_total", "Deltas over the stage budget", "counter", "over_budget"),
+            ("chat_transform_skipped_total", "Answers an optional stage was skipped for", "counter", "skipped"),
+        ):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            for stage, values in self.stats().items():
+                lines.append(f'{name}{{stage="{stage}"}} {values[field]:.6g}')
+        return lines
+
+
+def create_stage(name):
+    if name == "pii":
+        return RegexRedactor()
+    if name == "blocklist":
+        if not TRANSFORM_BLOCKLIST_PATH:
+            raise ValueError("The blocklist transform needs TRANSFORM_BLOCKLIST_PATH")
+        return KeywordRedactor.from_file(TRANSFORM_BLOCKLIST_PATH)
+    if name == "fences":
+        return FenceRepair()
+    raise ValueError(f"Unknown transform {name!r}")
+
+
+def load_pipeline(spec=TRANSFORMS):
+    """The pipeline configured by TRANSFORMS, or None when no stages are enabled"""
+    names = [name.strip() for name in spec.split(",") if name.strip()]
+    return TransformPipeline([create_stage(name) for name in names]) if names else None